@@ -121,6 +121,151 @@ bool isAuthorizedCard() {
   return true;
 }
 
+// ---------------------------------------------------------------------------
+// Card record decoder (mirror of CardRecord in Issuing Station/rfid_handler.py)
+//
+// The issuing station writes one 16-byte record into block 8 (sector 2,
+// key A = FF FF FF FF FF FF). Multi-byte fields are big-endian:
+//   [0]      0x80 | version << 4 | roll digit count
+//   [1..5]   roll number, 40-bit integer
+//   [6..7]   permission bitmask, bit n-1 = machine ID n
+//   [8..11]  session ID, 32 bits
+//   [12..14] issue time, minutes since 2024-01-01 00:00 UTC
+//   [15]     CRC-8 (poly 0x07, init 0x00) over bytes 0..14
+// Version 2 records (machine IDs above 16) continue in blocks 9 and 10:
+//   [0] extension block count, [1..14] bits for the next 112 machines
+//   (little-endian), [15] CRC-8 over bytes 0..14
+// A block whose first byte has bit 7 clear is a legacy ASCII card (roll in
+// block 8, '0'/'1' machine flags in block 9) and is not decoded here.
+// ---------------------------------------------------------------------------
+#define RECORD_BLOCK   8
+#define RECORD_VERSION 1
+#define RECORD_VERSION_EXTENDED 2
+#define RECORD_EPOCH   1704067200UL
+
+struct CardRecord {
+  uint8_t  version;
+  uint8_t  rollDigits;
+  uint64_t rollNumber;
+  uint16_t permissions;
+  uint32_t sessionId;
+  uint32_t issuedAt;  // Unix seconds
+};
+
+uint8_t recordCrc8(const byte *data, byte len) {
+  uint8_t crc = 0;
+  for (byte i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (byte b = 0; b < 8; b++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+// Returns true and fills rec if block holds a valid v1 record
+bool decodeCardRecord(const byte *block, CardRecord &rec) {
+  if (!(block[0] & 0x80)) return false;                       // legacy ASCII layout
+  byte version = (block[0] >> 4) & 0x07;
+  if (version != RECORD_VERSION && version != RECORD_VERSION_EXTENDED) return false;
+  if (recordCrc8(block, 15) != block[15]) return false;
+
+  rec.version = version;
+  rec.rollDigits = block[0] & 0x0F;
+  rec.rollNumber = 0;
+  for (byte i = 1; i <= 5; i++) rec.rollNumber = (rec.rollNumber << 8) | block[i];
+  rec.permissions = ((uint16_t)block[6] << 8) | block[7];
+  rec.sessionId = ((uint32_t)block[8] << 24) | ((uint32_t)block[9] << 16) |
+                  ((uint32_t)block[10] << 8) | block[11];
+  uint32_t minutes = ((uint32_t)block[12] << 16) | ((uint32_t)block[13] << 8) | block[14];
+  rec.issuedAt = RECORD_EPOCH + minutes * 60UL;
+  return true;
+}
+
+bool hasMachineAccess(const CardRecord &rec, byte machineId) {
+  return machineId >= 1 && machineId <= 16 && (rec.permissions >> (machineId - 1)) & 1;
+}
+
+// Machine IDs 17-128 live in the first extension block (block 9, version 2 only)
+bool hasExtendedAccess(const byte *ext, byte machineId) {
+  if (machineId <= 16 || machineId > 128) return false;
+  if (recordCrc8(ext, 15) != ext[15]) return false;
+  byte bit = machineId - 17;
+  return (ext[1 + bit / 8] >> (bit % 8)) & 1;
+}
+
+// One authentication and one block read after PICC_ReadCardSerial()
+bool readCardRecord(CardRecord &rec) {
+  MFRC522::MIFARE_Key key;
+  for (byte i = 0; i < 6; i++) key.keyByte[i] = 0xFF;
+  byte buffer[18];
+  byte size = sizeof(buffer);
+  bool ok = rfid.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, RECORD_BLOCK, &key, &rfid.uid) == MFRC522::STATUS_OK
+         && rfid.MIFARE_Read(RECORD_BLOCK, buffer, &size) == MFRC522::STATUS_OK
+         && decodeCardRecord(buffer, rec);
+  rfid.PCD_StopCrypto1();
+  return ok;
+}
+
+// ---------------------------------------------------------------------------
+// Usage credits (mirror of credit_blocks() in Issuing Station/rfid_handler.py)
+//
+// Metered machines get a MIFARE value block each in the sectors listed in the
+// station's CREDIT_SECTORS; CREDIT_BLOCKS below must match it. Value block:
+//   [0..3] balance (int32, little-endian), [4..7] inverted, [8..11] balance,
+//   [12] machine ID, [13] inverted, [14] machine ID, [15] inverted
+// A debit is one decrement + transfer on the card, no server round trip; the
+// node reports {card_id, session_id, machine_id, amount, balance} to the
+// station's POST /api/credits/debits when it can, for the ledger.
+// The station locks the credit sectors: key A (below) may only read and
+// decrement; increments need key B, which stays on the station.
+// ---------------------------------------------------------------------------
+const byte CREDIT_BLOCKS[] = {12, 13, 14};  // CREDIT_SECTORS=3
+const byte CREDIT_BLOCK_COUNT = sizeof(CREDIT_BLOCKS);
+// Must equal the station's CREDIT_KEY_A; set it before flashing (not kept in the repo)
+const byte CREDIT_KEY_A[6] = {0x00, 0x00, 0x00, 0x00, 0x00, 0x00};
+
+bool decodeValueBlock(const byte *block, int32_t &value, byte &addr) {
+  for (byte i = 0; i < 4; i++) {
+    if (block[i] != block[8 + i] || (byte)(block[i] ^ block[4 + i]) != 0xFF) return false;
+  }
+  if (block[12] != block[14] || block[13] != block[15] || (byte)(block[12] ^ block[13]) != 0xFF) return false;
+  value = (int32_t)((uint32_t)block[0] | ((uint32_t)block[1] << 8) | ((uint32_t)block[2] << 16) | ((uint32_t)block[3] << 24));
+  addr = block[12];
+  return true;
+}
+
+// Takes amount off machineId's credits after PICC_ReadCardSerial(). False (and the card
+// untouched) if the card has no credits for the machine or not enough left.
+bool debitCredit(byte machineId, int32_t amount, int32_t &balance) {
+  MFRC522::MIFARE_Key key;
+  for (byte i = 0; i < 6; i++) key.keyByte[i] = CREDIT_KEY_A[i];
+  byte buffer[18];
+  bool ok = false;
+  byte authSector = 0xFF;
+  for (byte i = 0; i < CREDIT_BLOCK_COUNT && !ok; i++) {
+    byte block = CREDIT_BLOCKS[i];
+    if (block / 4 != authSector) {
+      if (rfid.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, block, &key, &rfid.uid) != MFRC522::STATUS_OK) break;
+      authSector = block / 4;
+    }
+    byte size = sizeof(buffer);
+    int32_t value;
+    byte addr;
+    if (rfid.MIFARE_Read(block, buffer, &size) != MFRC522::STATUS_OK) break;
+    if (!decodeValueBlock(buffer, value, addr) || addr != machineId) continue;
+    if (value < amount) {
+      balance = value;
+      break;
+    }
+    ok = rfid.MIFARE_Decrement(block, amount) == MFRC522::STATUS_OK
+      && rfid.MIFARE_Transfer(block) == MFRC522::STATUS_OK;
+    balance = ok ? value - amount : value;
+  }
+  rfid.PCD_StopCrypto1();
+  return ok;
+}
+
 void handleRfidDetection() {
   bool cardDetected = false;
   
@@ -1,268 +1,435 @@
-from flask import Flask, render_template, request, jsonify
+# HTTP layer of the issuing station. It holds no hardware and no single-writer state:
+# readers, dispenser, write queue and background jobs live in the hardware daemon,
+# reached through a pooled Unix socket client, so any number of workers can serve it.
+#   python app.py                               (development: daemon in-process, one server)
+#   python hardware_daemon.py & gunicorn 'app:create_app()'     (production)
+from flask import Flask, Response, g, render_template, request, jsonify
 from flask_cors import CORS
-import threading
+import argparse
+import os
+import tempfile
 import time
 import traceback
-from firebase_config import get_user_by_roll
-from models import hash_pin, verify_pin
-from rfid_handler import RFIDHandler
-
-app = Flask(__name__)
-CORS(app)
-
-# Initialize RFID handler
-rfid = RFIDHandler()  
-current_card_id = None
-card_detection_active = False
-detection_lock = threading.Lock()
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/api/card_status')
-def card_status():
-    """Check if card is detected"""
-    global current_card_id
-    try:
-        # Only check for card when not continuously polling
-        with detection_lock:
-            card_id = rfid.detect_card()
-            if card_id != current_card_id:
-                current_card_id = card_id
-                if card_id:
-                    print(f"New card detected: {card_id}")
-                else:
-                    print("Card removed")
-            
-            return jsonify({
-                'detected': bool(current_card_id),
-                'card_id': current_card_id
-            })
-    except Exception as e:
-        print(f"Card status error: {e}")
-        return jsonify({'detected': False, 'error': str(e)})
-
-@app.route('/api/start_detection')
-def start_detection():
-    """Start active card detection for card writing"""
-    global card_detection_active
-    card_detection_active = True
-    return jsonify({'status': 'Detection started'})
-
-@app.route('/api/stop_detection') 
-def stop_detection():
-    """Stop active card detection"""
-    global card_detection_active
-    card_detection_active = False
-    return jsonify({'status': 'Detection stopped'})
-
-@app.route('/api/check_user', methods=['POST'])
-def check_user():
-    """Check if user exists in database"""
-    try:
-        data = request.json
-        roll_number = data.get('roll_number')
-        
-        if not roll_number:
-            return jsonify({'exists': False, 'error': 'Roll number required'})
-        
-        user = get_user_by_roll(roll_number)
-        if user:
-            return jsonify({
-                'exists': True,
-                'has_pin': bool(user.get('pin_hash')),
-                'user_data': {
-                    'name': user.get('name', ''),
-                    'branch': user.get('branch', ''),
-                    'year': user.get('year', '')
-                }
-            })
-        else:
-            return jsonify({'exists': False})
+from config import Config
+from enroll import roster_digest
+from hardware_client import HardwareBusy, HardwareClient, HardwareError
+import metrics
+from machine_registry import get_registry
+from models import PinHasher, PinHasherBusy
+from startup import NotReady, Startup
+from user_replica import UserLookupUnavailable
+
+HTTP_SECONDS = metrics.histogram('http_request_duration_seconds', "Request latency per route", ['route', 'method'])
+HTTP_REQUESTS = metrics.counter('http_requests_total', "Requests per route and status", ['route', 'method', 'status'])
+
+def _start_firestore():
+    # Imported here, not at module level: the credential load and client setup run in
+    # the background, and a pre-forking server does not share gRPC channels across workers.
+    # No network here: lookups are served from the replica while Firestore is unreachable.
+    import firebase_config
+    return firebase_config
+
+def create_app(hardware=None):
+    """WSGI application; hardware is the daemon client (a pooled HardwareClient by default)
+
+    Returns at once: the Firestore client and the daemon connection come up in
+    the background, so the kiosk page is served while they start. Routes that
+    need one wait up to STARTUP_WAIT and answer 503 if it is not up yet.
+    """
+    app = Flask(__name__)
+    CORS(app)
+    hardware = hardware or HardwareClient()
+    machines = get_registry()
+    pin_hasher = PinHasher()
+    startup = Startup()
+    startup.add('firestore', _start_firestore, retry=Config.STARTUP_RETRY)
+    # Sets up the gRPC channel before the first read-through; a kiosk booted offline stays usable
+    startup.add('firestore_warm_up', lambda: startup.get('firestore', timeout=None).warm_up(),
+                retry=Config.STARTUP_RETRY, gating=False)
+    startup.add('hardware_daemon', lambda: hardware.call('ping'), retry=1)
+    startup.start()
+
+    def users():
+        """firebase_config once the Firestore client is up"""
+        return startup.get('firestore', timeout=Config.STARTUP_WAIT)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # The route pattern, not the path, so lane IDs and job IDs do not add series
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_SECONDS.observe(time.perf_counter() - started, route, request.method)
+            HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        return response
+
+    @app.errorhandler(HardwareError)
+    def hardware_error(e):
+        """Unknown lanes and jobs (404), a busy reader or no daemon (503)"""
+        body = {'success': False, 'error': str(e)}
+        if isinstance(e, HardwareBusy):
+            body['busy'] = True
+        return jsonify(body), e.status
+
+    @app.errorhandler(NotReady)
+    def not_ready(e):
+        return jsonify({'success': False, 'starting': True, 'error': str(e)}), 503
+
+    @app.errorhandler(UserLookupUnavailable)
+    def user_lookup_unavailable(e):
+        """User not in the replica while Firestore is down: worth retrying, unlike a 404"""
+        return jsonify({'success': False, 'unavailable': True, 'error': str(e)}), 503
+
+    @app.route('/healthz')
+    def healthz():
+        """Liveness: this worker is serving; startup state of what it depends on"""
+        return jsonify({'status': 'ok', 'startup': startup.status()})
+
+    @app.route('/readyz')
+    def readyz():
+        """Readiness: the Firestore client and the daemon's readers and journal are up (503 until then)"""
+        try:
+            daemon = hardware.call('ping')
+        except HardwareError as e:
+            daemon = {'ready': False, 'error': str(e)}
+        ready = startup.ready() and daemon.get('ready', False)
+        return jsonify({'ready': ready, 'worker': startup.status(), 'daemon': daemon}), 200 if ready else 503
+
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    @app.route('/api/lanes')
+    def list_lanes():
+        """Configured lanes with their card, polling and reader state, and shared-bus counters"""
+        return jsonify(hardware.call('lanes'))
+
+    @app.route('/api/card_status', defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/card_status')
+    def card_status(lane_id):
+        """Card currently in the field, as last seen by the card monitor (no SPI traffic)"""
+        return jsonify(hardware.call('card_status', lane=lane_id))
+
+    @app.route('/api/events', defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/events')
+    def card_event_stream(lane_id):
+        """Server-Sent Events: card_arrived / card_removed as the card monitor sees them"""
+        return Response(hardware.stream('events', lane=lane_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/start_detection', defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/start_detection')
+    def start_detection(lane_id):
+        """UI is waiting for a card: poll at the fastest interval (lease renewed by each call)"""
+        return jsonify({'status': 'Detection started', 'polling': hardware.call('start_detection', lane=lane_id)})
+
+    @app.route('/api/stop_detection', defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/stop_detection')
+    def stop_detection(lane_id):
+        """UI left the card screen: polling backs off once the activity window passes"""
+        return jsonify({'status': 'Detection stopped', 'polling': hardware.call('stop_detection', lane=lane_id)})
+
+    @app.route('/api/polling', defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/polling')
+    def polling_status(lane_id):
+        """Current poll interval and mode, polls per minute and antenna duty cycle"""
+        return jsonify(hardware.call('polling', lane=lane_id))
+
+    @app.route('/api/check_user', methods=['POST'])
+    def check_user():
+        """Check if user exists in database"""
+        get_user_by_roll = users().get_user_by_roll
+        try:
+            data = request.json
+            roll_number = data.get('roll_number')
             
-    except Exception as e:
-        print(f"Check user error: {e}")
-        traceback.print_exc()
-        return jsonify({'exists': False, 'error': str(e)})
-
-@app.route('/api/verify_pin', methods=['POST'])
-def verify_pin_route():
-    """Verify user PIN"""
-    try:
-        data = request.json
-        roll_number = data.get('roll_number')
-        pin = data.get('pin')
-        
-        if not roll_number or not pin:
-            return jsonify({'valid': False, 'error': 'Roll number and PIN required'})
-        
-        user = get_user_by_roll(roll_number)
-        if user and user.get('pin_hash') and verify_pin(pin, user.get('pin_hash')):
-            return jsonify({
-                'valid': True,
-                'user_data': {
-                    'name': user.get('name', ''),
-                    'branch': user.get('branch', ''),
-                    'year': user.get('year', ''),
-                    'accessible_machines': user.get('accessible_machines', [])
-                }
-            })
-        else:
-            return jsonify({'valid': False, 'error': 'Invalid PIN'})
+            if not roll_number:
+                return jsonify({'exists': False, 'error': 'Roll number required'})
             
-    except Exception as e:
-        print(f"Verify PIN error: {e}")
-        traceback.print_exc()
-        return jsonify({'valid': False, 'error': str(e)})
-
-@app.route('/api/write_card', methods=['POST'])
-def write_card():
-    """Write data to RFID card with enhanced debugging"""
-    global current_card_id
-    try:
-        data = request.json
-        roll_number = data.get('roll_number')
-        
-        print(f"Write card request for roll: {roll_number}")
-        
-        if not roll_number:
-            return jsonify({'success': False, 'error': 'Roll number required'})
-        
-        # Check card presence multiple times
-        with detection_lock:
-            card_present = False
-            for attempt in range(3):
-                if rfid.is_card_present():
-                    card_present = True
-                    break
-                time.sleep(0.3)
+            user = get_user_by_roll(roll_number)
+            if user:
+                return jsonify({
+                    'exists': True,
+                    'has_pin': bool(user.get('pin_hash')),
+                    'user_data': {
+                        'name': user.get('name', ''),
+                        'branch': user.get('branch', ''),
+                        'year': user.get('year', '')
+                    }
+                })
+            else:
+                return jsonify({'exists': False})
                 
-            if not card_present:
-                return jsonify({'success': False, 'error': 'No card detected. Please place card on reader.'})
+        except UserLookupUnavailable:
+            raise
+        except Exception as e:
+            print(f"Check user error: {e}")
+            traceback.print_exc()
+            return jsonify({'exists': False, 'error': str(e)})
+
+    @app.route('/api/verify_pin', methods=['POST'])
+    def verify_pin_route():
+        """Verify user PIN"""
+        get_user_by_roll = users().get_user_by_roll
+        try:
+            data = request.json
+            roll_number = data.get('roll_number')
+            pin = data.get('pin')
             
-            current_card_id = rfid.detect_card()
-            if not current_card_id:
-                return jsonify({'success': False, 'error': 'Unable to read card ID'})
-        
-        # Get user data
-        user = get_user_by_roll(roll_number)
-        if not user:
-            return jsonify({'success': False, 'error': 'User not found'})
-        
-        # FIX: Proper machine ID mapping
-        accessible_machines = user.get('accessible_machines', [])
-        machine_flags = '0' * 16
-        
-        # Define machine name to ID mapping
-        machine_id_map = {
-            '3D Printer': 1,
-            'Laser Cutter': 2,
-            'CNC Machine': 3,
-            'PCB Mill': 4,
-            'Soldering Station': 5,
-            # Add more as needed
-        }
-        
-        print(f"Accessible machines: {accessible_machines}")
-        
-        for machine in accessible_machines:
-            try:
-                if isinstance(machine, str):
-                    machine_id = machine_id_map.get(machine)
-                else:
-                    machine_id = int(machine)
-                
-                if machine_id and 1 <= machine_id <= 16:
-                    bit_position = machine_id - 1
-                    machine_flags = machine_flags[:bit_position] + '1' + machine_flags[bit_position+1:]
-                    print(f"Set bit {bit_position} for machine {machine}")
-                    
-            except (ValueError, TypeError) as e:
-                print(f"Error processing machine {machine}: {e}")
-                continue
-        
-        print(f"Final machine flags: {machine_flags}")
-        
-        # Write to card
-        success, message = rfid.write_card(roll_number, machine_flags)
-        
-        if success:
-            # Update database
-            try:
-                from firebase_config import db
-                user_ref = db.collection('users').document(roll_number)
-                user_ref.update({
-                    'card_id': str(current_card_id),
-                    'card_written_at': time.time()
+            if not roll_number or not pin:
+                return jsonify({'valid': False, 'error': 'Roll number and PIN required'})
+            
+            user = get_user_by_roll(roll_number)
+            valid = False
+            if user and user.get('pin_hash'):
+                valid, upgraded_hash = pin_hasher.verify(pin, user.get('pin_hash'))
+                if upgraded_hash:
+                    # Legacy/outdated hash: store the current KDF format in the background.
+                    # Best effort: the PIN is already verified, the upgrade is retried next login.
+                    try:
+                        hardware.call('queue_update', roll_number=roll_number, fields={'pin_hash': upgraded_hash})
+                    except Exception as e:
+                        print(f"PIN hash upgrade for {roll_number} not queued: {e}")
+            if valid:
+                return jsonify({
+                    'valid': True,
+                    'user_data': {
+                        'name': user.get('name', ''),
+                        'branch': user.get('branch', ''),
+                        'year': user.get('year', ''),
+                        'accessible_machines': user.get('accessible_machines', [])
+                    }
                 })
-            except Exception as db_error:
-                print(f"Database update error: {db_error}")
+            else:
+                return jsonify({'valid': False, 'error': 'Invalid PIN'})
+                
+        except PinHasherBusy as e:
+            return jsonify({'valid': False, 'busy': True, 'error': str(e)}), 503
+        except UserLookupUnavailable:
+            raise
+        except Exception as e:
+            print(f"Verify PIN error: {e}")
+            traceback.print_exc()
+            return jsonify({'valid': False, 'error': str(e)})
+
+    @app.route('/api/write_card', methods=['POST'], defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/write_card', methods=['POST'])
+    def write_card(lane_id):
+        """Write data to RFID card with enhanced debugging"""
+        get_user_by_roll = users().get_user_by_roll
+        try:
+            data = request.json
+            roll_number = data.get('roll_number')
+            
+            print(f"Write card request for roll: {roll_number} (lane {lane_id})")
+            
+            if not roll_number:
+                return jsonify({'success': False, 'error': 'Roll number required'})
+            
+            # Get user data (cache/replica) before claiming the reader
+            user = get_user_by_roll(roll_number)
+            if not user:
+                return jsonify({'success': False, 'error': 'User not found'})
+            
+            accessible_machines = user.get('accessible_machines', [])
+            print(f"Accessible machines: {accessible_machines}")
+            permissions = machines.mask_for(accessible_machines)
+            print(f"Permission mask: {permissions:#x} ({', '.join(machines.names_for(permissions)) or 'none'})")
+            credits = machines.credits_for(permissions, user.get('credits'))
+            if credits:
+                print(f"Credits: {credits}")
+            
+            # The daemon claims the reader at write priority and journals the card ID and credits
+            result = hardware.call('write_card', lane=lane_id, roll_number=roll_number, permissions=permissions,
+                                   credits={str(machine_id): amount for machine_id, amount in credits.items()},
+                                   timeout=Config.READER_WRITE_TIMEOUT)
+            if not result['success']:
+                return jsonify(result)
             
             return jsonify({
                 'success': True, 
                 'message': 'Card written successfully',
-                'card_id': current_card_id
+                'card_id': result['card_id'],
+                'lane': lane_id
             })
-        else:
-            return jsonify({'success': False, 'error': f'Failed to write card: {message}'})
             
-    except Exception as e:
-        print(f"Write card error: {e}")
-        traceback.print_exc()
-        return jsonify({'success': False, 'error': str(e)})
-    
-@app.route('/api/read_card', methods=['GET'])
-def read_card():
-    """Read current card data"""
-    try:
-        with detection_lock:
-            card_data = rfid.read_card()
+        except (HardwareError, UserLookupUnavailable):
+            raise
+        except Exception as e:
+            print(f"Write card error: {e}")
+            traceback.print_exc()
+            return jsonify({'success': False, 'error': str(e)})
+        
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Counters and latency histograms in the Prometheus text format"""
+        # Hardware, write queue and daemon-side Firestore series come from the daemon;
+        # this worker's own series carry its pid, since each worker counts separately
+        try:
+            daemon_families = hardware.call('metrics')
+        except HardwareError as e:
+            print(f"Daemon metrics unavailable: {e}")
+            daemon_families = []
+        return Response(metrics.render(daemon_families, const_labels={'worker': str(os.getpid())}),
+                        mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/machines')
+    def list_machines():
+        """Machine registry (ID, name) as used for card permissions"""
+        return jsonify({'machines': machines.to_list(), 'version': machines.version})
+
+    @app.route('/api/user_cache')
+    def user_cache_stats():
+        """User cache size and hit/miss counters"""
+        return jsonify(users().user_cache.stats())
+
+    @app.route('/api/replica')
+    def replica_status():
+        """Local user replica row count, listener state and lag"""
+        return jsonify(hardware.call('replica'))
+
+    @app.route('/api/reader', defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/reader')
+    def reader_status(lane_id):
+        """Reader command queue depth, wait and service times per priority"""
+        return jsonify(hardware.call('reader', lane=lane_id))
+
+    @app.route('/api/pin_hasher')
+    def pin_hasher_status():
+        """PIN KDF pool occupancy and counters"""
+        return jsonify(pin_hasher.status())
+
+    @app.route('/api/write_queue')
+    def write_queue_status():
+        """Pending post-issuance updates, commit and retry counters"""
+        return jsonify(hardware.call('write_queue'))
+
+    @app.route('/api/enroll', methods=['POST'])
+    def start_enrollment():
+        """Bulk-enroll from an uploaded CSV/JSONL roster (form field 'roster'); runs in the background"""
+        try:
+            upload = request.files.get('roster')
+            if not upload or not upload.filename:
+                return jsonify({'success': False, 'error': 'Roster file required'})
+            fmt = 'jsonl' if upload.filename.endswith(('.jsonl', '.json')) else 'csv'
+
+            # Store by content so a re-upload of the same roster can resume its progress file
+            os.makedirs(Config.ENROLL_UPLOAD_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=Config.ENROLL_UPLOAD_DIR)
+            with os.fdopen(fd, 'wb') as f:
+                upload.save(f)
+            path = os.path.join(Config.ENROLL_UPLOAD_DIR, f"{roster_digest(tmp_path)}.{fmt}")
+            os.replace(tmp_path, path)
+
+            flag = lambda name: request.form.get(name, '').lower() in ('1', 'true', 'yes')
+            # The job runs in the daemon, so its progress is visible from every worker
+            job_id = hardware.call('enroll_start', path=path, fmt=fmt, dry_run=flag('dry_run'),
+                                   reset_pins=flag('reset_pins'), resume=flag('resume'))
+            return jsonify({'success': True, 'job_id': job_id})
+        except Exception as e:
+            print(f"Enrollment error: {e}")
+            traceback.print_exc()
+            return jsonify({'success': False, 'error': str(e)})
+
+    @app.route('/api/enroll/<job_id>')
+    def enrollment_status(job_id):
+        """Progress, users/sec and (for dry runs) the diff of an enrollment job"""
+        return jsonify(dict(hardware.call('enroll_status', job_id=job_id), success=True))
+
+    @app.route('/api/batch_issue', methods=['POST'])
+    def start_batch_issue():
+        """Issue cards for a list of roll numbers through the card dispenser on one lane; runs in the background"""
+        try:
+            data = request.json or {}
+            roll_numbers = data.get('roll_numbers') or []
+            if not roll_numbers:
+                return jsonify({'success': False, 'error': 'Roll numbers required'})
+            job_id = hardware.call('batch_start', roll_numbers=roll_numbers, lane=int(data.get('lane', 0)))
+            return jsonify({'success': True, 'job_id': job_id})
+        except HardwareError:
+            raise
+        except Exception as e:
+            print(f"Batch issue error: {e}")
+            traceback.print_exc()
+            return jsonify({'success': False, 'error': str(e)})
+
+    @app.route('/api/batch_issue/<job_id>')
+    def batch_issue_status(job_id):
+        """Issued/rejected/failed counts, cards per minute and per-step timings of a batch"""
+        return jsonify(dict(hardware.call('batch_status', job_id=job_id), success=True))
+
+    @app.route('/api/batch_issue/<job_id>/stop', methods=['POST'])
+    def stop_batch_issue(job_id):
+        """Stop after the current card; the rest is reported as remaining"""
+        hardware.call('batch_stop', job_id=job_id)
+        return jsonify({'success': True})
+
+    @app.route('/api/read_credits', methods=['GET'], defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/read_credits', methods=['GET'])
+    def read_credits(lane_id):
+        """Usage credits left on the card, per machine"""
+        card_data = hardware.call('read_credits', lane=lane_id, timeout=Config.READER_READ_TIMEOUT)
+        if not card_data:
+            return jsonify({'success': False, 'error': 'No card detected'})
+        credits = sorted((int(machine_id), balance) for machine_id, balance in card_data['credits'].items())
+        # Value blocks from a foreign card can carry any address byte; only list machine IDs
+        card_data['credits'] = [{'machine_id': machine_id, 'machine': machines.name_for(machine_id),
+                                 'unit': machines.credit_unit(machine_id), 'balance': balance}
+                                for machine_id, balance in credits if machines.name_for(machine_id)]
+        return jsonify({'success': True, 'data': card_data})
+
+    @app.route('/api/credits/debits', methods=['POST'])
+    def record_debits():
+        """Debits access nodes took off cards offline: {"debits": [{card_id, session_id,
+        machine_id, amount, balance, at, node}, ...]}; resending a batch is harmless"""
+        debits = (request.json or {}).get('debits')
+        if not isinstance(debits, list):
+            return jsonify({'success': False, 'error': 'debits list required'}), 400
+        return jsonify({'success': True, 'recorded': hardware.call('record_debits', debits=debits)})
+
+    @app.route('/api/read_card', methods=['GET'], defaults={'lane_id': 0})
+    @app.route('/api/lanes/<int:lane_id>/read_card', methods=['GET'])
+    def read_card(lane_id):
+        """Read current card data"""
+        try:
+            card_data = hardware.call('read_card', lane=lane_id, timeout=Config.READER_READ_TIMEOUT)
             if card_data:
                 return jsonify({'success': True, 'data': card_data})
             else:
                 return jsonify({'success': False, 'error': 'No card detected or read failed'})
-    except Exception as e:
-        print(f"Read card error: {e}")
-        return jsonify({'success': False, 'error': str(e)})
-
-# Controlled card detection thread - only runs when needed
-def controlled_card_detection():
-    global current_card_id, card_detection_active
-    last_card_id = None
-    
-    while True:
-        try:
-            if card_detection_active:
-                with detection_lock:
-                    card_id = rfid.detect_card()
-                    if card_id != last_card_id:
-                        current_card_id = card_id
-                        last_card_id = card_id
-                        if card_id:
-                            print(f"Card detected in active mode: {card_id}")
-                        else:
-                            print("Card removed in active mode")
-            
-            time.sleep(0.5)  # Check every 500ms instead of continuous polling
-            
+        except HardwareError:
+            raise
         except Exception as e:
-            print(f"Detection thread error: {e}")
-            time.sleep(1)
+            print(f"Read card error: {e}")
+            return jsonify({'success': False, 'error': str(e)})
+
+    return app
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Development server")
+    parser.add_argument('--no-daemon', action='store_true',
+                        help="use a hardware daemon already running (python hardware_daemon.py)")
+    args = parser.parse_args()
+    daemon = None
     try:
-        # Start controlled card detection
-        detection_thread = threading.Thread(target=controlled_card_detection)
-        detection_thread.daemon = True
-        detection_thread.start()
+        if not args.no_daemon:
+            from hardware_daemon import HardwareDaemon
+            daemon = HardwareDaemon()
+            daemon.start()
         
         print("RFID Card Station starting...")
         print("Access the interface at: http://localhost:5000")
         
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        # The reloader would start a second daemon; only allowed against an external one
+        create_app().run(host='0.0.0.0', port=5000, debug=Config.FLASK_DEBUG, threaded=True,
+                         use_reloader=Config.FLASK_DEBUG and args.no_daemon)
         
     except KeyboardInterrupt:
         print("Shutting down...")
     finally:
-        rfid.cleanup()
\ No newline at end of file
+        if daemon is not None:
+            daemon.stop()
@@ -0,0 +1,405 @@
+# Batch card issuance through the ESP32 card dispenser (dispenser_code.ino)
+#   python batch_issue.py rolls.txt --port /dev/ttyUSB0
+#   python batch_issue.py rolls.txt --sim          (fake dispenser + simulated reader)
+#
+# rolls.txt: one roll number per line. The reader antenna sits at the sensor-1 stop:
+# each card is fed there, written and verified, then sent out with the EJECT command.
+# Run it with the station app stopped (or use POST /api/batch_issue), since both
+# would otherwise drive the same reader.
+import argparse
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from machine_registry import get_registry
+from reader_actor import PRIORITY_WRITE, ReaderActor
+from rfid_handler import CardRecord, RFIDHandler
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+# Firmware messages (by prefix) -> dispenser events
+DISPENSER_EVENTS = (
+    ('Card detected by sensor 1', 'staged'),
+    ('Card detected by sensor 2', 'dispensed'),
+    ('Ready for next card', 'ready'),
+    ('Card Dispenser System Initialized', 'ready'),
+    ('Emergency stop', 'stopped'),
+)
+
+class DispenserError(Exception):
+    """The dispenser did not report the expected sensor event in time"""
+
+class Dispenser:
+    """Serial link to the card dispenser: DISPENSE/EJECT commands, sensor events back"""
+
+    def __init__(self, port=None, baudrate=None, device=None, boot_wait=2.0):
+        if device is None:
+            if serial is None:
+                raise RuntimeError("pyserial not available; install it or use the fake dispenser")
+            # Opening the port resets the ESP32; it announces itself once booted
+            device = serial.Serial(port or Config.DISPENSER_PORT, baudrate or Config.DISPENSER_BAUDRATE, timeout=0.1)
+        self.device = device
+        self.events = queue.Queue()
+        self.running = True
+        self.busy = False       # a card was ejected and the firmware has not reported ready yet
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+        try:
+            self.wait_for('ready', boot_wait)
+        except DispenserError:
+            pass    # already running (no reset on open): assume idle
+
+    def _read_loop(self):
+        while self.running:
+            try:
+                line = self.device.readline()
+            except Exception as e:
+                print(f"Dispenser serial error: {e}")
+                self.events.put('error')
+                return
+            if not line:
+                continue
+            text = line.decode(errors='replace').strip()
+            for prefix, event in DISPENSER_EVENTS:
+                if text.startswith(prefix):
+                    self.events.put(event)
+                    break
+
+    def command(self, command):
+        self.device.write((command + '\n').encode())
+
+    def wait_for(self, event, timeout):
+        """Block until the firmware reports event; other events on the way are dropped"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DispenserError(f"Dispenser did not report '{event}' within {timeout} s")
+            try:
+                got = self.events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if got == event:
+                return
+            if got in ('error', 'stopped'):
+                raise DispenserError(f"Dispenser {got} while waiting for '{event}'")
+
+    def dispense(self, timeout=None):
+        """Feed the next card from the stack to the reader (sensor 1)"""
+        timeout = timeout or Config.DISPENSER_TIMEOUT
+        if self.busy:
+            # The firmware drops commands until it is back in IDLE
+            self.wait_for('ready', timeout)
+            self.busy = False
+        self.command('DISPENSE')
+        self.wait_for('staged', timeout)
+
+    def eject(self, timeout=None):
+        """Move the card at the reader out through sensor 2"""
+        self.command('EJECT')
+        self.wait_for('dispensed', timeout or Config.DISPENSER_TIMEOUT)
+        self.busy = True
+
+    def close(self):
+        self.running = False
+        self.thread.join(1)
+        self.device.close()
+
+def make_dispenser(sim_transport=None):
+    """Dispenser on Config.DISPENSER_PORT, or the fake one feeding blank cards to a simulated reader"""
+    if Config.DISPENSER_PORT == 'sim':
+        from dispenser_sim import FakeDispenserSerial
+        device = FakeDispenserSerial(on_staged=getattr(sim_transport, 'place_card', None),
+                                     on_removed=getattr(sim_transport, 'remove_card', None))
+        return Dispenser(device=device)
+    return Dispenser()
+
+def write_staged(rfid, record, blocks, wait=0.5):
+    """Reader command: wait for the fed card to answer, then write and verify the prepared record"""
+    deadline = time.monotonic() + wait
+    card_id = rfid.poll_card()
+    while not card_id and time.monotonic() < deadline:
+        time.sleep(0.02)    # card still sliding into place
+        card_id = rfid.poll_card()
+    if not card_id:
+        return False, 'No card at the reader', None
+    success, message = rfid.write_record(record, blocks)
+    return success, message, card_id
+
+class BatchStats:
+    def __init__(self, total):
+        self.lock = threading.Lock()
+        self.total = total
+        self.issued = 0
+        self.rejected = 0       # cards that failed write/verify and were set aside
+        self.failed = []        # roll numbers given up on after retries
+        self.skipped = []       # roll numbers that could not be staged (unknown user etc.)
+        self.unused = 0         # blank cards fed but not needed
+        self.unrecorded = []    # issued, but the card_id/grants could not be journaled
+        self.results = []
+        self.timings = collections.defaultdict(list)
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def cards_per_minute(self):
+        return self.issued / self.elapsed * 60 if self.elapsed > 0 else 0.0
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'total': self.total,
+                'issued': self.issued,
+                'rejected': self.rejected,
+                'failed': list(self.failed),
+                'skipped': list(self.skipped),
+                'unused': self.unused,
+                'unrecorded': list(self.unrecorded),
+                'results': list(self.results[-100:]),
+                'avg_ms': {step: round(sum(t) / len(t) * 1000, 1) for step, t in self.timings.items() if t},
+                'error': self.error,
+                'elapsed': round(self.elapsed, 2),
+                'cards_per_minute': round(self.cards_per_minute, 1),
+                'done': self.finished is not None,
+            }
+
+class BatchIssuer:
+    """Issue cards for a queue of roll numbers, one dispensed card at a time
+
+    Payloads (user lookup, permission mask, packed CardRecord) are prepared up to
+    `lookahead` roll numbers ahead on a thread pool, so the Firestore round trips
+    for the next cards overlap the feed and RF write of the current one. A card that fails
+    to write or verify is still ejected but counted as rejected, and its roll
+    number goes to the back of the queue with a fresh payload (up to max_retries).
+    """
+
+    def __init__(self, rolls, dispenser, reader, lookup=None, record_issue=None,
+                 lookahead=None, max_retries=None, registry=None, record_grants=None):
+        if lookup is None or record_issue is None:
+            from firebase_config import get_user_by_roll, queue_user_update, start_sync
+            start_sync()
+            lookup = lookup or get_user_by_roll
+            record_issue = record_issue or queue_user_update
+        self.todo = collections.deque((str(roll).strip(), 0) for roll in rolls if str(roll).strip())
+        self.dispenser = dispenser
+        self.reader = reader
+        self.lookup = lookup
+        self.record_issue = record_issue
+        self.record_grants = record_grants
+        self.lookahead = lookahead if lookahead is not None else Config.BATCH_LOOKAHEAD
+        self.max_retries = max_retries if max_retries is not None else Config.BATCH_MAX_RETRIES
+        self.registry = registry or get_registry()
+        self.stats = BatchStats(len(self.todo))
+        self.stopped = False
+
+    def _stage(self, roll_number):
+        """(record, blocks, credits) ready to write for one roll number; raises LookupError for unknown users"""
+        user = self.lookup(roll_number)
+        if not user:
+            raise LookupError(f"User {roll_number} not found")
+        record = CardRecord.new(roll_number, self.registry.mask_for(user.get('accessible_machines', [])))
+        credits = self.registry.credits_for(record.permissions, user.get('credits'))
+        if not self.reader.rfid.CREDIT_BLOCKS:
+            credits = {}
+        return record, self.reader.rfid.record_blocks(record, credits), credits
+
+    def _timed(self, step, fn, *args, **kwargs):
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.stats.timings[step].append(time.monotonic() - start)
+
+    def _result(self, roll_number, status, message, card_id=None, attempt=0):
+        with self.stats.lock:
+            self.stats.results.append({'roll_number': roll_number, 'status': status, 'message': message,
+                                       'card_id': card_id, 'attempt': attempt + 1})
+
+    def _halt(self, error):
+        # Jam or empty stack: stop, the rest of the queue is reported as not issued
+        self.stats.error = str(error)
+        print(f"Batch issue stopped: {error}")
+
+    def _write(self, roll_number, record, blocks, credits):
+        try:
+            success, message, card_id = self._timed(
+                'write', self.reader.call, write_staged, record, blocks,
+                priority=PRIORITY_WRITE, timeout=Config.READER_WRITE_TIMEOUT)
+        except Exception as e:
+            return False, f"Write error: {e}", None
+        if success:
+            message = self._record(roll_number, record, credits, card_id, message)
+        return success, message, card_id
+
+    def _record(self, roll_number, record, credits, card_id, message):
+        """Journal a card that is written. A failure here must not reject the card: it is
+        valid, so it is reported as issued (and listed as unrecorded) rather than reissued."""
+        try:
+            # Journaled locally; committed to Firestore by the write queue
+            self.record_issue(roll_number, {'card_id': str(card_id), 'card_written_at': time.time()})
+            if credits:
+                if self.record_grants is None:
+                    from credit_ledger import queue_grants
+                    self.record_grants = queue_grants
+                self.record_grants(card_id, roll_number, record.session_id, credits)
+        except Exception as e:
+            print(f"Card {card_id} for {roll_number} written but not recorded: {e}")
+            with self.stats.lock:
+                self.stats.unrecorded.append(roll_number)
+            return f"{message}; not recorded: {e}"
+        return message
+
+    def run(self):
+        staged = collections.deque()    # (roll_number, attempt, future), in issue order
+        card_at_reader = False
+        with ThreadPoolExecutor(max_workers=max(1, self.lookahead)) as pool:
+            while not self.stopped:
+                # The card being issued plus `lookahead` more in preparation
+                while self.todo and len(staged) <= self.lookahead:
+                    roll_number, attempt = self.todo.popleft()
+                    staged.append((roll_number, attempt, pool.submit(self._stage, roll_number)))
+                if not staged:
+                    break
+                if not card_at_reader:
+                    # Feed first: the lookup for this card runs while the card travels
+                    try:
+                        self._timed('dispense', self.dispenser.dispense)
+                    except DispenserError as e:
+                        self._halt(e)
+                        break
+                    card_at_reader = True
+
+                roll_number, attempt, future = staged.popleft()
+                try:
+                    record, blocks, credits = self._timed('stage_wait', future.result)
+                except Exception as e:
+                    # The fed card stays at the reader for the next roll number
+                    with self.stats.lock:
+                        self.stats.skipped.append(roll_number)
+                    self._result(roll_number, 'skipped', str(e), attempt=attempt)
+                    continue
+
+                success, message, card_id = self._write(roll_number, record, blocks, credits)
+                with self.stats.lock:
+                    if success:
+                        self.stats.issued += 1
+                    else:
+                        self.stats.rejected += 1
+                if success:
+                    self._result(roll_number, 'issued', message, card_id, attempt)
+                elif attempt < self.max_retries:
+                    # Divert: this card goes out as a reject, the roll number gets a fresh card later
+                    self._result(roll_number, 'rejected', message, card_id, attempt)
+                    self.todo.append((roll_number, attempt + 1))
+                else:
+                    with self.stats.lock:
+                        self.stats.failed.append(roll_number)
+                    self._result(roll_number, 'failed', message, card_id, attempt)
+
+                try:
+                    self._timed('eject', self.dispenser.eject)
+                except DispenserError as e:
+                    self._halt(e)
+                    break
+                card_at_reader = False
+
+            for roll_number, attempt, future in reversed(staged):
+                future.cancel()
+                self.todo.appendleft((roll_number, attempt))
+        if card_at_reader and not self.stats.error:
+            # Fed for a roll number that could not be staged; leaves blank
+            try:
+                self.dispenser.eject()
+                self.stats.unused += 1
+            except DispenserError as e:
+                self._halt(e)
+        self.stats.finished = time.monotonic()
+        return self.stats
+
+    def remaining(self):
+        """Roll numbers not issued yet (after a stop or dispenser error)"""
+        return [roll for roll, _ in self.todo]
+
+    def stop(self):
+        self.stopped = True
+
+class BatchIssueJob(threading.Thread):
+    """Batch issuance run in the background for the API; poll .status()"""
+
+    def __init__(self, job_id, issuer):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.issuer = issuer
+        self.error = None
+
+    def run(self):
+        try:
+            self.issuer.run()
+        except Exception as e:
+            print(f"Batch issue job {self.job_id} error: {e}")
+            self.error = str(e)
+            self.issuer.stats.finished = time.monotonic()
+
+    def status(self):
+        status = self.issuer.stats.to_dict()
+        status.update({'job_id': self.job_id, 'remaining': self.issuer.remaining()})
+        if self.error:
+            status.update({'done': True, 'error': self.error})
+        return status
+
+def print_report(stats, remaining=()):
+    print(f"Batch issue: {stats.issued}/{stats.total} issued, {stats.rejected} cards rejected, "
+          f"{len(stats.failed)} failed, {len(stats.skipped)} skipped, {stats.unused} unused")
+    for result in stats.results:
+        if result['status'] != 'issued':
+            print(f"  ! {result['roll_number']} ({result['status']}, attempt {result['attempt']}): {result['message']}")
+    if stats.unrecorded:
+        print(f"  issued but not recorded (update card_id by hand): {', '.join(stats.unrecorded)}")
+    if remaining:
+        print(f"  not issued: {', '.join(remaining)}")
+    if stats.error:
+        print(f"  stopped: {stats.error}")
+    steps = ', '.join(f"{step} {sum(t) / len(t) * 1000:.0f} ms" for step, t in stats.timings.items() if t)
+    print(f"{stats.cards_per_minute:.1f} cards/min over {stats.elapsed:.1f} s (avg {steps})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Issue cards for a list of roll numbers through the card dispenser")
+    parser.add_argument('rolls', help="file with one roll number per line")
+    parser.add_argument('--port', help=f"dispenser serial port (default {Config.DISPENSER_PORT})")
+    parser.add_argument('--sim', action='store_true', help="fake dispenser and simulated reader")
+    parser.add_argument('--lookahead', type=int, help="roll numbers staged ahead of the current card")
+    parser.add_argument('--retries', type=int, help="fresh cards tried per roll number after a failed write")
+    args = parser.parse_args()
+
+    with open(args.rolls) as f:
+        rolls = [line.strip() for line in f if line.strip()]
+    if args.sim:
+        Config.RFID_BACKEND = 'sim'
+        Config.DISPENSER_PORT = 'sim'
+    rfid = RFIDHandler()
+    reader = ReaderActor(rfid)
+    reader.start()
+    dispenser = make_dispenser(rfid.mfrc.spi) if args.sim or not args.port else Dispenser(port=args.port)
+    issuer = BatchIssuer(rolls, dispenser, reader, lookahead=args.lookahead, max_retries=args.retries)
+    try:
+        issuer.run()
+    except KeyboardInterrupt:
+        issuer.stats.finished = time.monotonic()
+    finally:
+        print_report(issuer.stats, issuer.remaining())
+        dispenser.close()
+        reader.stop()
+
+if __name__ == '__main__':
+    main()
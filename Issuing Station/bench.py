@@ -0,0 +1,316 @@
+# Off-hardware benchmarks for the issuing station, driven through the MFRC522 simulator
+#   python bench.py card --iterations 5
+#   python bench.py card --realtime      (wait for modelled RF/timer time like real hardware)
+#   python bench.py card --realtime --spi-latency 40
+#   python bench.py crc --blocks 50
+#   python bench.py poll --polls 200
+#   python bench.py kdf --sessions 8      (run on the Pi to pick PIN_SCRYPT_N / iterations)
+#   python bench.py lanes --lanes 1,2,3 --cards 20
+#   python bench.py dispense --cards 20 --lookup-ms 80 --slow-every 4 --slow-ms 3000
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+from batch_issue import BatchIssuer, Dispenser, print_report
+from dispenser_sim import FakeDispenserSerial
+from mfrc522_sim import MFRC522Simulator, MifareClassic1K
+from config import Config
+from machine_registry import get_registry
+from models import PinHasher, PinHasherBusy, _pbkdf2, _scrypt, hash_pin
+from reader_actor import ReaderActor
+from rfid_handler import MFRC522, BusTransport, RFIDHandler, SharedBus, machines_to_mask
+
+def measure(sim, fn, *args, quiet=True):
+    """Run fn once and return (result, wall seconds, SPI transactions, modelled RF seconds)"""
+    start_tx = sim.transactions
+    start_air = sim.air_time
+    sink = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+    start = time.perf_counter()
+    with sink:
+        result = fn(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed, sim.transactions - start_tx, sim.air_time - start_air
+
+def report(title, rows):
+    """Print mean wall time, SPI transactions and RF time per operation"""
+    print(title)
+    print(f"  {'operation':<14}{'ok':>6}{'wall ms':>12}{'spi xfers':>12}{'rf ms':>10}")
+    for name, samples in rows.items():
+        if not samples:
+            continue
+        n = len(samples)
+        ok = sum(1 for s in samples if s[0])
+        wall = sum(s[1] for s in samples) / n * 1000
+        xfers = sum(s[2] for s in samples) / n
+        air = sum(s[3] for s in samples) / n * 1000
+        print(f"  {name:<14}{ok:>3}/{n:<2}{wall:>12.1f}{xfers:>12.0f}{air:>10.2f}")
+
+def report_ops(mfrc):
+    """Print SPI transactions per MFRC522 driver operation (inclusive of nested calls)"""
+    print("Driver operations")
+    print(f"  {'operation':<20}{'calls':>8}{'spi xfers/call':>16}")
+    for name, (calls, xfers) in sorted(mfrc.op_stats.items()):
+        print(f"  {name:<20}{calls:>8}{xfers / calls:>16.1f}")
+
+def bench_card(iterations, realtime=False, spi_latency=0.0, quiet=True):
+    """write_card, then read_card from the card and again from the record cache, on a fresh card per iteration"""
+    sim = MFRC522Simulator(realtime=realtime, spi_latency=spi_latency)
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        handler = RFIDHandler(transport=sim)
+    handler.mfrc.op_stats.clear()
+    flags = machines_to_mask(['3D Printer', 'Laser Cutter'])
+    rows = {'write_card': [], 'read_card': [], 'read_cached': []}
+
+    for _ in range(iterations):
+        sim.place_card(MifareClassic1K())
+        result, *stats = measure(sim, handler.write_card, '240003021', flags, quiet=quiet)
+        rows['write_card'].append([result[0]] + stats)
+        handler.records.clear()     # as if the card came from another station
+        result, *stats = measure(sim, handler.read_card, quiet=quiet)
+        rows['read_card'].append([bool(result) and 'error' not in result] + stats)
+        result, *stats = measure(sim, handler.read_card, quiet=quiet)
+        rows['read_cached'].append([bool(result) and result.get('cached')] + stats)
+
+    report(f"Card operations ({'realtime' if realtime else 'instant'} simulator, {iterations} cards)", rows)
+    report_ops(handler.mfrc)
+    return rows
+
+def bench_crc(blocks, spi_latency=30e-6):
+    """Authenticated block write + read-back per CRC mode, on the realtime simulator"""
+    print(f"CRC_A per block write+read ({blocks} blocks, {spi_latency * 1e6:.0f} us/transfer)")
+    print(f"  {'crc mode':<12}{'spi xfers':>12}{'wall ms':>10}")
+    results = {}
+    for mode in ('hardware', 'software'):
+        sim = MFRC522Simulator(card=MifareClassic1K(), realtime=True, spi_latency=spi_latency)
+        with contextlib.redirect_stdout(io.StringIO()):
+            mfrc = MFRC522(transport=sim, crc_mode=mode)
+            mfrc.MFRC522_Init()
+            mfrc.MFRC522_Request(mfrc.PICC_REQIDL)
+            _, uid = mfrc.MFRC522_Anticoll()
+            mfrc.MFRC522_SelectTag(uid)
+            mfrc.MFRC522_Auth(mfrc.PICC_AUTHENT1A, 8, [0xFF] * 6, uid)
+
+        start_tx = sim.transactions
+        start = time.perf_counter()
+        for i in range(blocks):
+            data = [(i + b) & 0xFF for b in range(16)]
+            mfrc.MFRC522_Write(8, data)
+            if mfrc.MFRC522_Read(8) != data:
+                print(f"  {mode}: read-back mismatch on block {i}")
+        elapsed = time.perf_counter() - start
+        results[mode] = ((sim.transactions - start_tx) / blocks, elapsed / blocks * 1000)
+        print(f"  {mode:<12}{results[mode][0]:>12.1f}{results[mode][1]:>10.2f}")
+
+    saved_tx = results['hardware'][0] - results['software'][0]
+    saved_ms = results['hardware'][1] - results['software'][1]
+    print(f"  saved per block: {saved_tx:.1f} SPI round trips, {saved_ms:.2f} ms")
+    return results
+
+def bench_poll(polls, spi_latency=30e-6):
+    """Empty-field REQA cost with IRQ-line completion vs register polling"""
+    print(f"Empty-field REQA ({polls} polls, realtime simulator, {spi_latency * 1e6:.0f} us/transfer)")
+    print(f"  {'completion':<12}{'wall ms':>10}{'cpu ms':>10}{'spi xfers':>12}")
+    for irq in (True, False):
+        sim = MFRC522Simulator(realtime=True, spi_latency=spi_latency, irq=irq)
+        mfrc = MFRC522(transport=sim)
+        mfrc.MFRC522_Init()
+        start_tx = sim.transactions
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        for _ in range(polls):
+            mfrc.MFRC522_Request(mfrc.PICC_REQIDL)
+        wall = (time.perf_counter() - start) / polls * 1000
+        cpu = (time.process_time() - start_cpu) / polls * 1000
+        xfers = (sim.transactions - start_tx) / polls
+        print(f"  {'irq' if irq else 'polling':<12}{wall:>10.2f}{cpu:>10.2f}{xfers:>12.1f}")
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def bench_kdf(sessions, rounds=3):
+    """Single-hash cost per KDF setting, then concurrent verifies through the PinHasher pool"""
+    print("PIN KDF cost (one hash, this machine)")
+    print(f"  {'setting':<28}{'ms':>8}")
+    salt = b'0' * 16
+    settings = [(f"scrypt n={n} r=8 p=1", lambda n=n: _scrypt('1234', salt, n, 8, 1)) for n in (4096, 8192, 16384, 32768)]
+    settings += [(f"pbkdf2_sha256 {i}", lambda i=i: _pbkdf2('1234', salt, i)) for i in (50000, 100000, 200000, 400000)]
+    for name, fn in settings:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        print(f"  {name:<28}{(time.perf_counter() - start) / rounds * 1000:>8.1f}")
+
+    hasher = PinHasher()
+    stored = hash_pin('1234')
+    print(f"Concurrent verify_pin ({sessions} sessions, {Config.PIN_KDF}, "
+          f"{hasher.workers} workers, capacity {hasher.capacity})")
+    latencies = []
+    busy = []
+
+    def session():
+        start = time.perf_counter()
+        try:
+            hasher.verify('1234', stored)
+            latencies.append(time.perf_counter() - start)
+        except PinHasherBusy:
+            busy.append(1)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    if latencies:
+        print(f"  p50 {percentile(latencies, 50) * 1000:.1f} ms  p95 {percentile(latencies, 95) * 1000:.1f} ms  "
+              f"max {max(latencies) * 1000:.1f} ms  busy {len(busy)}  wall {wall * 1000:.1f} ms")
+    else:
+        print(f"  all {len(busy)} sessions rejected as busy")
+
+def bench_lanes(lane_counts, cards, spi_latency=30e-6):
+    """Concurrent write_card on N readers sharing one SPI bus: aggregate and per-lane throughput"""
+    print(f"Issuance throughput per lane count ({cards} cards per lane, realtime simulator, "
+          f"{spi_latency * 1e6:.0f} us/transfer, one shared bus)")
+    print(f"  {'lanes':<7}{'cards/s':>9}{'per lane':>10}{'slowest':>9}{'fastest':>9}{'contended':>11}{'bus wait us':>13}")
+    flags = machines_to_mask(['3D Printer', 'Laser Cutter'])
+    results = {}
+    for count in lane_counts:
+        bus = SharedBus(0)
+        sims = [MFRC522Simulator(realtime=True, spi_latency=spi_latency) for _ in range(count)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            handlers = [RFIDHandler(transport=BusTransport(sim, bus) if count > 1 else sim) for sim in sims]
+        rates = [0.0] * count
+        failures = []
+
+        def lane(i):
+            start = time.perf_counter()
+            for _ in range(cards):
+                sims[i].place_card(MifareClassic1K())
+                success, _ = handlers[i].write_card('240003021', flags)
+                if not success:
+                    failures.append(i)
+            rates[i] = cards / (time.perf_counter() - start)
+
+        threads = [threading.Thread(target=lane, args=(i,)) for i in range(count)]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        total = count * cards / (time.perf_counter() - start)
+        stats = bus.status()
+        results[count] = total
+        print(f"  {count:<7}{total:>9.1f}{total / count:>10.1f}{min(rates):>9.1f}{max(rates):>9.1f}"
+              f"{stats['contended'] / max(1, stats['transfers']):>10.0%}{stats['avg_wait_us']:>13.1f}")
+        if failures:
+            print(f"    {len(failures)} writes failed")
+    base = results.get(lane_counts[0])
+    if base:
+        print("  scaling vs first row: " + ", ".join(f"{n} lanes x{results[n] / base:.2f}" for n in lane_counts))
+    return results
+
+def bench_dispense(cards, lookup_ms=80.0, bad_every=0, feed=0.4, transport=0.4, ready=1.0, lookaheads=(0, 4),
+                   slow_every=4, slow_ms=3000.0):
+    """Batch issuance through the fake dispenser and realtime simulator, with and without lookahead
+
+    Even without lookahead the current card's lookup overlaps its own feed, so a fast
+    lookup costs nothing either way. Lookahead pays off when lookups outlast a feed:
+    every slow_every-th one takes slow_ms (a replica miss read through to Firestore).
+    """
+    print(f"Batch issuance ({cards} cards, lookup {lookup_ms:.0f} ms"
+          f"{f', every {slow_every}th {slow_ms:.0f} ms' if slow_every else ''}, feed {feed} s, "
+          f"transport {transport} s, ready {ready} s{f', every {bad_every}th card unwritable' if bad_every else ''})")
+    registry = get_registry()
+    results = {}
+    for lookahead in lookaheads:
+        sim = MFRC522Simulator(realtime=True, spi_latency=30e-6)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rfid = RFIDHandler(transport=sim)
+        reader = ReaderActor(rfid)
+        reader.start()
+        fed = [0]
+
+        def staged():
+            fed[0] += 1
+            # A card keyed differently fails authentication, i.e. a bad card to divert
+            bad = bad_every and fed[0] % bad_every == 0
+            sim.place_card(MifareClassic1K(key_a=[0x01] * 6, key_b=[0x01] * 6) if bad else MifareClassic1K())
+
+        def lookup(roll_number):
+            slow = slow_every and int(roll_number) % slow_every == slow_every - 1
+            time.sleep((slow_ms if slow else lookup_ms) / 1000)
+            return {'roll_number': roll_number, 'accessible_machines': ['3D Printer', 'Laser Cutter']}
+
+        device = FakeDispenserSerial(feed_time=feed, transport_time=transport, ready_delay=ready,
+                                     on_staged=staged, on_removed=sim.remove_card)
+        dispenser = Dispenser(device=device)
+        issuer = BatchIssuer([str(240000000 + i) for i in range(cards)], dispenser, reader, lookup=lookup,
+                             record_issue=lambda roll_number, fields: None, lookahead=lookahead, registry=registry)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = issuer.run()
+        print(f"  lookahead {lookahead}:")
+        print_report(stats, issuer.remaining())
+        results[lookahead] = stats.cards_per_minute
+        dispenser.close()
+        reader.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Issuing station benchmarks (simulated reader)")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    card = sub.add_parser('card', help="write_card/read_card wall time and SPI transactions")
+    card.add_argument('--iterations', type=int, default=5)
+    card.add_argument('--realtime', action='store_true', help="model RF and timer latency")
+    card.add_argument('--spi-latency', type=float, default=30.0, help="per-transfer cost in us (realtime only)")
+    card.add_argument('--verbose', action='store_true', help="show driver output")
+
+    crc = sub.add_parser('crc', help="software vs on-chip CRC_A cost per block")
+    crc.add_argument('--blocks', type=int, default=50)
+    crc.add_argument('--spi-latency', type=float, default=30.0, help="per-transfer cost in us")
+
+    poll = sub.add_parser('poll', help="empty-field REQA latency and CPU, IRQ vs polling")
+    poll.add_argument('--polls', type=int, default=200)
+    poll.add_argument('--spi-latency', type=float, default=30.0, help="per-transfer cost in us")
+
+    kdf = sub.add_parser('kdf', help="PIN KDF cost per setting and concurrent verify latency")
+    kdf.add_argument('--sessions', type=int, default=8, help="simultaneous verify_pin calls")
+
+    lanes = sub.add_parser('lanes', help="aggregate issuance throughput with N readers on one SPI bus")
+    lanes.add_argument('--lanes', default='1,2,3', help="comma separated lane counts")
+    lanes.add_argument('--cards', type=int, default=20, help="cards written per lane")
+    lanes.add_argument('--spi-latency', type=float, default=30.0, help="per-transfer cost in us")
+
+    dispense = sub.add_parser('dispense', help="batch issuance cards/min through the fake dispenser")
+    dispense.add_argument('--cards', type=int, default=20)
+    dispense.add_argument('--lookup-ms', type=float, default=80.0, help="simulated Firestore lookup latency")
+    dispense.add_argument('--slow-every', type=int, default=4, help="make every Nth lookup slow (0: none)")
+    dispense.add_argument('--slow-ms', type=float, default=3000.0, help="latency of a slow (read-through) lookup")
+    dispense.add_argument('--bad-every', type=int, default=0, help="make every Nth card unwritable")
+    dispense.add_argument('--feed', type=float, default=0.4, help="seconds from DISPENSE to sensor 1")
+    dispense.add_argument('--transport', type=float, default=0.4, help="seconds from EJECT to sensor 2")
+    dispense.add_argument('--ready', type=float, default=1.0, help="firmware pause before the next card")
+
+    args = parser.parse_args()
+    if args.bench == 'card':
+        spi_latency = args.spi_latency / 1e6 if args.realtime else 0.0
+        bench_card(args.iterations, realtime=args.realtime, spi_latency=spi_latency, quiet=not args.verbose)
+    elif args.bench == 'crc':
+        bench_crc(args.blocks, spi_latency=args.spi_latency / 1e6)
+    elif args.bench == 'poll':
+        bench_poll(args.polls, spi_latency=args.spi_latency / 1e6)
+    elif args.bench == 'kdf':
+        bench_kdf(args.sessions)
+    elif args.bench == 'dispense':
+        bench_dispense(args.cards, args.lookup_ms, args.bad_every, args.feed, args.transport, args.ready,
+                       slow_every=args.slow_every, slow_ms=args.slow_ms)
+    elif args.bench == 'lanes':
+        bench_lanes([int(n) for n in args.lanes.split(',')], args.cards, spi_latency=args.spi_latency / 1e6)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+from config import Config
+
+class CardEvents:
+    """Fan-out of card-arrived/card-removed events to any number of subscribers"""
+
+    def __init__(self, max_backlog=16):
+        self.max_backlog = max_backlog
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.card_id = None
+        self.changed_at = time.time()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        """New subscriber queue, primed with the current state"""
+        q = queue.Queue(maxsize=self.max_backlog)
+        with self.lock:
+            q.put_nowait(self._state_event())
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def _state_event(self):
+        return {'type': 'card_present' if self.card_id else 'card_absent',
+                'card_id': self.card_id, 'at': self.changed_at}
+
+    def publish(self, card_id):
+        """Record the card now in the field and notify subscribers if it changed"""
+        with self.lock:
+            if card_id == self.card_id:
+                return
+            event = {'type': 'card_arrived' if card_id else 'card_removed',
+                     'card_id': card_id or self.card_id, 'at': time.time()}
+            self.card_id = card_id
+            self.changed_at = event['at']
+            self.published += 1
+            for q in self.subscribers:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    # A stalled browser must not hold up the others; it loses its oldest event
+                    self.dropped += 1
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+                    q.put_nowait(event)
+
+    def stream(self, keepalive=15):
+        """Server-Sent Events generator for one client"""
+        q = self.subscribe()
+        try:
+            while True:
+                try:
+                    event = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: card\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+    def status(self):
+        with self.lock:
+            return {'card_id': self.card_id, 'subscribers': len(self.subscribers),
+                    'published': self.published, 'dropped': self.dropped}
+
+class PollScheduler:
+    """Presence-poll interval: fast while someone is at the kiosk, exponential backoff when idle"""
+
+    def __init__(self, min_interval=None, max_interval=None, backoff=None,
+                 active_window=None, attentive_window=None):
+        self.min_interval = min_interval or Config.CARD_POLL_MIN_INTERVAL
+        self.max_interval = max_interval or Config.CARD_POLL_MAX_INTERVAL
+        self.backoff = backoff or Config.CARD_POLL_BACKOFF
+        # Stay fast this long after the last card or UI activity
+        self.active_window = active_window if active_window is not None else Config.CARD_POLL_ACTIVE_WINDOW
+        # The UI's "waiting for a card" request expires unless renewed
+        self.attentive_window = attentive_window if attentive_window is not None else Config.CARD_POLL_ATTENTIVE_WINDOW
+        self.interval = self.min_interval
+        self.last_activity = time.monotonic()
+        self.attentive_until = 0.0
+        self.wake = threading.Event()
+
+    def note_activity(self):
+        self.last_activity = time.monotonic()
+
+    def set_attentive(self, attentive):
+        """UI is (or is no longer) on the screen waiting for a card"""
+        self.attentive_until = time.monotonic() + self.attentive_window if attentive else 0.0
+        if attentive:
+            self.interval = self.min_interval
+            self.wake.set()
+
+    def mode(self):
+        now = time.monotonic()
+        if now < self.attentive_until:
+            return 'attentive'
+        if now - self.last_activity < self.active_window:
+            return 'active'
+        return 'idle'
+
+    def next_interval(self, card_present):
+        """Interval before the next poll, given what this poll saw"""
+        if card_present:
+            self.note_activity()
+        if card_present or self.mode() != 'idle':
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+    def sleep(self, interval):
+        """Wait for the next poll; an attentive request cuts the wait short"""
+        self.wake.wait(interval)
+        self.wake.clear()
+
+    def status(self):
+        return {
+            'mode': self.mode(),
+            'interval': round(self.interval, 3),
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
+            'backoff': self.backoff,
+            'active_window': self.active_window,
+            'attentive_window': self.attentive_window,
+        }
+
+class CardMonitor(threading.Thread):
+    """The one loop that probes the reader for cards; everything else reads its state"""
+
+    def __init__(self, reader, events, scheduler=None, remove_misses=None):
+        super().__init__(daemon=True)
+        self.reader = reader
+        self.events = events
+        self.scheduler = scheduler or PollScheduler()
+        # Consecutive empty probes before a card counts as removed (one can be a bad frame)
+        self.remove_misses = remove_misses or Config.CARD_REMOVE_MISSES
+        self.polls = 0
+        self.running = True
+        self.started = time.monotonic()
+
+    def run(self):
+        misses = 0
+        while self.running:
+            card_id = None
+            try:
+                # The field is switched off between polls unless a card is present
+                card_id = self.reader.poll_card(power_down=True).result(timeout=5)
+                self.polls += 1
+                if card_id:
+                    misses = 0
+                    self.events.publish(card_id)
+                elif self.events.card_id:
+                    misses += 1
+                    if misses >= self.remove_misses:
+                        self.events.publish(None)
+            except TimeoutError:
+                pass    # the reader was busy with a write/read; probe again next round
+            except Exception as e:
+                print(f"Card monitor error: {e}")
+                time.sleep(1)
+            self.scheduler.sleep(self.scheduler.next_interval(bool(card_id or self.events.card_id)))
+
+    def stop(self):
+        self.running = False
+        self.scheduler.wake.set()
+
+    def status(self):
+        elapsed = time.monotonic() - self.started
+        mfrc = self.reader.rfid.mfrc
+        return dict(self.scheduler.status(), polls=self.polls,
+                    polls_per_minute=round(self.polls / elapsed * 60, 1) if elapsed else 0.0,
+                    antenna_on=mfrc.antenna_on_since is not None,
+                    antenna_duty=round(mfrc.antenna_time() / elapsed, 4) if elapsed else 0.0,
+                    antenna_switches=mfrc.antenna_switches)
@@ -1,7 +1,91 @@
 import os
+import tempfile
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key'
     FIREBASE_CREDENTIALS = 'path/to/serviceAccountKey.json'
     RFID_PORT = '/dev/ttyUSB0'  # Adjust for your RFID reader
-    RFID_BAUDRATE = 9600
\ No newline at end of file
+    RFID_BAUDRATE = 9600
+    RFID_BACKEND = os.environ.get('RFID_BACKEND') or 'spi'  # 'spi' on the Pi, 'sim' for the simulator
+    RFID_CRC_MODE = os.environ.get('RFID_CRC_MODE') or 'software'  # 'software', 'hardware' or 'check'
+    # BCM pin wired to the MFRC522 IRQ output (e.g. 24); unset polls registers instead.
+    # Only set it where the line is wired: an unconnected IRQ pin waits out every command.
+    RFID_IRQ_PIN = os.environ.get('RFID_IRQ_PIN', '')
+    RFID_IRQ_PIN = int(RFID_IRQ_PIN) if RFID_IRQ_PIN else None
+    # Issuing lanes, one MFRC522 each, as 'bus:device:rst_pin[:irq_pin]' separated by commas,
+    # e.g. '0:0:25:24,0:1:23:22' for two readers on SPI0 CE0/CE1. Default: the single reader above.
+    RFID_LANES = os.environ.get('RFID_LANES') or f"0:0:25:{RFID_IRQ_PIN if RFID_IRQ_PIN is not None else ''}"
+    # SPI trace of every reader transfer for offline replay (spi_trace.py); empty disables it.
+    # With several lanes each one writes <path>.lane<N>.
+    RFID_TRACE_PATH = os.environ.get('RFID_TRACE_PATH') or ''
+    RFID_TRACE_MAX_BYTES = int(os.environ.get('RFID_TRACE_MAX_BYTES', str(4 * 1024 * 1024)))  # per file before rotating
+    RFID_TRACE_FILES = int(os.environ.get('RFID_TRACE_FILES', '4'))  # rotated files kept
+    RFID_TRACE_BUFFER = int(os.environ.get('RFID_TRACE_BUFFER', '65536'))  # records held for the writer before dropping
+    # Usage credits for metered machines: one MIFARE value block per machine in these sectors
+    # (3 per sector, e.g. '3,4' for 6 machines), decremented offline by the access nodes.
+    # Empty disables credits; Access_Node.ino must list the same blocks.
+    CREDIT_SECTORS = os.environ.get('CREDIT_SECTORS') or ''
+    # Credit sector keys, 12 hex digits each; required (and not FFFFFFFFFFFF) with CREDIT_SECTORS.
+    # The station writes trailers where key A (Access_Node.ino) can only read and decrement
+    # and key B (kept on the station) can also increment and rewrite.
+    CREDIT_KEY_A = os.environ.get('CREDIT_KEY_A') or ''
+    CREDIT_KEY_B = os.environ.get('CREDIT_KEY_B') or ''
+    # Machine name -> ID mapping: 'file' (JSON list of {"id", "name", "aliases"}) or 'firestore'
+    MACHINE_REGISTRY_SOURCE = os.environ.get('MACHINE_REGISTRY_SOURCE') or 'file'
+    MACHINE_REGISTRY_FILE = os.environ.get('MACHINE_REGISTRY_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'machines.json')
+    MACHINE_REGISTRY_CHECK_INTERVAL = float(os.environ.get('MACHINE_REGISTRY_CHECK_INTERVAL', '2'))  # seconds between file mtime checks
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '512'))
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '300'))  # seconds; the syncing process's listener refreshes sooner
+    USER_CACHE_NEGATIVE_TTL = float(os.environ.get('USER_CACHE_NEGATIVE_TTL', '5'))  # unknown roll numbers
+    ENROLL_UPLOAD_DIR = os.environ.get('ENROLL_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'rfid_enroll')
+    # Local SQLite mirror of the users collection; lookups keep working through Firestore outages
+    USER_REPLICA_ENABLED = os.environ.get('USER_REPLICA', '1') not in ('0', 'false', 'no')
+    USER_REPLICA_PATH = os.environ.get('USER_REPLICA_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'users_replica.db')
+    USER_REPLICA_PAGE_SIZE = int(os.environ.get('USER_REPLICA_PAGE_SIZE', '500'))
+    USER_REPLICA_CHECK_INTERVAL = float(os.environ.get('USER_REPLICA_CHECK_INTERVAL', '30'))  # listener health, seconds
+    USER_REPLICA_RECONCILE = float(os.environ.get('USER_REPLICA_RECONCILE', '21600'))  # full sync backstop; 0 disables
+    # Journal for post-issuance Firestore updates (write-behind, replayed on restart)
+    WRITE_QUEUE_PATH = os.environ.get('WRITE_QUEUE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'write_queue.jsonl')
+    WRITE_QUEUE_BATCH_SIZE = int(os.environ.get('WRITE_QUEUE_BATCH_SIZE', '100'))  # documents per commit
+    WRITE_QUEUE_LINGER = float(os.environ.get('WRITE_QUEUE_LINGER', '0.2'))  # seconds to gather a batch
+    WRITE_QUEUE_MAX_BACKOFF = float(os.environ.get('WRITE_QUEUE_MAX_BACKOFF', '60'))
+    WRITE_QUEUE_MAX_ATTEMPTS = int(os.environ.get('WRITE_QUEUE_MAX_ATTEMPTS', '5'))  # permanent errors before dead-lettering
+    # PIN hashing: 'scrypt' or 'pbkdf2_sha256'; tune with `python bench.py kdf` on the Pi
+    PIN_KDF = os.environ.get('PIN_KDF') or 'scrypt'
+    PIN_SCRYPT_N = int(os.environ.get('PIN_SCRYPT_N', '16384'))
+    PIN_SCRYPT_R = int(os.environ.get('PIN_SCRYPT_R', '8'))
+    PIN_SCRYPT_P = int(os.environ.get('PIN_SCRYPT_P', '1'))
+    PIN_PBKDF2_ITERATIONS = int(os.environ.get('PIN_PBKDF2_ITERATIONS', '200000'))
+    PIN_HASH_WORKERS = int(os.environ.get('PIN_HASH_WORKERS', '2'))
+    PIN_HASH_QUEUE = int(os.environ.get('PIN_HASH_QUEUE', '8'))  # jobs waiting beyond the workers
+    PIN_HASH_ADMIT_TIMEOUT = float(os.environ.get('PIN_HASH_ADMIT_TIMEOUT', '2'))  # seconds before answering busy
+    # Presence polling: min interval while someone is at the kiosk, backing off to max when idle
+    CARD_POLL_MIN_INTERVAL = float(os.environ.get('CARD_POLL_MIN_INTERVAL', '0.05'))
+    CARD_POLL_MAX_INTERVAL = float(os.environ.get('CARD_POLL_MAX_INTERVAL', '2.0'))
+    CARD_POLL_BACKOFF = float(os.environ.get('CARD_POLL_BACKOFF', '2'))
+    CARD_POLL_ACTIVE_WINDOW = float(os.environ.get('CARD_POLL_ACTIVE_WINDOW', '30'))  # seconds after last card/UI activity
+    CARD_POLL_ATTENTIVE_WINDOW = float(os.environ.get('CARD_POLL_ATTENTIVE_WINDOW', '120'))  # UI "waiting for card" lease
+    RFID_RESET_SETTLE = float(os.environ.get('RFID_RESET_SETTLE', '0.05'))  # oscillator start-up after a hard reset
+    RFID_RETRY_BASE = float(os.environ.get('RFID_RETRY_BASE', '0.005'))  # first retry backoff, doubled per attempt
+    RFID_RETRY_MAX = float(os.environ.get('RFID_RETRY_MAX', '0.1'))
+    CARD_WAIT = float(os.environ.get('CARD_WAIT', '0.9'))  # seconds a write waits for the card to be placed
+    RFID_FIELD_SETTLE = float(os.environ.get('RFID_FIELD_SETTLE', '0.005'))  # card power-up after the field comes on
+    RFID_RECORD_CACHE = int(os.environ.get('RFID_RECORD_CACHE', '256'))  # decoded card records kept per lane
+    CARD_REMOVE_MISSES = int(os.environ.get('CARD_REMOVE_MISSES', '2'))  # empty probes before "card removed"
+    READER_WRITE_TIMEOUT = float(os.environ.get('READER_WRITE_TIMEOUT', '15'))  # seconds, queueing + issuance
+    READER_READ_TIMEOUT = float(os.environ.get('READER_READ_TIMEOUT', '5'))
+    # ESP32 card dispenser (dispenser_code.ino) for batch issuance; 'sim' for the fake one
+    DISPENSER_PORT = os.environ.get('DISPENSER_PORT') or ('sim' if RFID_BACKEND == 'sim' else '/dev/ttyUSB0')
+    DISPENSER_BAUDRATE = int(os.environ.get('DISPENSER_BAUDRATE', '115200'))
+    DISPENSER_TIMEOUT = float(os.environ.get('DISPENSER_TIMEOUT', '10'))  # seconds for a feed or eject
+    BATCH_LOOKAHEAD = int(os.environ.get('BATCH_LOOKAHEAD', '4'))  # roll numbers staged ahead of the current card
+    BATCH_MAX_RETRIES = int(os.environ.get('BATCH_MAX_RETRIES', '2'))  # fresh cards per roll after a failed write
+    # Hardware daemon (hardware_daemon.py) owning the readers, dispenser, write queue and
+    # background jobs; the HTTP workers reach it over this Unix socket
+    HARDWARE_SOCKET = os.environ.get('HARDWARE_SOCKET') or os.path.join(tempfile.gettempdir(), 'rfid_station.sock')
+    HARDWARE_POOL_SIZE = int(os.environ.get('HARDWARE_POOL_SIZE', '8'))  # idle connections kept per worker
+    HARDWARE_RPC_TIMEOUT = float(os.environ.get('HARDWARE_RPC_TIMEOUT', '5'))  # seconds, plus the reader timeout for card ops
+    FLASK_DEBUG = os.environ.get('FLASK_DEBUG', '0') in ('1', 'true', 'yes')
+    # Startup: subsystems come up in the background; requests needing one wait this long, then get a 503
+    STARTUP_WAIT = float(os.environ.get('STARTUP_WAIT', '3'))
+    STARTUP_RETRY = float(os.environ.get('STARTUP_RETRY', '5'))  # seconds between attempts (e.g. network not up yet)
@@ -0,0 +1,179 @@
+# Usage-credit ledger: credits granted at issuance and debits the access nodes report
+# after taking them off the card offline, reconciled per card, issuance session and machine.
+#   python credit_ledger.py reconcile                        (every card in Firestore)
+#   python credit_ledger.py reconcile --card 3735928559
+#   python credit_ledger.py reconcile --file ledger.jsonl    (exported entries, no Firestore)
+#
+# Entries live in the credit_ledger collection and go through the station's write-behind
+# queue. Document IDs are derived from the entry, so a node that reports the same debit
+# twice (e.g. after a lost acknowledgement) writes the same document.
+import argparse
+import json
+import time
+
+from machine_registry import get_registry
+from metrics import firestore_call
+
+COLLECTION = 'credit_ledger'
+
+def _session(session_id):
+    """Session ID as the 8 hex digits printed on the station (int or hex string in)"""
+    if isinstance(session_id, str):
+        session_id = int(session_id, 16)
+    return f"{session_id & 0xFFFFFFFF:08X}"
+
+def grant_entries(card_id, roll_number, session_id, credits, registry=None):
+    """[(doc ID, fields)] for the credits written at issuance ({machine ID: amount})"""
+    registry = registry or get_registry()
+    session = _session(session_id)
+    now = time.time()
+    return [(f"{card_id}-{session}-{machine_id}-grant", {
+        'kind': 'grant', 'card_id': str(card_id), 'roll_number': str(roll_number), 'session_id': session,
+        'machine_id': machine_id, 'unit': registry.credit_unit(machine_id) or 'sessions',
+        'amount': amount, 'balance': amount, 'at': now,
+    }) for machine_id, amount in sorted(credits.items())]
+
+def debit_entry(report):
+    """(doc ID, fields) for one debit reported by an access node:
+    {'card_id', 'session_id', 'machine_id', 'amount', 'balance' (left on the card), 'at'}.
+    Raises ValueError for a malformed report."""
+    try:
+        card_id = str(int(report['card_id']))
+        session = _session(report['session_id'])
+        machine_id = int(report['machine_id'])
+        amount = int(report['amount'])
+        balance = int(report['balance'])
+        at = float(report.get('at') or time.time())
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed debit report {report!r}: {e}")
+    if amount <= 0 or balance < 0:
+        raise ValueError(f"Debit report {report!r} has a non-positive amount or a negative balance")
+    # A card's balance only goes down within one session, so it identifies the debit
+    return (f"{card_id}-{session}-{machine_id}-{balance}", {
+        'kind': 'debit', 'card_id': card_id, 'session_id': session, 'machine_id': machine_id,
+        'amount': amount, 'balance': balance, 'at': at, 'node': str(report.get('node', '')),
+    })
+
+def observed_entries(card_id, session_id, credits):
+    """[(doc ID, fields)] for balances read off a card at the station ({machine ID: balance})"""
+    session = _session(session_id)
+    now = time.time()
+    return [(f"{card_id}-{session}-{machine_id}-seen-{int(now)}", {
+        'kind': 'observed', 'card_id': str(card_id), 'session_id': session, 'machine_id': machine_id,
+        'balance': balance, 'at': now,
+    }) for machine_id, balance in sorted(credits.items())]
+
+def queue_entries(entries):
+    """Journal entries for Firestore through the write-behind queue (the syncing process only)"""
+    import firebase_config
+    if firebase_config.write_queue is None:
+        raise RuntimeError("Write queue not running in this process; ledger entries go through the hardware daemon")
+    for doc_id, fields in entries:
+        firebase_config.write_queue.enqueue(f"{COLLECTION}/{doc_id}", fields)
+    return len(entries)
+
+def queue_grants(card_id, roll_number, session_id, credits):
+    """Journal the grants of a card just issued"""
+    return queue_entries(grant_entries(card_id, roll_number, session_id, credits))
+
+def reconcile(entries):
+    """One account per (card, session, machine) from ledger entry dicts:
+    granted, debits reported, credits used without a report (gaps in the balance
+    chain or a lower balance seen at the station), lowest known balance, issues."""
+    accounts = {}
+    for entry in entries:
+        key = (entry['card_id'], entry['session_id'], int(entry['machine_id']))
+        account = accounts.setdefault(key, {'grant': None, 'debits': [], 'observed': []})
+        if entry['kind'] == 'grant':
+            account['grant'] = entry
+        elif entry['kind'] == 'debit':
+            account['debits'].append(entry)
+        elif entry['kind'] == 'observed':
+            account['observed'].append(entry)
+
+    results = []
+    for (card_id, session, machine_id), account in sorted(accounts.items()):
+        grant = account['grant']
+        issues = []
+        if grant is None:
+            issues.append("no grant recorded for this session")
+        # Debits ordered by the balance they left: each should start where the last one ended
+        debits = sorted(account['debits'], key=lambda d: (-d['balance'], d['at']))
+        known = grant['amount'] if grant else None
+        unreported = 0
+        history = []    # (time, balance known after it)
+        for debit in debits:
+            before = debit['balance'] + debit['amount']
+            if known is not None and before < known:
+                unreported += known - before
+            elif known is not None and before > known:
+                issues.append(f"debit at {debit['at']:.0f} starts at {before}, above the {known} left before it")
+            known = debit['balance']
+            history.append((debit['at'], known))
+        for seen in account['observed']:
+            earlier = [balance for at, balance in history if at <= seen['at']]
+            expected = min(earlier) if earlier else (grant['amount'] if grant else None)
+            if expected is not None and seen['balance'] > expected:
+                issues.append(f"card showed {seen['balance']} at {seen['at']:.0f}, above the {expected} reported")
+        lowest_seen = min((seen['balance'] for seen in account['observed']), default=None)
+        if lowest_seen is not None and known is not None and lowest_seen < known:
+            unreported += known - lowest_seen
+            known = lowest_seen
+        results.append({
+            'card_id': card_id, 'session_id': session, 'machine_id': machine_id,
+            'roll_number': grant['roll_number'] if grant else None,
+            'unit': grant['unit'] if grant else None,
+            'granted': grant['amount'] if grant else None,
+            'reported': sum(debit['amount'] for debit in debits),
+            'unreported': unreported,
+            'balance': known,
+            'issues': issues,
+        })
+    return results
+
+def load_entries(card_id=None, db=None):
+    """Ledger entries from Firestore, for one card or all of them"""
+    if db is None:
+        from firebase_config import db
+    query = db.collection(COLLECTION)
+    if card_id is not None:
+        query = query.where('card_id', '==', str(card_id))
+    with firestore_call('load_ledger'):
+        return [doc.to_dict() for doc in query.stream()]
+
+def print_report(results):
+    print(f"{'card':>12} {'session':>9} {'machine':>8} {'granted':>8} {'reported':>9} {'unreported':>11} {'balance':>8}")
+    for r in results:
+        granted = '-' if r['granted'] is None else r['granted']
+        balance = '-' if r['balance'] is None else r['balance']
+        print(f"{r['card_id']:>12} {r['session_id']:>9} {r['machine_id']:>8} {granted:>8} "
+              f"{r['reported']:>9} {r['unreported']:>11} {balance:>8}")
+        for issue in r['issues']:
+            print(f"{'':>12} ! {issue}")
+    flagged = sum(1 for r in results if r['issues'] or r['unreported'])
+    print(f"{len(results)} accounts, {flagged} with unreported use or issues")
+
+def main():
+    parser = argparse.ArgumentParser(description="Usage-credit ledger")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rec = sub.add_parser('reconcile', help="granted vs reported vs seen, per card, session and machine")
+    rec.add_argument('--card', help="only this card ID")
+    rec.add_argument('--file', help="JSONL of ledger entries instead of Firestore")
+    rec.add_argument('--json', action='store_true', help="print the accounts as JSON")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if args.card:
+            entries = [entry for entry in entries if entry['card_id'] == str(args.card)]
+    else:
+        entries = load_entries(args.card)
+    results = reconcile(entries)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+if __name__ == '__main__':
+    main()
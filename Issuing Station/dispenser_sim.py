@@ -0,0 +1,103 @@
+# Stand-in for the ESP32 card dispenser on the serial port.
+# Speaks the same commands and prints the same messages as dispenser_code.ino, with
+# configurable mechanical timings, so batch_issue.py runs off the hardware:
+#   python batch_issue.py rolls.txt --sim
+import queue
+import threading
+
+class FakeDispenserSerial:
+    """pyserial-like device (write/readline/close) running the dispenser state machine
+
+    on_staged is called when a card stops at sensor 1 (i.e. enters the reader
+    field), on_removed when the transport roller moves it on. stack limits the
+    number of cards in the hopper (None: unlimited); an empty hopper never
+    reports sensor 1, like the real motor spinning on nothing.
+    """
+    IDLE = 'IDLE'
+    DISPENSING = 'DISPENSING_FROM_STACK'
+    WAITING = 'WAITING_FOR_MOTOR2_ENABLE'
+    TRANSPORTING = 'TRANSPORTING_CARD'
+    DISPENSED = 'CARD_DISPENSED'
+
+    def __init__(self, feed_time=0.4, transport_time=0.4, ready_delay=1.0, stack=None,
+                 on_staged=None, on_removed=None, timeout=0.1):
+        self.feed_time = feed_time
+        self.transport_time = transport_time
+        self.ready_delay = ready_delay
+        self.stack = stack
+        self.on_staged = on_staged
+        self.on_removed = on_removed
+        self.timeout = timeout
+        self.state = self.IDLE
+        self.lines = queue.Queue()
+        self.buffer = ''
+        self.lock = threading.Lock()
+        self.commands = []
+        self.dispensed = 0
+        self._println("Card Dispenser System Initialized")
+        self._println("Send 'DISPENSE' to start dispensing a card")
+
+    def _println(self, text):
+        self.lines.put((text + '\r\n').encode())
+
+    def _after(self, delay, fn):
+        timer = threading.Timer(delay, fn)
+        timer.daemon = True
+        timer.start()
+
+    def write(self, data):
+        with self.lock:
+            self.buffer += data.decode()
+            while '\n' in self.buffer:
+                command, self.buffer = self.buffer.split('\n', 1)
+                self._command(command.strip())
+        return len(data)
+
+    def _command(self, command):
+        self.commands.append(command)
+        if command == 'DISPENSE' and self.state == self.IDLE:
+            self._println("Starting card dispensing...")
+            self._println("Motor 1 started (dispensing from stack)")
+            self.state = self.DISPENSING
+            if self.stack is None or self.stack > 0:
+                self._after(self.feed_time, self._staged)
+        elif command == 'EJECT' and self.state == self.WAITING:
+            self._println("Eject command received - Starting transport")
+            self._println("Motor 2 started (transporting card)")
+            self.state = self.TRANSPORTING
+            if self.on_removed:
+                self.on_removed()
+            self._after(self.transport_time, self._dispensed)
+
+    def _staged(self):
+        with self.lock:
+            if self.stack is not None:
+                self.stack -= 1
+            if self.on_staged:
+                self.on_staged()
+            self._println("Card detected by sensor 1 - Waiting for Motor 2 enable signal")
+            self._println("Motor 1 stopped")
+            self.state = self.WAITING
+
+    def _dispensed(self):
+        with self.lock:
+            self._println("Card detected by sensor 2 - Card dispensed")
+            self._println("Motor 2 stopped")
+            self.state = self.DISPENSED
+            self.dispensed += 1
+        self._after(self.ready_delay, self._ready)
+
+    def _ready(self):
+        with self.lock:
+            self._println("Ready for next card")
+            self.state = self.IDLE
+
+    def readline(self):
+        """Next line, or b'' after timeout seconds (as pyserial does)"""
+        try:
+            return self.lines.get(timeout=self.timeout)
+        except queue.Empty:
+            return b''
+
+    def close(self):
+        pass
@@ -0,0 +1,396 @@
+# Bulk user enrollment from a CSV or JSONL roster
+#   python enroll.py students.csv --dry-run
+#   python enroll.py students.csv --batch-size 400 --concurrency 4
+#   python enroll.py students.jsonl --resume          (continue after a failure)
+#
+# CSV columns: roll_number,name,branch,year,accessible_machines,pin
+# (accessible_machines separated by ';'). JSONL: one object per line with the
+# same keys, accessible_machines as a list.
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from machine_registry import get_registry
+from metrics import firestore_call
+from models import hash_pin
+from rfid_handler import CardRecord
+
+FIRESTORE_BATCH_LIMIT = 500
+# Fields compared for the diff; pin_hash, card_id and timestamps are owned by the station
+PROFILE_FIELDS = ('name', 'branch', 'year', 'accessible_machines')
+MAX_REPORTED_DIFFS = 1000
+
+def read_roster(path, fmt=None):
+    """Yield (line number, row dict) from a CSV or JSONL roster without loading it whole"""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'jsonl':
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except ValueError as e:
+                        yield line_no, {'_error': f"Invalid JSON: {e}"}
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+def roster_digest(path):
+    """SHA-256 of the roster file, so resume only trusts progress for identical content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def normalize_row(row, registry):
+    """Validated user fields for one roster row; raises ValueError on bad input"""
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    roll_number = str(row.get('roll_number') or '').strip()
+    if not CardRecord.valid_roll(roll_number):
+        # Rejected here rather than at the kiosk, where no card could be issued for it
+        raise ValueError(f"Invalid roll number '{roll_number}': cards hold numeric roll numbers "
+                         f"of 1-{CardRecord.MAX_ROLL_DIGITS} digits")
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise ValueError("Name is required")
+
+    machines = row.get('accessible_machines') or []
+    if isinstance(machines, str):
+        machines = [m for m in (part.strip() for part in machines.split(';')) if m]
+    mask = 0
+    unknown = []
+    for machine in machines:
+        bit = registry.bit_for(machine)
+        if not bit:
+            unknown.append(str(machine))
+        mask |= bit
+    if unknown:
+        raise ValueError(f"Unknown machine(s): {', '.join(unknown)}")
+    # Store canonical registry names so every station maps them the same way; IDs
+    # not (yet) in the registry stay numeric, as bit_for() cannot map 'Machine n' back
+    machines = [registry.machines.get(machine_id, str(machine_id))
+                for machine_id in range(1, mask.bit_length() + 1) if mask >> (machine_id - 1) & 1]
+
+    pin = str(row.get('pin') or '').strip()
+    if pin and not (len(pin) == 4 and pin.isdigit()):
+        raise ValueError("PIN must be 4 digits")
+
+    return {
+        'roll_number': roll_number,
+        'name': name,
+        'branch': str(row.get('branch') or '').strip(),
+        'year': str(row.get('year') or '').strip(),
+        'accessible_machines': machines,
+        'pin': pin,
+    }
+
+def diff_user(existing, incoming):
+    """{field: (old, new)} for profile fields that differ"""
+    return {
+        field: (existing.get(field), incoming[field])
+        for field in PROFILE_FIELDS
+        if existing.get(field) != incoming[field]
+    }
+
+class EnrollStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.errors = []
+        self.diffs = []
+        self.batches = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def users_per_sec(self):
+        done = self.created + self.updated + self.unchanged
+        return done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'skipped': self.skipped,
+            'errors': self.errors[:MAX_REPORTED_DIFFS],
+            'error_count': len(self.errors),
+            'diffs': self.diffs,
+            'batches': self.batches,
+            'elapsed': round(self.elapsed, 2),
+            'users_per_sec': round(self.users_per_sec, 1),
+            'done': self.finished is not None,
+        }
+
+class Enrollment:
+    """Stream a roster into the users collection in batched writes"""
+
+    def __init__(self, path, fmt=None, dry_run=False, batch_size=400, concurrency=4,
+                 hash_workers=None, reset_pins=False, resume=False, db=None):
+        if not 1 <= batch_size <= FIRESTORE_BATCH_LIMIT:
+            raise ValueError(f"Batch size must be 1-{FIRESTORE_BATCH_LIMIT}")
+        if db is None:
+            from firebase_config import db
+        self.db = db
+        self.path = path
+        self.fmt = fmt
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.hash_workers = hash_workers
+        self.reset_pins = reset_pins
+        self.resume = resume
+        self.progress_path = path + '.progress'
+        self.stats = EnrollStats()
+        self.registry = get_registry()
+        self._done_batches = set()
+        self._checkpoint = 0        # batches committed without gaps
+        self._batch_rows = {}       # batch index -> roster rows up to and including it
+        self._digest = None
+
+    def _fingerprint(self):
+        if self._digest is None:
+            self._digest = roster_digest(self.path)
+        return {'roster': os.path.basename(self.path), 'digest': self._digest}
+
+    def _load_progress(self):
+        """Roster rows already committed by an interrupted run"""
+        try:
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if {k: progress.get(k) for k in ('roster', 'digest')} != self._fingerprint():
+            print("Roster changed since the last run, starting from the top")
+            return 0
+        return progress.get('rows_done', 0)
+
+    def _mark_done(self, index):
+        """Advance the resume checkpoint past every batch committed without gaps"""
+        with self.stats.lock:
+            self._done_batches.add(index)
+            advanced = False
+            while self._checkpoint in self._done_batches:
+                self._done_batches.discard(self._checkpoint)
+                self._checkpoint += 1
+                advanced = True
+            if not advanced or self.dry_run:
+                return
+            rows_done = self._batch_rows[self._checkpoint - 1]
+            for done in [i for i in self._batch_rows if i < self._checkpoint]:
+                del self._batch_rows[done]
+            tmp = self.progress_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict(self._fingerprint(), rows_done=rows_done), f)
+            os.replace(tmp, self.progress_path)
+
+    def _process_batch(self, index, users, hash_pool):
+        """Diff one batch against Firestore, hash the PINs it needs and commit it"""
+        users_ref = self.db.collection('users')
+        refs = [users_ref.document(u['roll_number']) for u in users]
+        with firestore_call('enroll_get_all'):
+            existing = {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+        writes = []   # (ref, data, merge)
+        needs_pin = []
+        now = datetime.datetime.now()
+        created = updated = unchanged = 0
+        diffs = []
+        for ref, user in zip(refs, users):
+            current = existing.get(user['roll_number'])
+            if current is None:
+                if not user['pin']:
+                    with self.stats.lock:
+                        self.stats.errors.append(f"{user['roll_number']}: PIN required for new users")
+                    continue
+                data = {field: user[field] for field in ('roll_number',) + PROFILE_FIELDS}
+                data.update({'pin_hash': None, 'card_id': None, 'created_at': now, 'last_updated': now})
+                needs_pin.append((data, user['pin']))
+                writes.append((ref, data, False))
+                diffs.append({'roll_number': user['roll_number'], 'action': 'create'})
+                created += 1
+                continue
+
+            changes = diff_user(current, user)
+            data = {field: new for field, (_, new) in changes.items()}
+            if user['pin'] and (self.reset_pins or not current.get('pin_hash')):
+                needs_pin.append((data, user['pin']))
+                changes['pin'] = ('***', '***')
+            if not changes:
+                unchanged += 1
+                continue
+            data['last_updated'] = now
+            writes.append((ref, data, True))
+            diffs.append({'roll_number': user['roll_number'], 'action': 'update',
+                          'changes': {f: {'old': old, 'new': new} for f, (old, new) in changes.items()}})
+            updated += 1
+
+        if not self.dry_run and writes:
+            if needs_pin:
+                hashes = hash_pool.map(hash_pin, [pin for _, pin in needs_pin], chunksize=32)
+                for (data, _), pin_hash in zip(needs_pin, hashes):
+                    data['pin_hash'] = pin_hash
+            batch = self.db.batch()
+            for ref, data, merge in writes:
+                batch.set(ref, data, merge=merge)
+            with firestore_call('enroll_commit'):
+                batch.commit()
+
+        with self.stats.lock:
+            self.stats.created += created
+            self.stats.updated += updated
+            self.stats.unchanged += unchanged
+            self.stats.batches += 1
+            room = MAX_REPORTED_DIFFS - len(self.stats.diffs)
+            if room > 0:
+                self.stats.diffs.extend(diffs[:room])
+        self._mark_done(index)
+
+    def run(self):
+        skip_rows = self._load_progress() if self.resume else 0
+        if skip_rows:
+            print(f"Resuming after {skip_rows} roster rows")
+        self.stats.skipped = skip_rows
+
+        # Bounded: at most 2x concurrency batches parsed but not yet committed
+        in_flight = threading.BoundedSemaphore(self.concurrency * 2)
+        failures = []
+        commit_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        hash_pool = ProcessPoolExecutor(max_workers=self.hash_workers) if not self.dry_run else None
+
+        def submit(index, users):
+            in_flight.acquire()
+            future = commit_pool.submit(self._process_batch, index, users, hash_pool)
+
+            def on_done(f):
+                in_flight.release()
+                if f.exception() is not None:
+                    failures.append((index, f.exception()))
+            future.add_done_callback(on_done)
+
+        try:
+            batch = []
+            seen = set()
+            index = 0
+            rows = 0
+            for line_no, row in read_roster(self.path, self.fmt):
+                rows += 1
+                if rows <= skip_rows:
+                    continue
+                if failures:
+                    break
+                try:
+                    user = normalize_row(row, self.registry)
+                except ValueError as e:
+                    with self.stats.lock:
+                        self.stats.errors.append(f"line {line_no}: {e}")
+                    continue
+                if user['roll_number'] in seen:
+                    with self.stats.lock:
+                        self.stats.errors.append(f"line {line_no}: duplicate roll number {user['roll_number']}")
+                    continue
+                seen.add(user['roll_number'])
+                batch.append(user)
+                if len(batch) == self.batch_size:
+                    self._batch_rows[index] = rows
+                    submit(index, batch)
+                    index += 1
+                    batch = []
+            if batch and not failures:
+                self._batch_rows[index] = rows
+                submit(index, batch)
+        finally:
+            commit_pool.shutdown(wait=True)
+            if hash_pool:
+                hash_pool.shutdown()
+            self.stats.rows = rows
+            self.stats.finished = time.monotonic()
+
+        if failures:
+            index, error = min(failures, key=lambda f: f[0])
+            raise RuntimeError(f"Batch {index} failed: {error} (re-run with --resume to continue)")
+        if not self.dry_run and os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+        return self.stats
+
+class EnrollJob(threading.Thread):
+    """Enrollment run in the background for the API; poll .stats / .error"""
+
+    def __init__(self, job_id, path, **options):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.path = path
+        self.options = options
+        self.enrollment = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.enrollment = Enrollment(self.path, **self.options)
+            self.enrollment.run()
+        except Exception as e:
+            print(f"Enrollment job {self.job_id} error: {e}")
+            self.error = str(e)
+
+    def status(self):
+        status = self.enrollment.stats.to_dict() if self.enrollment else {'done': False}
+        status.update({'job_id': self.job_id, 'dry_run': self.options.get('dry_run', False)})
+        if self.error:
+            status.update({'done': True, 'error': self.error})
+        return status
+
+def print_report(stats, dry_run):
+    print(f"{'Dry run' if dry_run else 'Enrollment'}: {stats.rows} rows, {stats.created} new, "
+          f"{stats.updated} changed, {stats.unchanged} unchanged, {len(stats.errors)} errors")
+    if dry_run:
+        for diff in stats.diffs:
+            if diff['action'] == 'create':
+                print(f"  + {diff['roll_number']}")
+            else:
+                changes = ', '.join(f"{f}: {c['old']!r} -> {c['new']!r}" for f, c in diff['changes'].items())
+                print(f"  ~ {diff['roll_number']}  {changes}")
+    for error in stats.errors[:50]:
+        print(f"  ! {error}")
+    print(f"{stats.users_per_sec:.1f} users/sec over {stats.elapsed:.2f} s ({stats.batches} batches)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-enroll users from a CSV/JSONL roster")
+    parser.add_argument('roster')
+    parser.add_argument('--format', choices=('csv', 'jsonl'))
+    parser.add_argument('--dry-run', action='store_true', help="show what would change, write nothing")
+    parser.add_argument('--batch-size', type=int, default=400, help=f"writes per commit (max {FIRESTORE_BATCH_LIMIT})")
+    parser.add_argument('--concurrency', type=int, default=4, help="batches committed in parallel")
+    parser.add_argument('--hash-workers', type=int, help="PIN hashing processes (default: CPU count)")
+    parser.add_argument('--reset-pins', action='store_true', help="replace PINs of existing users")
+    parser.add_argument('--resume', action='store_true', help="skip rows committed by an interrupted run")
+    args = parser.parse_args()
+
+    enrollment = Enrollment(args.roster, fmt=args.format, dry_run=args.dry_run,
+                            batch_size=args.batch_size, concurrency=args.concurrency,
+                            hash_workers=args.hash_workers, reset_pins=args.reset_pins,
+                            resume=args.resume)
+    try:
+        enrollment.run()
+    finally:
+        print_report(enrollment.stats, args.dry_run)
+
+if __name__ == '__main__':
+    main()
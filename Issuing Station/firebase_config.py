@@ -1,28 +1,212 @@
+import threading
+import time
+from collections import OrderedDict
+
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from config import Config
+from metrics import firestore_call
+from user_replica import UserReplica
+from write_queue import WriteQueue
+
 # Download service account key from Firebase Console
 cred = credentials.Certificate('rfid-access-control-151cd-firebase-adminsdk-fbsvc-6a92a77af2.json')
-firebase_admin.initialize_app(cred)
+try:
+    firebase_admin.get_app()
+except ValueError:
+    # Not initialized yet (a retried import after a failure may find it initialized)
+    firebase_admin.initialize_app(cred)
 
 db = firestore.client()
 
-def get_user_by_roll(roll_number):
-    """Get user data from Firestore"""
+class UserCache:
+    """Bounded LRU of user documents keyed by roll number, with a TTL as a
+    backstop to the snapshot listener that keeps cached entries current"""
+
+    def __init__(self, max_size=None, ttl=None, negative_ttl=None):
+        self.max_size = max_size or Config.USER_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else Config.USER_CACHE_TTL
+        self.negative_ttl = negative_ttl if negative_ttl is not None else Config.USER_CACHE_NEGATIVE_TTL
+        self.entries = OrderedDict()  # roll_number -> (user dict or None, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.listener_updates = 0
+        self._watch = None
+
+    def get(self, roll_number):
+        """(found, user) - found is False on a miss or an expired entry"""
+        with self.lock:
+            entry = self.entries.get(roll_number)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(roll_number)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self.entries[roll_number]
+            self.misses += 1
+            return False, None
+
+    def put(self, roll_number, user):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        with self.lock:
+            self.entries[roll_number] = (user, time.monotonic() + ttl)
+            self.entries.move_to_end(roll_number)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, roll_number):
+        with self.lock:
+            if self.entries.pop(roll_number, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def watch(self, collection):
+        """Refresh cached users from Firestore change events"""
+        if self._watch is not None:
+            return
+
+        def on_snapshot(docs, changes, read_time):
+            for change in changes:
+                doc = change.document
+                user = doc.to_dict() or {}
+                roll_number = user.get('roll_number') or doc.id
+                if change.type.name == 'REMOVED':
+                    self.invalidate(roll_number)
+                    continue
+                with self.lock:
+                    cached = roll_number in self.entries
+                # Only refresh what is cached (or cached as missing); the initial
+                # snapshot should not flush the LRU with the whole collection
+                if cached:
+                    self.put(roll_number, user)
+                    self.listener_updates += 1
+
+        try:
+            self._watch = collection.on_snapshot(on_snapshot)
+        except Exception as e:
+            print(f"User cache listener error: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'listener_updates': self.listener_updates,
+            'listening': self._watch is not None,
+        }
+
+user_cache = UserCache()
+# Every process reads the replica file; only the one that called start_sync() keeps
+# it current and owns the write-behind journal (the hardware daemon, or a
+# standalone tool run while the daemon is not)
+user_replica = UserReplica(db) if Config.USER_REPLICA_ENABLED else None
+write_queue = None
+
+def start_sync():
+    """Run replica sync and the write-behind queue in this process"""
+    global write_queue
+    if write_queue is not None:
+        return
+    if user_replica:
+        # The replica's listener keeps the cache fresh too
+        user_replica.on_change = user_cache.invalidate
+        user_replica.start()
+    else:
+        user_cache.watch(db.collection('users'))
+    write_queue = WriteQueue(db)
+    write_queue.start()
+
+def stop_sync():
+    if write_queue is not None:
+        write_queue.close()
+    if user_replica:
+        user_replica.close()
+
+def warm_up():
+    """One cheap read, so the gRPC channel and auth token are set up before the first real lookup"""
+    with firestore_call('warm_up'):
+        list(db.collection('users').limit(1).stream())
+
+def fetch_user_by_roll(roll_number):
+    """Get user data straight from Firestore (document ID is the roll number)"""
     users_ref = db.collection('users')
-    query = users_ref.where('roll_number', '==', roll_number).limit(1)
-    docs = query.stream()
-    
-    for doc in docs:
+    with firestore_call('get_user'):
+        doc = users_ref.document(roll_number).get()
+    if doc.exists:
         return doc.to_dict()
-    return None
+
+    # Older documents may not be keyed by roll number
+    query = users_ref.where('roll_number', '==', roll_number).limit(1)
+    with firestore_call('query_user'):
+        docs = list(query.stream())
+    return docs[0].to_dict() if docs else None
+
+def get_user_by_roll(roll_number):
+    """Get user data, from the in-process cache or local replica when possible"""
+    if user_replica and write_queue is None:
+        # Not the syncing process: the daemon keeps the replica file current, and an
+        # indexed local read is cheap, so no per-worker cache (or listener) to keep fresh
+        return user_replica.lookup(roll_number, fetch_user_by_roll)
+    found, user = user_cache.get(roll_number)
+    if found:
+        return user
+    # Without a replica, workers rely on USER_CACHE_TTL: one collection listener per
+    # worker would multiply Firestore reads by the worker count
+    if user_replica:
+        user = user_replica.lookup(roll_number, fetch_user_by_roll)
+    else:
+        user = fetch_user_by_roll(roll_number)
+    user_cache.put(roll_number, user)
+    return user
+
+def get_user_by_card(card_id):
+    """User a card was issued to (replica index on card_id), or None"""
+    if user_replica:
+        return user_replica.get_by_card(card_id)
+    with firestore_call('query_card'):
+        docs = list(db.collection('users').where('card_id', '==', str(card_id)).limit(1).stream())
+    return docs[0].to_dict() if docs else None
+
+def update_user(roll_number, fields):
+    """Update user fields and drop the cached copy"""
+    if user_replica:
+        user_replica.apply_local(roll_number, fields)
+    user_cache.invalidate(roll_number)
+    user_ref = db.collection('users').document(roll_number)
+    with firestore_call('update_user'):
+        user_ref.update(fields)
+
+def queue_user_update(roll_number, fields):
+    """Apply fields locally now and commit them to Firestore in the background"""
+    if write_queue is None:
+        raise RuntimeError("Write queue not running in this process; updates go through the hardware daemon")
+    if user_replica:
+        user_replica.apply_local(roll_number, fields)
+    user_cache.invalidate(roll_number)
+    return write_queue.enqueue(f"users/{roll_number}", fields)
 
 def save_user_pin(roll_number, pin_hash):
     """Save/update user PIN"""
-    user_ref = db.collection('users').document(roll_number)
-    user_ref.update({'pin_hash': pin_hash})
+    update_user(roll_number, {'pin_hash': pin_hash})
 
 def create_user(user_data):
     """Create new user in database"""
     user_ref = db.collection('users').document(user_data['roll_number'])
-    user_ref.set(user_data)
\ No newline at end of file
+    with firestore_call('create_user'):
+        user_ref.set(user_data)
+    if user_replica:
+        user_replica.put(user_data['roll_number'], user_data)
+    user_cache.invalidate(user_data['roll_number'])
\ No newline at end of file
@@ -0,0 +1,14 @@
+# Production HTTP server settings: gunicorn 'app:create_app()' (start hardware_daemon.py first)
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:5000'
+# Workers hold no hardware, so they scale with the cores; each SSE client holds a thread
+workers = int(os.environ.get('GUNICORN_WORKERS', str(min(4, multiprocessing.cpu_count()))))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+# Heartbeat timeout; gthread workers keep beating while request threads wait on the daemon
+timeout = 60
+graceful_timeout = 10
+# No preload: each worker creates its own Firebase client after the fork
+preload_app = False
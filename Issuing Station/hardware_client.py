@@ -0,0 +1,195 @@
+# Client side of the hardware daemon RPC (see hardware_daemon.py).
+# One JSON object per line in each direction over a Unix domain socket:
+#   -> {"method": "read_card", "params": {"lane": 0}}
+#   <- {"ok": true, "result": {...}}   or   {"ok": false, "error": "...", "status": 404, "busy": false}
+# Streaming methods (events) answer with one {"ok": true} line, then {"data": ...} lines
+# until either side closes the connection.
+import json
+import queue
+import select
+import socket
+import threading
+
+from config import Config
+
+# Calls that change nothing on the daemon side. A request that could not be sent
+# never reached the daemon and is retried on a fresh connection whatever the method;
+# only these are also retried when a pooled connection fails after the send
+SAFE_TO_RETRY = {
+    'ping', 'lanes', 'card_status', 'polling', 'reader', 'write_queue', 'replica',
+    'metrics', 'enroll_status', 'batch_status',
+}
+
+class HardwareError(Exception):
+    """The daemon answered with an error (or could not be reached)"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+class HardwareBusy(HardwareError):
+    """The reader did not get to the request in time; worth retrying"""
+
+    def __init__(self, message):
+        super().__init__(message, status=503)
+
+class HardwareUnavailable(HardwareError):
+    """No daemon listening on the socket"""
+
+    def __init__(self, message):
+        super().__init__(message, status=503)
+
+class _Connection:
+    def __init__(self, path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError as e:
+            self.sock.close()
+            raise HardwareUnavailable(f"Hardware daemon not reachable at {path}: {e}")
+        self.file = self.sock.makefile('rwb')
+
+    def send(self, message, timeout):
+        self.sock.settimeout(timeout)
+        self.file.write(json.dumps(message).encode() + b'\n')
+        self.file.flush()
+
+    def stale(self):
+        """True if the daemon closed this idle connection (it never sends unasked)"""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def receive(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Hardware daemon closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+def _raise_for(response):
+    if response.get('ok'):
+        return
+    if response.get('busy'):
+        raise HardwareBusy(response.get('error', 'Reader busy'))
+    raise HardwareError(response.get('error', 'Hardware daemon error'), response.get('status', 500))
+
+class HardwareClient:
+    """Thread-safe RPC client with a pool of persistent connections
+
+    Each HTTP worker thread borrows a connection for one call and returns it,
+    so steady-state calls cost one round trip on an open socket. At most
+    pool_size idle connections are kept; bursts open extra ones.
+    """
+
+    def __init__(self, path=None, pool_size=None, timeout=None):
+        self.path = path or Config.HARDWARE_SOCKET
+        self.pool_size = pool_size or Config.HARDWARE_POOL_SIZE
+        self.timeout = timeout or Config.HARDWARE_RPC_TIMEOUT
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'connects': 0, 'reused': 0, 'stale': 0, 'retries': 0, 'errors': 0}
+
+    def _borrow(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    self.stats['connects'] += 1
+                return _Connection(self.path, self.timeout), False
+            if conn.stale():
+                # Closed by a daemon restart while idle
+                conn.close()
+                with self.lock:
+                    self.stats['stale'] += 1
+                continue
+            with self.lock:
+                self.stats['reused'] += 1
+            return conn, True
+
+    def _return(self, conn):
+        if self.idle.qsize() < self.pool_size:
+            self.idle.put(conn)
+        else:
+            conn.close()
+
+    def call(self, method, timeout=None, **params):
+        """Result of one daemon method; timeout adds to the base RPC timeout for slow card ops"""
+        timeout = self.timeout + (timeout or 0)
+        with self.lock:
+            self.stats['calls'] += 1
+        while True:
+            conn, reused = self._borrow()
+            try:
+                conn.send({'method': method, 'params': params}, timeout)
+            except (OSError, ValueError) as e:
+                conn.close()
+                # The daemon only acts on a complete line, so nothing was done
+                if reused:
+                    with self.lock:
+                        self.stats['retries'] += 1
+                    continue
+                with self.lock:
+                    self.stats['errors'] += 1
+                raise HardwareUnavailable(f"Hardware daemon call {method} failed: {e}")
+            try:
+                response = conn.receive()
+            except (OSError, ValueError) as e:
+                conn.close()
+                # Sent: the daemon may have acted on it, so only side-effect free calls repeat
+                if reused and method in SAFE_TO_RETRY:
+                    with self.lock:
+                        self.stats['retries'] += 1
+                    continue
+                with self.lock:
+                    self.stats['errors'] += 1
+                raise HardwareUnavailable(f"Hardware daemon call {method} failed: {e}")
+            self._return(conn)
+            _raise_for(response)
+            return response.get('result')
+
+    def stream(self, method, **params):
+        """Generator over a streaming method's data items, on a connection of its own.
+        Errors in the request itself are raised here, before the generator is returned."""
+        conn = _Connection(self.path, self.timeout)
+        try:
+            conn.send({'method': method, 'params': params}, self.timeout)
+            _raise_for(conn.receive())
+            # Events can be minutes apart; a daemon that goes away closes the socket
+            conn.sock.settimeout(None)
+        except Exception:
+            conn.close()
+            raise
+
+        def items():
+            try:
+                while True:
+                    try:
+                        message = conn.receive()
+                    except (OSError, ValueError):
+                        return
+                    yield message.get('data')
+            finally:
+                conn.close()
+        return items()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, idle=self.idle.qsize(), pool_size=self.pool_size, socket=self.path)
@@ -0,0 +1,384 @@
+# Hardware daemon: the one process per station that opens the MFRC522 readers and the
+# card dispenser, and owns everything that must have a single writer (the write-behind
+# journal, replica sync, enrollment and batch jobs). HTTP workers talk to it over a
+# Unix domain socket (protocol in hardware_client.py), so they hold no hardware state
+# and any number of them can run:
+#   python hardware_daemon.py
+#   gunicorn 'app:create_app()'          (settings in gunicorn.conf.py)
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import uuid
+
+from batch_issue import BatchIssueJob, BatchIssuer, make_dispenser
+from config import Config
+import credit_ledger
+from enroll import EnrollJob
+from lanes import Station
+import metrics
+from reader_actor import PRIORITY_READ, PRIORITY_WRITE, ReaderBusy
+from rfid_handler import CardSessionError, retry_delay
+from startup import NotReady, Startup
+
+RPC_SECONDS = metrics.histogram('hardware_rpc_duration_seconds', "Hardware daemon call latency", ['method'])
+RPC_ERRORS = metrics.counter('hardware_rpc_errors_total', "Hardware daemon calls answered with an error", ['method'])
+
+class RpcError(Exception):
+    """Error returned to the caller with an HTTP-like status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def issue_card(rfid, roll_number, permissions, credits=None):
+    """Reader command: confirm the card, read its ID and write the record and credits;
+    (success, message, card_id, session_id)"""
+    # One WUPA + anticollision both confirms the card and reads its ID (a separate presence
+    # check first would leave the card READY, and READY cards drop the next WUPA). Probe
+    # with a short backoff until the card lands, up to CARD_WAIT in total.
+    deadline = time.monotonic() + Config.CARD_WAIT
+    attempt = 0
+    card_id = rfid.poll_card()
+    while not card_id and time.monotonic() < deadline:
+        time.sleep(retry_delay(attempt))
+        attempt += 1
+        card_id = rfid.poll_card()
+    if not card_id:
+        return False, 'No card detected. Please place card on reader.', None, None
+
+    success, message = rfid.write_card(roll_number, permissions, credits)
+    if not success:
+        return False, f'Failed to write card: {message}', card_id, None
+    # The record just written is the one cached for the card in the field
+    record = rfid.records.in_field(card_id)
+    return True, message, card_id, record.session_id if record else None
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One client connection: requests are answered in order until the client hangs up"""
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        daemon = self.server.hardware
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                method = request['method']
+                params = request.get('params') or {}
+            except (ValueError, KeyError, TypeError):
+                self._send({'ok': False, 'error': 'Malformed request', 'status': 400})
+                continue
+            if method in daemon.streams:
+                self._stream(daemon.streams[method], params)
+                return
+            self._send(daemon.dispatch(method, params))
+
+    def _stream(self, open_stream, params):
+        try:
+            items = open_stream(**params)
+        except RpcError as e:
+            self._send({'ok': False, 'error': str(e), 'status': e.status})
+            return
+        try:
+            self._send({'ok': True})
+            for item in items:
+                self._send({'data': item})
+        except OSError:
+            pass    # client went away
+        finally:
+            items.close()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class HardwareDaemon:
+    """RPC server over the station's lanes, dispenser and background jobs
+
+    Each rpc_<name> method is callable by clients as <name> with keyword
+    params; results must be JSON-serializable.
+    """
+
+    def __init__(self, path=None, station=None):
+        self.path = path or Config.HARDWARE_SOCKET
+        self.station = station
+        self.dispenser = None   # opened on the first batch; opening the port resets the ESP32
+        self.enroll_jobs = {}
+        self.batch_jobs = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        # The socket is up at once; readers and Firestore come up behind it in parallel
+        self.startup = Startup()
+        self.startup.add('readers', self._start_readers)
+        self.startup.add('firestore', self._start_firestore, retry=Config.STARTUP_RETRY)
+        self.startup.add('firestore_warm_up', self._warm_up_firestore, retry=Config.STARTUP_RETRY, gating=False)
+        self.methods = {name[4:]: getattr(self, name) for name in dir(self) if name.startswith('rpc_')}
+        self.streams = {'events': self.stream_events}
+
+    # Lifecycle
+
+    def _bind(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise RuntimeError(f"Another hardware daemon is listening on {self.path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.path)    # left behind by a daemon that did not shut down cleanly
+            finally:
+                probe.close()
+        self.server = _Server(self.path, _Handler)
+        self.server.hardware = self
+        os.chmod(self.path, 0o660)
+
+    def _start_readers(self):
+        if self.station is None:
+            self.station = Station()
+        # One detection loop per lane feeds every client's events and card_status
+        self.station.start()
+        return self.station
+
+    def _start_firestore(self):
+        # Ready once the client, replica and write journal exist; issuing works offline from them
+        import firebase_config
+        firebase_config.start_sync()
+        return firebase_config
+
+    def _warm_up_firestore(self):
+        self.startup.get('firestore', timeout=None).warm_up()
+
+    def start(self):
+        """Serve in a thread right away; the hardware and Firestore initialize in the background"""
+        self._bind()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='hardware-rpc')
+        self.thread.start()
+        print(f"Hardware daemon listening on {self.path}")
+        self.startup.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        for job in self.batch_jobs.values():
+            job.issuer.stop()
+        if self.dispenser is not None:
+            self.dispenser.close()
+        firebase_config = self.startup.subsystems['firestore'].result
+        if firebase_config is not None:
+            firebase_config.stop_sync()
+        if self.station is not None:
+            self.station.stop()
+
+    def dispatch(self, method, params):
+        fn = self.methods.get(method)
+        if fn is None:
+            return {'ok': False, 'error': f'Unknown method {method}', 'status': 404}
+        with RPC_SECONDS.time(method):
+            try:
+                return {'ok': True, 'result': fn(**params)}
+            except RpcError as e:
+                RPC_ERRORS.inc(method)
+                return {'ok': False, 'error': str(e), 'status': e.status}
+            except ReaderBusy as e:
+                RPC_ERRORS.inc(method)
+                return {'ok': False, 'error': str(e), 'busy': True, 'status': 503}
+            except Exception as e:
+                RPC_ERRORS.inc(method)
+                print(f"Hardware daemon {method} error: {e}")
+                traceback.print_exc()
+                return {'ok': False, 'error': str(e), 'status': 500}
+
+    def _needs(self, name):
+        try:
+            return self.startup.get(name, timeout=Config.STARTUP_WAIT)
+        except NotReady as e:
+            raise RpcError(str(e), 503)
+
+    def firestore(self):
+        """firebase_config, once the client is up and the write queue is running"""
+        return self._needs('firestore')
+
+    def lane(self, lane_id):
+        lane = self._needs('readers').lane(int(lane_id))
+        if lane is None:
+            raise RpcError(f'Unknown lane {lane_id}', 404)
+        return lane
+
+    # Readers
+
+    def rpc_ping(self):
+        return {'pid': os.getpid(), 'ready': self.startup.ready(), 'startup': self.startup.status()}
+
+    def rpc_lanes(self):
+        return self._needs('readers').status()
+
+    def rpc_card_status(self, lane=0):
+        """Card currently in the field, as last seen by the card monitor (no SPI traffic)"""
+        card_id = self.lane(lane).events.card_id
+        return {'detected': bool(card_id), 'card_id': card_id}
+
+    def rpc_start_detection(self, lane=0):
+        monitor = self.lane(lane).monitor
+        monitor.scheduler.set_attentive(True)
+        return monitor.status()
+
+    def rpc_stop_detection(self, lane=0):
+        monitor = self.lane(lane).monitor
+        monitor.scheduler.set_attentive(False)
+        monitor.scheduler.note_activity()
+        return monitor.status()
+
+    def rpc_polling(self, lane=0):
+        return self.lane(lane).monitor.status()
+
+    def rpc_reader(self, lane=0):
+        lane = self.lane(lane)
+        return dict(lane.reader.status(), record_cache=lane.rfid.records.status())
+
+    def rpc_read_card(self, lane=0):
+        return self.lane(lane).reader.call(lambda rfid: rfid.read_card(), priority=PRIORITY_READ,
+                                           timeout=Config.READER_READ_TIMEOUT)
+
+    def rpc_write_card(self, roll_number, permissions, lane=0, credits=None):
+        """Issue a card on one lane and journal the card ID for the user and the credits granted"""
+        reader = self.lane(lane).reader
+        # JSON object keys are strings
+        credits = {int(machine_id): int(amount) for machine_id, amount in (credits or {}).items()}
+        # Presence check, card ID and write run back to back at write priority
+        success, message, card_id, session_id = reader.call(
+            issue_card, roll_number, permissions, credits,
+            priority=PRIORITY_WRITE, timeout=Config.READER_WRITE_TIMEOUT)
+        if not success:
+            return {'success': False, 'error': message}
+        # Journaled before we answer; committed to Firestore in the background
+        try:
+            self.firestore().queue_user_update(roll_number, {
+                'card_id': str(card_id),
+                'card_written_at': time.time()
+            })
+            if credits and session_id is not None and reader.rfid.CREDIT_BLOCKS:
+                credit_ledger.queue_grants(card_id, roll_number, session_id, credits)
+        except Exception as db_error:
+            print(f"Database update error: {db_error}")
+            return {'success': False, 'error': f'Card written but not recorded: {db_error}'}
+        return {'success': True, 'card_id': card_id}
+
+    def rpc_read_credits(self, lane=0):
+        """Credit balances on the card, recorded in the ledger as seen at the station"""
+        try:
+            read = self.lane(lane).reader.call(lambda rfid: rfid.read_credits(), priority=PRIORITY_READ,
+                                               timeout=Config.READER_READ_TIMEOUT)
+        except CardSessionError as e:
+            raise RpcError(str(e), 409)
+        if read and read['session_id'] and read['credits']:
+            self.firestore()
+            credit_ledger.queue_entries(credit_ledger.observed_entries(read['card_id'], read['session_id'], read['credits']))
+        return read
+
+    def rpc_record_debits(self, debits):
+        """Debits reported by access nodes; all or nothing, so a node can resend the batch"""
+        try:
+            entries = [credit_ledger.debit_entry(report) for report in debits]
+        except ValueError as e:
+            raise RpcError(str(e), 400)
+        self.firestore()
+        return credit_ledger.queue_entries(entries)
+
+    def stream_events(self, lane=0):
+        """SSE chunks for one client: card_arrived / card_removed as the card monitor sees them"""
+        return self.lane(lane).events.stream()
+
+    # Shared state
+
+    def rpc_queue_update(self, roll_number, fields):
+        return self.firestore().queue_user_update(roll_number, fields)
+
+    def rpc_write_queue(self):
+        return self.firestore().write_queue.status()
+
+    def rpc_replica(self):
+        user_replica = self.firestore().user_replica
+        if not user_replica:
+            return {'enabled': False}
+        return dict(user_replica.status(), enabled=True)
+
+    def rpc_metrics(self):
+        return metrics.collect()
+
+    # Background jobs
+
+    def rpc_enroll_start(self, path, fmt='csv', dry_run=False, reset_pins=False, resume=False):
+        self.firestore()
+        job = EnrollJob(uuid.uuid4().hex[:8], path, fmt=fmt, dry_run=dry_run,
+                        reset_pins=reset_pins, resume=resume)
+        self.enroll_jobs[job.job_id] = job
+        job.start()
+        return job.job_id
+
+    def rpc_enroll_status(self, job_id):
+        job = self.enroll_jobs.get(job_id)
+        if not job:
+            raise RpcError('Unknown job', 404)
+        return job.status()
+
+    def rpc_batch_start(self, roll_numbers, lane=0):
+        lane = self.lane(lane)
+        self.firestore()
+        with self.lock:
+            if any(job.is_alive() for job in self.batch_jobs.values()):
+                raise RpcError('A batch is already running', 409)
+            if self.dispenser is None:
+                self.dispenser = make_dispenser(lane.rfid.mfrc.spi)
+            job = BatchIssueJob(uuid.uuid4().hex[:8], BatchIssuer(roll_numbers, self.dispenser, lane.reader))
+            self.batch_jobs[job.job_id] = job
+            job.start()
+        return job.job_id
+
+    def rpc_batch_status(self, job_id):
+        job = self.batch_jobs.get(job_id)
+        if not job:
+            raise RpcError('Unknown job', 404)
+        return job.status()
+
+    def rpc_batch_stop(self, job_id):
+        job = self.batch_jobs.get(job_id)
+        if not job:
+            raise RpcError('Unknown job', 404)
+        job.issuer.stop()
+        return True
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(description="Own the station hardware and serve it to the HTTP workers")
+    parser.add_argument('--socket', help=f"Unix socket path (default {Config.HARDWARE_SOCKET})")
+    args = parser.parse_args()
+
+    daemon = HardwareDaemon(path=args.socket)
+    # systemd stops the service with SIGTERM; shut down like on Ctrl-C
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        daemon.start()
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        daemon.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from card_events import CardEvents, CardMonitor
+from config import Config
+from reader_actor import PRIORITY_WRITE, ReaderActor
+from rfid_handler import RFIDHandler, SharedBus, make_transport
+
+def parse_lanes(spec=None):
+    """'bus:device:rst_pin[:irq_pin]' entries (comma separated) as a list of dicts"""
+    spec = spec if spec is not None else Config.RFID_LANES
+    lanes = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        fields = entry.split(':')
+        if len(fields) not in (3, 4):
+            raise ValueError(f"Bad lane spec '{entry}', expected bus:device:rst_pin[:irq_pin]")
+        irq = fields[3] if len(fields) == 4 else ''
+        lanes.append({
+            'bus': int(fields[0]),
+            'device': int(fields[1]),
+            'rst_pin': int(fields[2]),
+            'irq_pin': int(irq) if irq else None,
+        })
+    if not lanes:
+        raise ValueError("No RFID lanes configured")
+    seen = set()
+    for lane in lanes:
+        for key in (('cs', lane['bus'], lane['device']), ('pin', lane['rst_pin']), ('pin', lane['irq_pin'])):
+            if key[-1] is None:
+                continue
+            if key in seen:
+                raise ValueError(f"Lane spec reuses {key[0]} {key[1:]}")
+            seen.add(key)
+    return lanes
+
+class Lane:
+    """One issuing lane: an MFRC522 on its own chip-select, its reader thread and card monitor"""
+
+    def __init__(self, lane_id, bus=0, device=0, rst_pin=25, irq_pin=None, shared_bus=None, backend=None,
+                 trace_path=None):
+        self.lane_id = lane_id
+        self.spec = {'bus': bus, 'device': device, 'rst_pin': rst_pin, 'irq_pin': irq_pin}
+        transport = make_transport(backend, rst_pin=rst_pin, irq_pin=irq_pin, bus=bus, device=device,
+                                   shared_bus=shared_bus, trace_path=trace_path)
+        self.rfid = RFIDHandler(transport=transport)
+        # Only this lane's reader thread touches its MFRC522; routes and the monitor submit commands
+        self.reader = ReaderActor(self.rfid, name=f'rfid-reader-{lane_id}')
+        self.reader.start()
+        self.events = CardEvents()
+        self.monitor = CardMonitor(self.reader, self.events)
+
+    def start(self):
+        self.monitor.start()
+
+    def stop(self):
+        self.monitor.stop()
+        try:
+            self.reader.call(lambda rfid: rfid.cleanup(), priority=PRIORITY_WRITE, timeout=5)
+        except Exception as e:
+            print(f"Lane {self.lane_id} cleanup error: {e}")
+        self.reader.stop()
+
+    def status(self):
+        return {
+            'lane': self.lane_id,
+            'spec': self.spec,
+            'card_id': self.events.card_id,
+            'polling': self.monitor.status(),
+            'reader': self.reader.status(),
+        }
+
+class Station:
+    """All lanes of this station. Lanes on the same SPI bus share its transfers fairly."""
+
+    def __init__(self, specs=None, backend=None):
+        specs = specs if specs is not None else parse_lanes()
+        per_bus = collections.Counter(spec['bus'] for spec in specs)
+        # A bus with one reader needs no arbitration
+        self.buses = {bus: SharedBus(bus) for bus, count in per_bus.items() if count > 1}
+
+        def make_lane(lane_id, spec):
+            trace_path = Config.RFID_TRACE_PATH
+            if trace_path and len(specs) > 1:
+                trace_path = f"{trace_path}.lane{lane_id}"
+            return Lane(lane_id, shared_bus=self.buses.get(spec['bus']), backend=backend,
+                        trace_path=trace_path, **spec)
+
+        # Reader init is mostly reset waits; the readers can wait at the same time
+        with ThreadPoolExecutor(max_workers=len(specs)) as pool:
+            futures = [pool.submit(make_lane, lane_id, spec) for lane_id, spec in enumerate(specs)]
+        self.lanes = {lane_id: future.result() for lane_id, future in enumerate(futures)}
+        print(f"Station: {len(self.lanes)} lane(s) on SPI bus(es) {sorted(per_bus)}")
+        metrics.add_collector(self.collect_metrics)
+
+    def lane(self, lane_id):
+        return self.lanes.get(lane_id)
+
+    def start(self):
+        for lane in self.lanes.values():
+            lane.start()
+
+    def stop(self):
+        for lane in self.lanes.values():
+            lane.stop()
+
+    def collect_metrics(self):
+        """Counters the transports and reader threads keep anyway, read at scrape time"""
+        transactions, transferred, antenna, depth = [], [], [], []
+        for lane_id, lane in self.lanes.items():
+            labels = {'lane': lane_id}
+            spi = lane.rfid.mfrc.spi
+            transactions.append((labels, getattr(spi, 'transactions', 0)))
+            transferred.append((labels, getattr(spi, 'bytes_transferred', 0)))
+            antenna.append((labels, round(lane.rfid.mfrc.antenna_time(), 3)))
+            depth.append((labels, lane.reader.queue.qsize()))
+        families = [
+            ('rfid_spi_transactions_total', 'counter', "SPI transfers to the MFRC522", transactions),
+            ('rfid_spi_bytes_total', 'counter', "Bytes clocked over SPI", transferred),
+            ('rfid_antenna_on_seconds_total', 'counter', "Time the RF field has been on", antenna),
+            ('rfid_reader_queue_depth', 'gauge', "Commands waiting for the reader thread", depth),
+        ]
+        if self.buses:
+            families.append(('rfid_spi_bus_wait_seconds_total', 'counter', "Time lanes waited for a shared SPI bus",
+                             [({'bus': bus.name}, round(bus.wait_time, 6)) for bus in self.buses.values()]))
+        return families
+
+    def status(self):
+        return {
+            'lanes': [lane.status() for lane in self.lanes.values()],
+            'buses': [bus.status() for bus in self.buses.values()],
+        }
@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+
+from config import Config
+
+# Used when neither the registry file nor Firestore is available
+DEFAULT_MACHINES = [
+    {'id': 1, 'name': '3D Printer'},
+    {'id': 2, 'name': 'Laser Cutter'},
+    {'id': 3, 'name': 'CNC Machine'},
+    {'id': 4, 'name': 'PCB Mill'},
+    {'id': 5, 'name': 'Soldering Station'},
+    {'id': 6, 'name': 'Drill Press'},
+    {'id': 7, 'name': 'Band Saw'},
+    {'id': 8, 'name': 'Lathe'},
+    {'id': 9, 'name': 'Milling Machine'},
+    {'id': 10, 'name': 'Plasma Cutter'},
+]
+
+# What a machine's usage credits count; the access node debits in the same unit
+CREDIT_UNITS = ('sessions', 'minutes')
+
+class MachineRegistry:
+    """Machine name <-> ID mapping; machine ID n is permission bit n-1
+
+    An entry with "credits" (and "credit_unit", 'sessions' by default) makes the
+    machine metered: every card issued with access to it gets that many credits.
+    """
+
+    def __init__(self, source=None, path=None, collection='machines', max_machines=None):
+        from rfid_handler import CardRecord
+        self.source = source or Config.MACHINE_REGISTRY_SOURCE
+        self.path = path or Config.MACHINE_REGISTRY_FILE
+        self.collection = collection
+        self.max_machines = max_machines or CardRecord.MAX_MACHINES
+        self.check_interval = Config.MACHINE_REGISTRY_CHECK_INTERVAL
+        self.lock = threading.Lock()
+        self.machines = {}    # id -> name
+        self.name_bits = {}   # lower-cased name -> bit mask
+        self.credits = {}     # id -> (credits granted at issuance, unit)
+        self.version = 0
+        self.reloads = 0
+        self._mtime = None
+        self._last_check = 0.0
+        self._watch = None
+
+        if self.source == 'firestore':
+            self._watch_firestore()
+        else:
+            self._load_file()
+
+    def _build(self, entries, origin):
+        """Swap in a new mapping from [{'id': n, 'name': ...}] entries"""
+        machines = {}
+        name_bits = {}
+        credits = {}
+        for entry in entries:
+            try:
+                machine_id = int(entry['id'])
+                name = str(entry['name']).strip()
+            except (KeyError, TypeError, ValueError):
+                print(f"Machine registry: skipping bad entry {entry}")
+                continue
+            if not 1 <= machine_id <= self.max_machines:
+                print(f"Machine registry: ID {machine_id} outside 1-{self.max_machines}, skipping {name}")
+                continue
+            if machine_id in machines:
+                print(f"Machine registry: duplicate ID {machine_id} ({machines[machine_id]} / {name})")
+                continue
+            machines[machine_id] = name
+            name_bits[name.lower()] = 1 << (machine_id - 1)
+            for alias in entry.get('aliases', []):
+                name_bits[str(alias).strip().lower()] = 1 << (machine_id - 1)
+            if entry.get('credits') is not None:
+                unit = entry.get('credit_unit', 'sessions')
+                try:
+                    amount = int(entry['credits'])
+                except (TypeError, ValueError):
+                    amount = -1
+                if amount < 0 or unit not in CREDIT_UNITS:
+                    print(f"Machine registry: bad credits for {name}, not metered")
+                else:
+                    credits[machine_id] = (amount, unit)
+
+        with self.lock:
+            self.machines = machines
+            self.name_bits = name_bits
+            self.credits = credits
+            self.version += 1
+        print(f"Machine registry: {len(machines)} machines loaded from {origin}")
+
+    def _load_file(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            if self.version == 0:
+                self._build(DEFAULT_MACHINES, 'defaults')
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Machine registry: could not read {self.path}: {e}")
+            if self.version == 0:
+                self._build(DEFAULT_MACHINES, 'defaults')
+            return
+        self._mtime = mtime
+        if self.version:
+            self.reloads += 1
+        self._build(entries, self.path)
+
+    def _watch_firestore(self):
+        """Load the collection and keep it current through a snapshot listener"""
+        try:
+            from firebase_config import db
+        except Exception as e:
+            print(f"Machine registry: Firestore unavailable ({e}), using {self.path}")
+            self.source = 'file'
+            self._load_file()
+            return
+
+        loaded = threading.Event()
+
+        def on_snapshot(docs, changes, read_time):
+            if loaded.is_set():
+                self.reloads += 1
+            self._build([doc.to_dict() for doc in docs], f"Firestore '{self.collection}'")
+            loaded.set()
+
+        self._watch = db.collection(self.collection).on_snapshot(on_snapshot)
+        if not loaded.wait(timeout=10):
+            print("Machine registry: Firestore snapshot timed out, using defaults until it arrives")
+            self._build(DEFAULT_MACHINES, 'defaults')
+
+    def refresh(self):
+        """Pick up registry file edits; Firestore changes arrive through the listener"""
+        if self.source != 'file':
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        self._load_file()
+
+    def bit_for(self, machine):
+        """Permission bit for a machine name or ID, or 0 if unknown"""
+        self.refresh()
+        if isinstance(machine, str) and not machine.strip().isdigit():
+            return self.name_bits.get(machine.strip().lower(), 0)
+        try:
+            machine_id = int(machine)
+        except (TypeError, ValueError):
+            return 0
+        return 1 << (machine_id - 1) if 1 <= machine_id <= self.max_machines else 0
+
+    def mask_for(self, machines):
+        """Integer permission bitmask for a list of machine names and/or IDs"""
+        mask = 0
+        for machine in machines or []:
+            bit = self.bit_for(machine)
+            if not bit:
+                print(f"Warning: Could not process machine: {machine}")
+            mask |= bit
+        return mask
+
+    def names_for(self, mask):
+        """Machine names for the set bits of a permission mask (unknown IDs as 'Machine n')"""
+        self.refresh()
+        names = []
+        machine_id = 1
+        while mask:
+            if mask & 1:
+                names.append(self.machines.get(machine_id, f"Machine {machine_id}"))
+            mask >>= 1
+            machine_id += 1
+        return names
+
+    def name_for(self, machine_id):
+        """Name of a machine ID ('Machine n' if unregistered), None for IDs outside 1..max_machines"""
+        self.refresh()
+        if not 1 <= machine_id <= self.max_machines:
+            return None
+        return self.machines.get(machine_id, f"Machine {machine_id}")
+
+    def credits_for(self, mask, overrides=None):
+        """{machine ID: credits} to provision for a permission mask: the registry default of
+        each permitted metered machine, or the user's own amount from overrides
+        ({machine name or ID: credits})"""
+        self.refresh()
+        grants = {machine_id: amount for machine_id, (amount, _) in self.credits.items()
+                  if mask >> (machine_id - 1) & 1}
+        for machine, amount in (overrides or {}).items():
+            bit = self.bit_for(machine)
+            if not bit or not mask & bit:
+                continue
+            try:
+                grants[bit.bit_length()] = max(0, int(amount))
+            except (TypeError, ValueError):
+                print(f"Warning: bad credit amount {amount!r} for {machine}")
+        return grants
+
+    def credit_unit(self, machine_id):
+        """'sessions' or 'minutes' for a metered machine, else None"""
+        entry = self.credits.get(machine_id)
+        return entry[1] if entry else None
+
+    def to_list(self):
+        self.refresh()
+        machines = []
+        for machine_id, name in sorted(self.machines.items()):
+            machine = {'id': machine_id, 'name': name}
+            if machine_id in self.credits:
+                machine['credits'], machine['credit_unit'] = self.credits[machine_id]
+            machines.append(machine)
+        return machines
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Process-wide registry, created on first use"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MachineRegistry()
+    return _registry
@@ -0,0 +1,175 @@
+# In-process counters and histograms, rendered in the Prometheus text format at GET /metrics.
+# Metrics are created once at import time by the module that updates them:
+#   WRITES = metrics.counter('rfid_write_attempts_total', "Record write attempts", ['result'])
+#   WRITES.inc('ok')
+# Values that components already count (SPI transactions, queue depths) are read at
+# scrape time through collectors instead of being updated on the hot path.
+import bisect
+import threading
+import time
+
+# Seconds; spans an empty-field probe (~1 ms) up to a stalled Firestore call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # An unlabelled counter is exported as 0 before its first increment
+        self.values = {} if self.labelnames else {(): 0}
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        with self.lock:
+            samples = [(self.name, dict(zip(self.labelnames, labelvalues)), value)
+                       for labelvalues, value in sorted(self.values.items())]
+        return (self.name, 'counter', self.documentation, samples)
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.values = {}    # labelvalues -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labelvalues)
+            if entry is None:
+                entry = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labelvalues, errors=None):
+        """Context manager observing the duration of its block; errors (a Counter with
+        the same labels) is incremented if the block raises"""
+        return _Timer(self, labelvalues, errors)
+
+    def collect(self):
+        with self.lock:
+            snapshot = sorted((labelvalues, list(counts), total) for labelvalues, (counts, total) in self.values.items())
+        samples = []
+        for labelvalues, counts, total in snapshot:
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=_number(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return (self.name, 'histogram', self.documentation, samples)
+
+class _Timer:
+    def __init__(self, histogram, labelvalues, errors=None):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+        self.errors = errors
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(*self.labelvalues)
+        return False
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(self, collect):
+        """collect() -> [(name, type, help, [(labels dict, value), ...]), ...], called per scrape"""
+        with self.lock:
+            self.collectors.append(collect)
+
+    def collect(self, const_labels=None):
+        """[(name, type, help, [(sample name, labels, value), ...]), ...] for every metric and
+        collector; const_labels are added to each sample. JSON-safe, see render(extra)."""
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+            collectors = list(self.collectors)
+        families = [metric.collect() for metric in metrics]
+        for collect in collectors:
+            try:
+                collected = collect()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, kind, documentation, samples in collected:
+                families.append((name, kind, documentation, [(name, labels, value) for labels, value in samples]))
+        if const_labels:
+            families = [(name, kind, documentation, [(sample, dict(labels, **const_labels), value)
+                                                     for sample, labels, value in samples])
+                        for name, kind, documentation, samples in families]
+        return families
+
+    def render(self, extra=(), const_labels=None):
+        """Text exposition of this registry, merged with families collected elsewhere
+        (e.g. another process); samples of the same metric are listed together"""
+        merged = {}
+        for name, kind, documentation, samples in list(self.collect(const_labels)) + list(extra):
+            if name in merged:
+                merged[name][2].extend(samples)
+            else:
+                merged[name] = (kind, documentation, list(samples))
+        lines = []
+        for name, (kind, documentation, samples) in merged.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples:
+                lines.append(f"{sample}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
+collect = REGISTRY.collect
+render = REGISTRY.render
+
+# Shared by every module that talks to Firestore
+FIRESTORE_SECONDS = histogram('firestore_request_duration_seconds', "Firestore call latency", ['operation'])
+FIRESTORE_ERRORS = counter('firestore_errors_total', "Firestore calls that raised", ['operation'])
+
+def firestore_call(operation):
+    """with firestore_call('fetch_user'): ... times the block and counts it as an error if it raises"""
+    return FIRESTORE_SECONDS.time(operation, errors=FIRESTORE_ERRORS)
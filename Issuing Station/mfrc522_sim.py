@@ -0,0 +1,621 @@
+# Register-level MFRC522 simulator with a virtual MIFARE Classic 1K card.
+# Implements the same xfer2()/reset()/close() interface as rfid_handler.SpiTransport,
+# so MFRC522/RFIDHandler (and the Flask app on top) run unmodified off the Pi:
+#   RFID_BACKEND=sim python app.py
+import time
+
+# Register addresses (unshifted, as in the datasheet)
+COMMAND = 0x01
+COM_IEN = 0x02
+DIV_IEN = 0x03
+COM_IRQ = 0x04
+DIV_IRQ = 0x05
+ERROR = 0x06
+STATUS1 = 0x07
+STATUS2 = 0x08
+FIFO_DATA = 0x09
+FIFO_LEVEL = 0x0A
+WATER_LEVEL = 0x0B
+CONTROL = 0x0C
+BIT_FRAMING = 0x0D
+COLL = 0x0E
+MODE = 0x11
+TX_MODE = 0x12
+RX_MODE = 0x13
+TX_CONTROL = 0x14
+CRC_RESULT_H = 0x21
+CRC_RESULT_L = 0x22
+T_MODE = 0x2A
+T_PRESCALER = 0x2B
+T_RELOAD_H = 0x2C
+T_RELOAD_L = 0x2D
+T_COUNTER_H = 0x2E
+T_COUNTER_L = 0x2F
+VERSION = 0x37
+
+READ_ONLY = (ERROR, STATUS1, CRC_RESULT_H, CRC_RESULT_L, T_COUNTER_H, T_COUNTER_L, VERSION)
+
+# Power-on values of the registers that do not reset to zero
+RESET_VALUES = {
+    COMMAND: 0x20, COM_IEN: 0x80, COM_IRQ: 0x14, STATUS1: 0x21, WATER_LEVEL: 0x08,
+    CONTROL: 0x10, COLL: 0x80, MODE: 0x3F, TX_CONTROL: 0x80, 0x16: 0x10, 0x17: 0x84,
+    0x18: 0x84, 0x19: 0x4D, 0x1C: 0x62, 0x1F: 0xEB, CRC_RESULT_H: 0xFF, CRC_RESULT_L: 0xFF,
+    0x24: 0x26, 0x26: 0x48, 0x27: 0x88, 0x28: 0x20, 0x29: 0x20, VERSION: 0x92,
+}
+
+# Chip commands
+CMD_IDLE = 0x00
+CMD_MEM = 0x01
+CMD_CALC_CRC = 0x03
+CMD_TRANSMIT = 0x04
+CMD_RECEIVE = 0x08
+CMD_TRANSCEIVE = 0x0C
+CMD_MF_AUTHENT = 0x0E
+CMD_SOFT_RESET = 0x0F
+
+COMMAND_NAMES = {
+    CMD_IDLE: 'Idle', CMD_MEM: 'Mem', CMD_CALC_CRC: 'CalcCRC', CMD_TRANSMIT: 'Transmit',
+    CMD_RECEIVE: 'Receive', CMD_TRANSCEIVE: 'Transceive', CMD_MF_AUTHENT: 'MFAuthent',
+    CMD_SOFT_RESET: 'SoftReset',
+}
+
+# ComIrqReg / DivIrqReg / ErrorReg / Status2Reg bits
+TX_IRQ = 0x40
+RX_IRQ = 0x20
+IDLE_IRQ = 0x10
+ERR_IRQ = 0x02
+TIMER_IRQ = 0x01
+CRC_IRQ = 0x04
+BUFFER_OVFL = 0x10
+CRC_ERR = 0x04
+PROTOCOL_ERR = 0x01
+MF_CRYPTO1_ON = 0x08
+
+FIFO_SIZE = 64
+CARRIER_HZ = 13.56e6
+BIT_TIME = 128 / CARRIER_HZ          # 106 kbit/s
+FRAME_DELAY = 1236 / CARRIER_HZ      # PICC frame delay time
+AUTH_TIME = 0.0012                   # three-pass Crypto1 authentication
+EEPROM_WRITE_TIME = 0.0025           # PICC programming time before the write ACK
+
+CRC_PRESETS = {0: 0x0000, 1: 0x6363, 2: 0xA671, 3: 0xFFFF}
+
+# PICC commands and answers
+PICC_REQA = 0x26
+PICC_WUPA = 0x52
+PICC_SEL_CL1 = 0x93
+PICC_READ = 0x30
+PICC_WRITE = 0xA0
+PICC_HALT = 0x50
+PICC_AUTH_A = 0x60
+PICC_AUTH_B = 0x61
+PICC_DECREMENT = 0xC0
+PICC_INCREMENT = 0xC1
+PICC_RESTORE = 0xC2
+PICC_TRANSFER = 0xB0
+VALUE_COMMANDS = {PICC_DECREMENT: 'decrement', PICC_INCREMENT: 'increment', PICC_RESTORE: 'restore'}
+ACK = 0x0A
+NAK_NOT_ALLOWED = 0x04
+NAK_TRANSMISSION = 0x05
+
+DEFAULT_UID = [0xDE, 0xAD, 0xBE, 0xEF]
+DEFAULT_KEY = [0xFF] * 6
+TRANSPORT_ACCESS = [0xFF, 0x07, 0x80, 0x69]
+
+# Access conditions C1C2C3 -> keys allowed to (read, write) a data block
+DATA_ACCESS = {
+    0b000: ('AB', 'AB'), 0b010: ('AB', ''), 0b100: ('AB', 'B'), 0b110: ('AB', 'B'),
+    0b001: ('AB', ''), 0b011: ('B', 'B'), 0b101: ('B', ''), 0b111: ('', ''),
+}
+# Access conditions C1C2C3 -> key allowed to rewrite the sector trailer (simplified:
+# the whole trailer is written when the key may write key A or the access bits)
+TRAILER_WRITE = {0b000: 'A', 0b001: 'A', 0b100: 'B', 0b011: 'B', 0b101: 'B'}
+# Access conditions C1C2C3 -> keys allowed to increment, and to decrement/transfer/restore
+VALUE_ACCESS = {0b000: ('AB', 'AB'), 0b110: ('B', 'AB'), 0b001: ('', 'AB')}
+KEY_B_READABLE = (0b000, 0b010, 0b001)
+
+def crc_a(data, preset=0x6363):
+    """Bitwise ISO 14443-A CRC (reference model of the chip's coprocessor), LSB first"""
+    crc = preset
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x01:
+                crc = (crc >> 1) ^ 0x8408
+            else:
+                crc >>= 1
+    return [crc & 0xFF, crc >> 8]
+
+def frame_time(bits):
+    """Air time of a 106 kbit/s frame including parity, SOF and EOF"""
+    return (bits + bits // 8 + 2) * BIT_TIME
+
+class MifareClassic1K:
+    """Virtual MIFARE Classic 1K PICC: 16 sectors x 4 blocks behind the ISO 14443-3 state machine"""
+    IDLE = 'IDLE'
+    READY = 'READY'
+    ACTIVE = 'ACTIVE'
+    HALT = 'HALT'
+
+    ATQA = [0x04, 0x00]
+    SAK = 0x08
+
+    def __init__(self, uid=None, key_a=None, key_b=None):
+        self.uid = list(uid or DEFAULT_UID)
+        self.bcc = self.uid[0] ^ self.uid[1] ^ self.uid[2] ^ self.uid[3]
+        self.blocks = [[0] * 16 for _ in range(64)]
+        self.blocks[0] = self.uid + [self.bcc, self.SAK] + self.ATQA[::-1] + [0x62, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69]
+        for sector in range(16):
+            self.blocks[sector * 4 + 3] = list(key_a or DEFAULT_KEY) + TRANSPORT_ACCESS + list(key_b or DEFAULT_KEY)
+        self.frames = 0
+        self.power_off()
+
+    def power_off(self):
+        """Card left the field: volatile state is lost"""
+        self.state = self.IDLE
+        self.halted = False
+        self.auth_sector = None
+        self.auth_key = None
+        self._pending_write = None
+        self._pending_value = None
+        self.transfer_buffer = None
+
+    def _to_idle(self):
+        self.state = self.HALT if self.halted else self.IDLE
+        self.auth_sector = None
+        self.auth_key = None
+        self._pending_write = None
+        self._pending_value = None
+        self.transfer_buffer = None
+        return None
+
+    def access_condition(self, block):
+        """C1C2C3 bits of a block from its sector trailer"""
+        trailer = self.blocks[(block // 4) * 4 + 3]
+        index = block % 4
+        c1 = (trailer[7] >> (4 + index)) & 1
+        c2 = (trailer[8] >> index) & 1
+        c3 = (trailer[8] >> (4 + index)) & 1
+        return (c1 << 2) | (c2 << 1) | c3
+
+    def _allowed(self, block, operation):
+        if self.auth_sector != block // 4:
+            return False
+        condition = self.access_condition(block)
+        if block % 4 == 3:
+            if operation == 'read':
+                return True
+            return TRAILER_WRITE.get(condition) == self.auth_key
+        if block == 0 and operation != 'read':
+            return False
+        if operation in ('increment', 'decrement', 'restore', 'transfer'):
+            increment_keys, decrement_keys = VALUE_ACCESS.get(condition, ('', ''))
+            return self.auth_key in (increment_keys if operation == 'increment' else decrement_keys)
+        read_keys, write_keys = DATA_ACCESS[condition]
+        return self.auth_key in (read_keys if operation == 'read' else write_keys)
+
+    @staticmethod
+    def _value(block):
+        """(value, addr) if block is in value block format, else None"""
+        data, inverted, copy = block[0:4], block[4:8], block[8:12]
+        if data != copy or any(a ^ b != 0xFF for a, b in zip(data, inverted)):
+            return None
+        if block[12] != block[14] or block[13] != block[15] or block[12] ^ block[13] != 0xFF:
+            return None
+        return int.from_bytes(bytes(data), 'little', signed=True), block[12]
+
+    def _value_operand(self, data):
+        """Second frame of increment/decrement/restore: compute into the transfer buffer.
+        Accepted operands get no answer; a block that is not a value block is NAKed."""
+        command, block = self._pending_value
+        self._pending_value = None
+        current = self._value(self.blocks[block])
+        if len(data) != 6 or current is None:
+            self._to_idle()
+            return ([NAK_NOT_ALLOWED], 4, 0)
+        value, addr = current
+        operand = int.from_bytes(bytes(data[:4]), 'little', signed=True)
+        if command == PICC_INCREMENT:
+            value += operand
+        elif command == PICC_DECREMENT:
+            value -= operand
+        if not -0x80000000 <= value <= 0x7FFFFFFF:
+            self._to_idle()
+            return ([NAK_NOT_ALLOWED], 4, 0)
+        self.transfer_buffer = (value, addr)
+        return None
+
+    def _read_block(self, block):
+        data = list(self.blocks[block])
+        if block % 4 == 3:
+            # Key A never reads back, key B only under the "readable" conditions
+            data[0:6] = [0] * 6
+            if self.access_condition(block) not in KEY_B_READABLE:
+                data[10:16] = [0] * 6
+        return data
+
+    def authenticate(self, key_type, block, key, uid):
+        """Crypto1 three-pass authentication outcome (the cipher stream itself is not modelled)"""
+        self.frames += 1
+        if self.state != self.ACTIVE or list(uid[:4]) != self.uid or not 0 <= block < 64:
+            return self._to_idle()
+        trailer = self.blocks[(block // 4) * 4 + 3]
+        expected = trailer[0:6] if key_type == 'A' else trailer[10:16]
+        if list(key) != expected:
+            self._to_idle()
+            return False
+        self.auth_sector = block // 4
+        self.auth_key = key_type
+        return True
+
+    def receive(self, data, bits, encrypted=False):
+        """Handle one PCD frame; returns (data, bits, processing_delay) or None for no answer"""
+        self.frames += 1
+        if bits == 7:
+            command = data[0] & 0x7F
+            if (command == PICC_REQA and self.state == self.IDLE) or \
+                    (command == PICC_WUPA and self.state in (self.IDLE, self.HALT)):
+                self.state = self.READY
+                return (list(self.ATQA), 16, 0)
+            if self.state in (self.READY, self.ACTIVE):
+                self._to_idle()
+            return None
+
+        if self.state == self.READY:
+            if bits == 16 and data[:2] == [PICC_SEL_CL1, 0x20]:
+                return (self.uid + [self.bcc], 40, 0)
+            if bits == 72 and data[:2] == [PICC_SEL_CL1, 0x70] and \
+                    data[2:7] == self.uid + [self.bcc] and crc_a(data[:7]) == data[7:9]:
+                self.state = self.ACTIVE
+                return ([self.SAK] + crc_a([self.SAK]), 24, 0)
+            return self._to_idle()
+
+        if self.state != self.ACTIVE:
+            return None
+
+        # After authentication the card only understands Crypto1-enciphered frames
+        if encrypted != (self.auth_sector is not None):
+            return self._to_idle()
+        if bits % 8 or len(data) < 3 or crc_a(data[:-2]) != data[-2:]:
+            self._to_idle()
+            return ([NAK_TRANSMISSION], 4, 0)
+
+        if self._pending_value is not None:
+            return self._value_operand(data)
+
+        if self._pending_write is not None:
+            block = self._pending_write
+            self._pending_write = None
+            if len(data) != 18:
+                self._to_idle()
+                return ([NAK_TRANSMISSION], 4, 0)
+            self.blocks[block] = list(data[:16])
+            return ([ACK], 4, EEPROM_WRITE_TIME)
+
+        command = data[0]
+        if command == PICC_HALT and len(data) == 4:
+            self.halted = True
+            self.state = self.HALT
+            self.auth_sector = None
+            self.auth_key = None
+            return None
+        if command in (PICC_READ, PICC_WRITE) and len(data) == 4 and 0 <= data[1] < 64:
+            block = data[1]
+            if command == PICC_READ:
+                if not self._allowed(block, 'read'):
+                    self._to_idle()
+                    return ([NAK_NOT_ALLOWED], 4, 0)
+                payload = self._read_block(block)
+                return (payload + crc_a(payload), 144, 0)
+            if not self._allowed(block, 'write'):
+                self._to_idle()
+                return ([NAK_NOT_ALLOWED], 4, 0)
+            self._pending_write = block
+            return ([ACK], 4, 0)
+        if command in VALUE_COMMANDS and len(data) == 4 and 0 <= data[1] < 64:
+            block = data[1]
+            if block % 4 == 3 or not self._allowed(block, VALUE_COMMANDS[command]):
+                self._to_idle()
+                return ([NAK_NOT_ALLOWED], 4, 0)
+            self._pending_value = (command, block)
+            return ([ACK], 4, 0)
+        if command == PICC_TRANSFER and len(data) == 4 and 0 <= data[1] < 64:
+            block = data[1]
+            if block % 4 == 3 or self.transfer_buffer is None or not self._allowed(block, 'transfer'):
+                self._to_idle()
+                return ([NAK_NOT_ALLOWED], 4, 0)
+            value, addr = self.transfer_buffer
+            data = list((value & 0xFFFFFFFF).to_bytes(4, 'little'))
+            self.blocks[block] = data + [b ^ 0xFF for b in data] + data + [addr, addr ^ 0xFF, addr, addr ^ 0xFF]
+            return ([ACK], 4, EEPROM_WRITE_TIME)
+        return self._to_idle()
+
+class MFRC522Simulator:
+    """Register-level MFRC522 model speaking the chip's SPI framing
+
+    Address byte: bit 7 = read, bits 6..1 = register. Reads clock out the register
+    addressed by the previous byte, writes repeat the same address (no auto-increment).
+    With realtime=True command results only become visible once the modelled RF or
+    timer time has elapsed; otherwise they complete instantly. air_time accumulates the
+    modelled time either way. spi_latency adds a per-transfer cost (seconds) to mimic
+    spidev ioctl overhead on the Pi. With irq=True the IRQ output is modelled as wired
+    to the host, see wait_for_irq().
+    """
+    def __init__(self, card=None, realtime=False, spi_latency=0.0, irq=True):
+        self.card = card
+        self.realtime = realtime
+        self.spi_latency = spi_latency
+        self.has_irq = irq
+        self.irq_waits = 0
+        self.field_switches = 0
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.air_time = 0.0
+        self.command_counts = {}
+        self._hard_reset()
+
+    # Transport interface
+
+    def xfer2(self, data):
+        self.transactions += 1
+        self.bytes_transferred += len(data)
+        if self.spi_latency:
+            # Busy-wait: sleep() granularity is far coarser than one SPI transfer
+            deadline = time.perf_counter() + self.spi_latency
+            while time.perf_counter() < deadline:
+                pass
+        self._settle()
+        out = [0]
+        reg = (data[0] >> 1) & 0x3F
+        if data[0] & 0x80:
+            for next_address in data[1:]:
+                out.append(self._read(reg))
+                reg = (next_address >> 1) & 0x3F
+        else:
+            for value in data[1:]:
+                self._write(reg, value & 0xFF)
+                out.append(0)
+        return out
+
+    def wait_for_irq(self, timeout):
+        """Sleep until the IRQ line asserts (no SPI traffic); False on timeout"""
+        self.irq_waits += 1
+        deadline = time.monotonic() + timeout
+        while True:
+            self._settle()
+            if self.irq_asserted():
+                return True
+            now = time.monotonic()
+            if self._pending is None or now >= deadline:
+                return False
+            time.sleep(max(0.0, min(self._pending[0], deadline) - now))
+
+    def irq_asserted(self):
+        """Level of the IRQ output (ignoring IRqInv polarity)"""
+        return bool((self.regs[COM_IRQ] & self.regs[COM_IEN] & 0x7F) or
+                    (self.regs[DIV_IRQ] & self.regs[DIV_IEN] & 0x14))
+
+    def reset(self):
+        """Hard reset via the NRSTPD line"""
+        self._hard_reset()
+
+    def close(self):
+        self._pending = None
+
+    # Field control
+
+    def place_card(self, card=None):
+        """Bring a card into the field (a fresh blank 1K card by default)"""
+        self.remove_card()
+        self.card = card if card is not None else MifareClassic1K()
+        return self.card
+
+    def remove_card(self):
+        if self.card is not None:
+            self.card.power_off()
+        self.card = None
+
+    def field_on(self):
+        return (self.regs[TX_CONTROL] & 0x03) != 0 and not (self.regs[COMMAND] & 0x10)
+
+    # Register file
+
+    def _hard_reset(self):
+        self.regs = [0] * 64
+        for reg, value in RESET_VALUES.items():
+            self.regs[reg] = value
+        self.fifo = []
+        self._pending = None
+        if self.card is not None:
+            self.card.power_off()
+
+    def _status1(self):
+        value = self.regs[STATUS1] & 0x60
+        if self.irq_asserted():
+            value |= 0x10
+        if self._pending is not None:
+            value |= 0x08
+        water = self.regs[WATER_LEVEL]
+        if FIFO_SIZE - len(self.fifo) <= water:
+            value |= 0x02
+        if len(self.fifo) <= water:
+            value |= 0x01
+        return value
+
+    def _read(self, reg):
+        if reg == FIFO_DATA:
+            return self.fifo.pop(0) if self.fifo else 0
+        if reg == FIFO_LEVEL:
+            return len(self.fifo)
+        if reg == STATUS1:
+            return self._status1()
+        return self.regs[reg]
+
+    def _write(self, reg, value):
+        if reg == FIFO_DATA:
+            if len(self.fifo) < FIFO_SIZE:
+                self.fifo.append(value)
+            else:
+                self.regs[ERROR] |= BUFFER_OVFL
+        elif reg == FIFO_LEVEL:
+            if value & 0x80:
+                self.fifo = []
+                self.regs[ERROR] &= ~BUFFER_OVFL & 0xFF
+        elif reg in (COM_IRQ, DIV_IRQ):
+            # Set1 bit selects whether the marked bits are set or cleared
+            if value & 0x80:
+                self.regs[reg] |= value & 0x7F
+            else:
+                self.regs[reg] &= ~value & 0x7F
+        elif reg == STATUS2:
+            # MFCrypto1On can only be cleared by software
+            self.regs[STATUS2] = (value & 0xC0) | (self.regs[STATUS2] & 0x07) | (self.regs[STATUS2] & value & MF_CRYPTO1_ON)
+        elif reg == CONTROL:
+            if value & 0x80:
+                self._pending = None
+            elif value & 0x40:
+                self._schedule(self.timer_period(), self._timer_expired)
+        elif reg == TX_CONTROL:
+            was_on = self.field_on()
+            self.regs[TX_CONTROL] = value
+            if was_on and not self.field_on():
+                self.field_switches += 1
+                if self.card is not None:
+                    self.card.power_off()
+        elif reg == BIT_FRAMING:
+            start = (value & 0x80) and not (self.regs[BIT_FRAMING] & 0x80)
+            self.regs[BIT_FRAMING] = value
+            if start and (self.regs[COMMAND] & 0x0F) == CMD_TRANSCEIVE:
+                self._transceive()
+        elif reg == COMMAND:
+            self.regs[COMMAND] = value & 0x3F
+            self._execute(value & 0x0F)
+        elif reg not in READ_ONLY:
+            self.regs[reg] = value
+
+    # Command execution
+
+    def _execute(self, command):
+        name = COMMAND_NAMES.get(command)
+        if name is None:
+            return
+        self.command_counts[name] = self.command_counts.get(name, 0) + 1
+        self._pending = None
+        if command == CMD_SOFT_RESET:
+            card = self.card
+            self._hard_reset()
+            self.card = card
+        elif command == CMD_CALC_CRC:
+            preset = CRC_PRESETS[self.regs[MODE] & 0x03]
+            low, high = crc_a(self.fifo, preset)
+            self.fifo = []
+            self.regs[CRC_RESULT_L] = low
+            self.regs[CRC_RESULT_H] = high
+            self.regs[DIV_IRQ] |= CRC_IRQ
+            self.regs[STATUS1] |= 0x20
+        elif command == CMD_TRANSMIT:
+            self._send(expect_answer=False)
+        elif command == CMD_RECEIVE:
+            self._wait_for_timer(0.0)
+        elif command == CMD_TRANSCEIVE:
+            if self.regs[BIT_FRAMING] & 0x80:
+                self._transceive()
+        elif command == CMD_MF_AUTHENT:
+            self._mf_authent()
+        elif command in (CMD_IDLE, CMD_MEM):
+            self.regs[COMMAND] &= 0x30
+
+    def _transceive(self):
+        self._send(expect_answer=True)
+
+    def _send(self, expect_answer):
+        data = self.fifo
+        self.fifo = []
+        last_bits = self.regs[BIT_FRAMING] & 0x07
+        bits = len(data) * 8 if last_bits == 0 else (len(data) - 1) * 8 + last_bits
+        if self.regs[TX_MODE] & 0x80:
+            data = data + crc_a(data, CRC_PRESETS[self.regs[MODE] & 0x03])
+            bits += 16
+        self.regs[COM_IRQ] |= TX_IRQ
+        duration = frame_time(bits)
+
+        answer = None
+        if self.field_on() and self.card is not None and bits > 0:
+            encrypted = bool(self.regs[STATUS2] & MF_CRYPTO1_ON)
+            answer = self.card.receive(list(data), bits, encrypted)
+
+        if not expect_answer:
+            self.regs[COMMAND] &= 0x30
+            self._schedule(duration, lambda: self._set_irq(IDLE_IRQ))
+        elif answer is None:
+            self._wait_for_timer(duration)
+        else:
+            rx_data, rx_bits, delay = answer
+            duration += FRAME_DELAY + delay + frame_time(rx_bits)
+            self._schedule(duration, lambda: self._received(rx_data, rx_bits))
+
+    def _received(self, data, bits):
+        if self.regs[RX_MODE] & 0x80 and bits >= 24:
+            if crc_a(data[:-2], CRC_PRESETS[self.regs[MODE] & 0x03]) != data[-2:]:
+                self.regs[ERROR] |= CRC_ERR
+                self.regs[COM_IRQ] |= ERR_IRQ
+            data = data[:-2]
+            bits -= 16
+        for byte in data:
+            self._write(FIFO_DATA, byte)
+        self.regs[CONTROL] = (self.regs[CONTROL] & 0xF8) | (bits % 8)
+        self.regs[COM_IRQ] |= RX_IRQ
+
+    def _mf_authent(self):
+        data = self.fifo
+        self.fifo = []
+        if len(data) != 12 or data[0] not in (PICC_AUTH_A, PICC_AUTH_B):
+            self.regs[ERROR] |= PROTOCOL_ERR
+            self.regs[COMMAND] &= 0x30
+            self._set_irq(IDLE_IRQ | ERR_IRQ)
+            return
+        key_type = 'A' if data[0] == PICC_AUTH_A else 'B'
+        ok = self.field_on() and self.card is not None and \
+            self.card.authenticate(key_type, data[1], data[2:8], data[8:12])
+        if ok:
+            self._schedule(AUTH_TIME, self._authenticated)
+        else:
+            self._wait_for_timer(AUTH_TIME)
+
+    def _authenticated(self):
+        self.regs[STATUS2] |= MF_CRYPTO1_ON
+        self.regs[COMMAND] &= 0x30
+        self._set_irq(IDLE_IRQ)
+
+    def _wait_for_timer(self, duration):
+        # Nobody answers: with TAuto the timer starts after transmission and raises TimerIRq,
+        # without it the command just hangs until software intervenes
+        if self.regs[T_MODE] & 0x80:
+            self._schedule(duration + self.timer_period(), self._timer_expired)
+        else:
+            self._schedule(duration, lambda: None)
+
+    def _timer_expired(self):
+        self._set_irq(TIMER_IRQ)
+
+    def _set_irq(self, bits):
+        self.regs[COM_IRQ] |= bits
+
+    def timer_period(self):
+        """Timeout programmed in TModeReg/TPrescalerReg/TReloadReg, in seconds"""
+        prescaler = ((self.regs[T_MODE] & 0x0F) << 8) | self.regs[T_PRESCALER]
+        reload = (self.regs[T_RELOAD_H] << 8) | self.regs[T_RELOAD_L]
+        return (reload + 1) * (2 * prescaler + 1) / CARRIER_HZ
+
+    def _schedule(self, duration, apply):
+        self.air_time += duration
+        if self.realtime:
+            self._pending = (time.monotonic() + duration, apply)
+        else:
+            apply()
+
+    def _settle(self):
+        if self._pending is not None and time.monotonic() >= self._pending[0]:
+            apply = self._pending[1]
+            self._pending = None
+            apply()
@@ -16,16 +16,155 @@ Fields:
 }
 """
 
-import hashlib
+import base64
 import datetime
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+# Stored format carries its own parameters:
+#   scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>
+#   pbkdf2_sha256$<iterations>$<salt b64>$<hash b64>
+# Bare 64-character hex strings are legacy unsalted SHA-256 hashes.
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
 
-def hash_pin(pin):
-    """Hash PIN for secure storage"""
-    return hashlib.sha256(pin.encode()).hexdigest()
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(pin, salt, n, r, p):
+    return hashlib.scrypt(pin.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + (1 << 20), dklen=HASH_BYTES)
+
+def _pbkdf2(pin, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', pin.encode(), salt, iterations, dklen=HASH_BYTES)
+
+def hash_pin(pin, kdf=None):
+    """Hash PIN for secure storage with the configured KDF and a random salt"""
+    kdf = kdf or Config.PIN_KDF
+    salt = os.urandom(SALT_BYTES)
+    if kdf == 'pbkdf2_sha256':
+        iterations = Config.PIN_PBKDF2_ITERATIONS
+        return f"pbkdf2_sha256${iterations}${_b64(salt)}${_b64(_pbkdf2(pin, salt, iterations))}"
+    if kdf == 'scrypt':
+        n, r, p = Config.PIN_SCRYPT_N, Config.PIN_SCRYPT_R, Config.PIN_SCRYPT_P
+        return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(pin, salt, n, r, p))}"
+    raise ValueError(f"Unknown PIN KDF '{kdf}'")
 
 def verify_pin(pin, pin_hash):
-    """Verify PIN against stored hash"""
-    return hash_pin(pin) == pin_hash
+    """Verify PIN against stored hash (any supported format, including legacy SHA-256)"""
+    if not pin_hash:
+        return False
+    try:
+        parts = pin_hash.split('$')
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            computed = _scrypt(pin, _unb64(parts[4]), n, r, p)
+            expected = _unb64(parts[5])
+        elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            computed = _pbkdf2(pin, _unb64(parts[2]), int(parts[1]))
+            expected = _unb64(parts[3])
+        elif len(parts) == 1:
+            computed = hashlib.sha256(pin.encode()).hexdigest().encode()
+            expected = pin_hash.encode()
+        else:
+            return False
+    except (ValueError, TypeError) as e:
+        print(f"Unreadable PIN hash: {e}")
+        return False
+    return hmac.compare_digest(computed, expected)
+
+def needs_rehash(pin_hash):
+    """True for legacy hashes and hashes made with other KDF settings than configured"""
+    if not pin_hash:
+        return False
+    parts = pin_hash.split('$')
+    if Config.PIN_KDF == 'scrypt':
+        return parts[:4] != ['scrypt', str(Config.PIN_SCRYPT_N), str(Config.PIN_SCRYPT_R), str(Config.PIN_SCRYPT_P)]
+    if Config.PIN_KDF == 'pbkdf2_sha256':
+        return parts[:2] != ['pbkdf2_sha256', str(Config.PIN_PBKDF2_ITERATIONS)]
+    return False
+
+class PinHasherBusy(Exception):
+    """All PIN hashing slots are taken; the caller should ask the user to retry"""
+
+class PinHasher:
+    """Bounded worker pool for PIN hashing and verification
+
+    hashlib's scrypt/PBKDF2 release the GIL, so worker threads run the KDF
+    in parallel without stalling Flask request threads. At most
+    workers + queue_size jobs are admitted; further callers wait up to
+    admit_timeout and then get PinHasherBusy.
+    """
+
+    def __init__(self, workers=None, queue_size=None, admit_timeout=None):
+        self.workers = workers or Config.PIN_HASH_WORKERS
+        self.capacity = self.workers + (queue_size if queue_size is not None else Config.PIN_HASH_QUEUE)
+        self.admit_timeout = admit_timeout if admit_timeout is not None else Config.PIN_HASH_ADMIT_TIMEOUT
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pin-kdf')
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {'verified': 0, 'hashed': 0, 'rehashed': 0, 'rehash_skipped': 0, 'rejected_busy': 0, 'kdf_seconds': 0.0}
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.admit_timeout):
+            with self.lock:
+                self.stats['rejected_busy'] += 1
+            raise PinHasherBusy("PIN service busy, please retry")
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return self.pool.submit(self._timed, fn, *args).result()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.stats['kdf_seconds'] += time.perf_counter() - start
+
+    def hash(self, pin):
+        result = self._run(hash_pin, pin)
+        with self.lock:
+            self.stats['hashed'] += 1
+        return result
+
+    def verify(self, pin, pin_hash):
+        """(valid, upgraded hash or None) - upgraded when the stored hash is legacy or outdated"""
+        valid = self._run(verify_pin, pin, pin_hash)
+        with self.lock:
+            self.stats['verified'] += 1
+        if valid and needs_rehash(pin_hash):
+            try:
+                upgraded = self._run(hash_pin, pin)
+            except PinHasherBusy:
+                # The PIN is verified; the upgrade is retried at the next login
+                with self.lock:
+                    self.stats['rehash_skipped'] += 1
+                return True, None
+            with self.lock:
+                self.stats['rehashed'] += 1
+            return True, upgraded
+        return valid, None
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, workers=self.workers, capacity=self.capacity,
+                        in_flight=self.in_flight, kdf_seconds=round(self.stats['kdf_seconds'], 3))
 
 def create_user_data(roll_number, name, branch, year, machines, pin):
     """Create user data structure"""
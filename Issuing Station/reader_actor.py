@@ -0,0 +1,123 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+# Lower runs first
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_POLL = 2
+PRIORITY_NAMES = {PRIORITY_WRITE: 'write', PRIORITY_READ: 'read', PRIORITY_POLL: 'poll'}
+
+class ReaderBusy(TimeoutError):
+    """The command did not finish (or start) before its deadline"""
+
+class ReaderActor(threading.Thread):
+    """Single thread that owns the RFIDHandler; everything else submits commands
+
+    Commands are callables taking the handler, queued by priority
+    (write > read > presence poll) and answered through futures. A command
+    whose deadline passes while queued is failed without touching the reader;
+    a cancelled future is skipped.
+    """
+
+    def __init__(self, rfid, history=256, name='rfid-reader'):
+        super().__init__(daemon=True, name=name)
+        self.rfid = rfid
+        self.queue = queue.PriorityQueue()
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.poll_lock = threading.Lock()
+        self.running = True
+        self._pending_poll = None
+        self.max_depth = 0
+        self.counts = collections.Counter()
+        self.expired = 0
+        self.cancelled = 0
+        self.wait_times = {p: collections.deque(maxlen=history) for p in PRIORITY_NAMES}
+        self.service_times = {p: collections.deque(maxlen=history) for p in PRIORITY_NAMES}
+
+    def submit(self, fn, *args, priority=PRIORITY_READ, timeout=None):
+        """Queue fn(rfid, *args); returns a Future. timeout bounds queueing + execution."""
+        future = Future()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self.queue.put((priority, next(self.seq), fn, args, future, deadline, time.monotonic()))
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return future
+
+    def call(self, fn, *args, priority=PRIORITY_READ, timeout=10):
+        """Run fn(rfid, *args) on the reader thread and wait for the result"""
+        future = self.submit(fn, *args, priority=priority, timeout=timeout)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise ReaderBusy(f"Reader did not answer within {timeout} s")
+
+    def poll_card(self, power_down=False, timeout=1):
+        """Presence probe; concurrent callers share one queued poll"""
+        with self.poll_lock:
+            if self._pending_poll is not None and not self._pending_poll.done():
+                return self._pending_poll
+            self._pending_poll = self.submit(lambda rfid: rfid.poll_card(power_down), priority=PRIORITY_POLL, timeout=timeout)
+            return self._pending_poll
+
+    def run(self):
+        while self.running:
+            try:
+                priority, _, fn, args, future, deadline, queued_at = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if not future.set_running_or_notify_cancel():
+                with self.lock:
+                    self.cancelled += 1
+                continue
+            started = time.monotonic()
+            if deadline is not None and started > deadline:
+                with self.lock:
+                    self.expired += 1
+                future.set_exception(ReaderBusy("Command expired in the reader queue"))
+                continue
+            try:
+                future.set_result(fn(self.rfid, *args))
+            except Exception as e:
+                future.set_exception(e)
+            finished = time.monotonic()
+            with self.lock:
+                self.counts[priority] += 1
+                self.wait_times[priority].append(started - queued_at)
+                self.service_times[priority].append(finished - started)
+
+    def stop(self):
+        self.running = False
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return {'avg_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+        ordered = sorted(samples)
+        return {
+            'avg_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+            'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+            'max_ms': round(ordered[-1] * 1000, 2),
+        }
+
+    def status(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'expired': self.expired,
+                'cancelled': self.cancelled,
+                'commands': {
+                    name: {
+                        'count': self.counts[p],
+                        'wait': self._summary(self.wait_times[p]),
+                        'service': self._summary(self.service_times[p]),
+                    }
+                    for p, name in PRIORITY_NAMES.items()
+                },
+            }
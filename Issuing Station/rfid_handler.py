@@ -1,11 +1,29 @@
 # Simplified rfid_handler.py with reliable card writing using spidev and gpiozero
-import spidev
+import functools
+import random
+from collections import OrderedDict
+import threading
 import time
 import uuid
-from gpiozero import DigitalOutputDevice
+import metrics
+from config import Config
+from machine_registry import get_registry
+
+try:
+    import spidev
+    from gpiozero import DigitalInputDevice, DigitalOutputDevice
+except ImportError:
+    # Only the simulator backend is usable off a Raspberry Pi
+    spidev = None
+    DigitalInputDevice = None
+    DigitalOutputDevice = None
 
 # MFRC522 constants
 COMMAND_REG = 0x01 << 1
+COM_IEN_REG = 0x02 << 1
+DIV_IEN_REG = 0x03 << 1
+COM_IRQ_REG = 0x04 << 1
+DIV_IRQ_REG = 0x05 << 1
 FIFO_DATA_REG = 0x09 << 1
 FIFO_LEVEL_REG = 0x0A << 1
 CONTROL_REG = 0x0C << 1
@@ -27,6 +45,24 @@ RF_CFG_REG = 0x26 << 1
 CRC_RESULT_REG_M = 0x21 << 1
 CRC_RESULT_REG_L = 0x22 << 1
 
+# Configuration registers the chip never changes on its own. The driver keeps shadow
+# copies of them so bit-mask updates need no read and unchanged writes are skipped.
+# Values are the datasheet reset values, valid after a hard or soft reset.
+SHADOW_RESET_VALUES = {
+    COM_IEN_REG: 0x80,
+    DIV_IEN_REG: 0x00,
+    BIT_FRAMING_REG: 0x00,
+    MODE_REG: 0x3F,
+    TX_CONTROL_REG: 0x80,
+    TX_ASK_REG: 0x00,
+    TX_AUTO_REG: 0x10,
+    TIMER_MODE_REG: 0x00,
+    TIMER_PRESCALER_REG: 0x00,
+    TIMER_RELOAD_REG_H: 0x00,
+    TIMER_RELOAD_REG_L: 0x00,
+    RF_CFG_REG: 0x48,
+}
+
 # Commands
 COMMAND_IDLE = 0x00
 COMMAND_MEM = 0x01
@@ -57,13 +93,223 @@ MI_OK = 0
 MI_NOTAGERR = 1
 MI_ERR = 2
 
-class MFRC522:
-    def __init__(self, rst_pin=25):
+# Chip timer runs in 25 us ticks (TPrescaler 0xA9). Each command type gets its own
+# timeout in ms: activation frames are answered within ~100 us so an empty field
+# fails fast, auth/read need the card to compute, writes wait for EEPROM programming.
+TIMER_TICK_US = 25
+TIMER_PROFILES = {
+    'activate': 1,
+    'auth': 10,
+    'read': 10,
+    'write': 20,
+    # The operand frame of increment/decrement/restore is only answered with a NAK;
+    # silence until the timer runs out means it was accepted
+    'value': 1,
+    'default': 25,
+}
+# Extra host-side wait on top of the chip timer, only hit if the chip is wedged
+HOST_TIMEOUT_MARGIN = 0.005
+# ComIrqReg polling without an IRQ line: 100 us, then 200 us between reads
+POLL_INTERVAL_MIN = 0.0001
+POLL_INTERVAL_MAX = 0.0002
+
+DEFAULT_KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+# Credit sector trailer access bits: data blocks C1C2C3=110 (value blocks: read and
+# decrement with key A or B, write and increment only with key B), trailer 011 (rewritten
+# only with key B, key A never read back). Access nodes hold key A, the station key B.
+CREDIT_ACCESS = [0x08, 0x77, 0x8F, 0x69]
+
+STATUS_NAMES = {MI_OK: 'ok', MI_NOTAGERR: 'notag', MI_ERR: 'error'}
+TOCARD_COMMANDS = metrics.counter('rfid_tocard_commands_total',
+                                  "MFRC522_ToCard commands by type (timer profile) and result", ['command', 'status'])
+TOCARD_SECONDS = metrics.histogram('rfid_tocard_duration_seconds',
+                                   "MFRC522_ToCard duration by type (timer profile)", ['command'])
+AUTH_FAILURES = metrics.counter('rfid_auth_failures_total', "Sector authentications that failed")
+WRITE_ATTEMPTS = metrics.counter('rfid_write_attempts_total', "Card record write attempts", ['result'])
+WRITE_RETRY_SLEEP = metrics.counter('rfid_write_retry_sleep_seconds_total', "Time slept between write attempts")
+WRITE_BLOCKS = metrics.counter('rfid_write_blocks_total', "Record blocks written, or skipped as already up to date",
+                               ['result'])
+VERIFY_FAILURES = metrics.counter('rfid_verify_failures_total', "Read-back verifications that did not match")
+RECORD_READS = metrics.counter('rfid_record_reads_total',
+                               "Card record reads by source: cache for a card that stayed in the field, "
+                               "cache for a returning card with the same session, or the card itself", ['source'])
+
+class CardSessionError(Exception):
+    """Card could not be activated or the sector could not be authenticated"""
+
+class SpiTransport:
+    """spidev bus with gpiozero reset (and optional IRQ) lines, i.e. a physical MFRC522 on the Pi"""
+    def __init__(self, bus=0, device=0, rst_pin=25, irq_pin=None, max_speed_hz=1000000):
+        if spidev is None:
+            raise RuntimeError("spidev/gpiozero not available; use RFID_BACKEND=sim off the Pi")
         self.rst = DigitalOutputDevice(rst_pin)
+        # The driver inverts IRQ (IRqInv), so the line is active low
+        self.irq = DigitalInputDevice(irq_pin, pull_up=True) if irq_pin is not None else None
+        self.has_irq = self.irq is not None
         self.spi = spidev.SpiDev()
-        self.spi.open(0, 0)
-        self.spi.max_speed_hz = 1000000
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = max_speed_hz
         self.spi.mode = 0
+        self.transactions = 0
+        self.bytes_transferred = 0
+
+    def xfer2(self, data):
+        self.transactions += 1
+        self.bytes_transferred += len(data)
+        return self.spi.xfer2(data)
+
+    def wait_for_irq(self, timeout):
+        """Block on the IRQ edge instead of polling ComIrqReg; False on timeout"""
+        return self.irq.wait_for_active(timeout)
+
+    def reset(self):
+        """Pulse the hard reset line and wait for the oscillator"""
+        self.rst.off()
+        time.sleep(0.001)   # datasheet minimum is 100 ns
+        self.rst.on()
+        # Crystal start-up plus 37.74 us (datasheet 8.8.2), with a generous margin
+        time.sleep(Config.RFID_RESET_SETTLE)
+
+    def close(self):
+        self.spi.close()
+        self.rst.close()
+        if self.irq is not None:
+            self.irq.close()
+
+class SharedBus:
+    """One SPI bus shared by several readers, each on its own chip-select
+
+    Transfers are granted in arrival order (ticket lock), so a lane busy with a
+    write cannot starve another lane's polls. Only single transfers hold the bus;
+    IRQ waits and RF time on one lane overlap with traffic on the others.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.cond = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+        self.transfers = 0
+        self.contended = 0
+        self.wait_time = 0.0
+
+    def __enter__(self):
+        with self.cond:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            if ticket != self.serving:
+                self.contended += 1
+                start = time.perf_counter()
+                while ticket != self.serving:
+                    self.cond.wait()
+                self.wait_time += time.perf_counter() - start
+        return self
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.serving += 1
+            self.transfers += 1
+            self.cond.notify_all()
+
+    def status(self):
+        with self.cond:
+            return {
+                'bus': self.name,
+                'transfers': self.transfers,
+                'contended': self.contended,
+                'avg_wait_us': round(self.wait_time / self.transfers * 1e6, 1) if self.transfers else 0.0,
+            }
+
+class BusTransport:
+    """Transport whose transfers go through a SharedBus; everything else passes straight through"""
+    def __init__(self, transport, bus):
+        self.transport = transport
+        self.bus = bus
+
+    def xfer2(self, data):
+        with self.bus:
+            return self.transport.xfer2(data)
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+def make_transport(backend=None, rst_pin=25, irq_pin=None, bus=0, device=0, shared_bus=None, trace_path=None):
+    """Build the transport for the configured backend ('spi' or 'sim'), on shared_bus if given.
+    With trace_path every transfer is recorded there (see spi_trace.py)."""
+    backend = backend or Config.RFID_BACKEND
+    if backend == 'spi':
+        transport = SpiTransport(bus=bus, device=device, rst_pin=rst_pin, irq_pin=irq_pin)
+    elif backend == 'sim':
+        from mfrc522_sim import MFRC522Simulator, MifareClassic1K
+        transport = MFRC522Simulator(card=MifareClassic1K())
+    else:
+        raise ValueError(f"Unknown RFID backend: {backend}")
+    if trace_path:
+        from spi_trace import TraceRecorder
+        # Inside the bus lock, so recorded timings are this reader's own transfers
+        transport = TraceRecorder(transport, trace_path, info={'backend': backend, 'crc_mode': Config.RFID_CRC_MODE})
+    return BusTransport(transport, shared_bus) if shared_bus is not None else transport
+
+def _build_crc_a_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 0x01 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC_A_TABLE = _build_crc_a_table()
+
+def crc_a(data):
+    """ISO 14443-A CRC (preset 0x6363, reflected 0x1021) as [low, high], one table lookup per byte"""
+    crc = 0x6363
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_A_TABLE[(crc ^ byte) & 0xFF]
+    return [crc & 0xFF, crc >> 8]
+
+CRC_MODES = ('software', 'hardware', 'check')
+
+def retry_delay(attempt):
+    """Seconds to wait before retry number attempt (0-based): exponential from a few
+    milliseconds, capped, with jitter so retries do not fall into step with a flaky field"""
+    return random.uniform(0.5, 1.0) * min(Config.RFID_RETRY_MAX, Config.RFID_RETRY_BASE * 2 ** attempt)
+
+def traced(method):
+    """Mark a handler operation in the SPI trace, if the transport records one, so it can be replayed"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        trace_op = getattr(self.mfrc.spi, 'trace_op', None)
+        if trace_op is None:
+            return method(self, *args, **kwargs)
+        with trace_op(method.__name__, args, kwargs, self.mfrc, {'in_field': self.records.snapshot()}):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def counted(method):
+    """Record calls and SPI transactions spent inside a driver operation in op_stats"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = getattr(self.spi, 'transactions', 0)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            stats = self.op_stats.setdefault(method.__name__, [0, 0])
+            stats[0] += 1
+            stats[1] += getattr(self.spi, 'transactions', 0) - start
+    return wrapper
+
+class MFRC522:
+    def __init__(self, rst_pin=25, transport=None, crc_mode=None):
+        # Anything with xfer2()/reset()/close() works, see SpiTransport and mfrc522_sim
+        self.spi = transport if transport is not None else make_transport(rst_pin=rst_pin, irq_pin=Config.RFID_IRQ_PIN)
+        # 'software': table CRC in Python, 'hardware': chip coprocessor,
+        # 'check': both, reporting mismatches and trusting the chip
+        self.crc_mode = crc_mode or Config.RFID_CRC_MODE
+        if self.crc_mode not in CRC_MODES:
+            raise ValueError(f"Unknown CRC mode: {self.crc_mode}")
+        self.crc_mismatches = 0
+        # Completion is signalled on the IRQ line when the transport has one wired
+        self.irq_enabled = getattr(self.spi, 'has_irq', False)
         self.PICC_REQIDL = PICC_REQIDL
         self.PICC_REQALL = PICC_REQALL
         self.PICC_ANTICOLL = PICC_ANTICOLL
@@ -76,40 +322,73 @@ class MFRC522:
         self.MI_OK = MI_OK
         self.MI_NOTAGERR = MI_NOTAGERR
         self.MI_ERR = MI_ERR
+        self.op_stats = {}  # operation name -> [calls, SPI transactions]
+        # RF field bookkeeping: seconds the transmitter has been on, and since when
+        self.antenna_on_seconds = 0.0
+        self.antenna_on_since = None
+        self.antenna_switches = 0
         
         # Reset the chip
-        self.rst.on()
-        time.sleep(0.1)
-        self.rst.off()
-        time.sleep(0.1)
-        self.rst.on()
-        time.sleep(0.1)
+        self.spi.reset()
+        self.shadow = dict(SHADOW_RESET_VALUES)
 
     def write_reg(self, reg, val):
+        if reg in self.shadow:
+            if self.shadow[reg] == val:
+                return
+            self.shadow[reg] = val
         self.spi.xfer2([reg & 0x7E, val])
 
+    def wait_powered_up(self, timeout=0.05):
+        """Poll CommandReg until the PowerDown bit clears, i.e. the soft reset has finished"""
+        deadline = time.monotonic() + timeout
+        while self.read_reg(COMMAND_REG) & 0x10:
+            if time.monotonic() > deadline:
+                print("MFRC522 still powered down after soft reset")
+                return
+            time.sleep(0.001)
+
     def read_reg(self, reg):
         val = self.spi.xfer2([reg | 0x80, 0])[1]
         return val
 
+    def read_regs(self, regs):
+        """Read several registers in one transaction (each address byte clocks out the previous one)"""
+        return self.spi.xfer2([reg | 0x80 for reg in regs] + [0])[1:]
+
+    def write_fifo(self, data):
+        """Push a whole payload into the FIFO; the chip does not auto-increment, so all bytes land in FIFODataReg"""
+        if data:
+            self.spi.xfer2([FIFO_DATA_REG & 0x7E] + list(data))
+
+    def read_fifo(self, count):
+        """Drain count bytes from the FIFO in one transaction"""
+        if count <= 0:
+            return []
+        return self.spi.xfer2([FIFO_DATA_REG | 0x80] * count + [0])[1:]
+
     def set_bit_mask(self, reg, mask):
-        tmp = self.read_reg(reg)
+        tmp = self.shadow[reg] if reg in self.shadow else self.read_reg(reg)
         self.write_reg(reg, tmp | mask)
 
     def clear_bit_mask(self, reg, mask):
-        tmp = self.read_reg(reg)
+        tmp = self.shadow[reg] if reg in self.shadow else self.read_reg(reg)
         self.write_reg(reg, tmp & (~mask))
 
     def MFRC522_Init(self):
         # Reset
-        self.write_reg(COMMAND_REG, COMMAND_SOFTRESET)
-        time.sleep(0.01)
+        self.spi.xfer2([COMMAND_REG & 0x7E, COMMAND_SOFTRESET])
+        self.shadow = dict(SHADOW_RESET_VALUES)
+        self.wait_powered_up()
         
-        # Timer: auto timer with 25ms timeout
-        self.write_reg(TIMER_MODE_REG, 0x8D)
-        self.write_reg(TIMER_PRESCALER_REG, 0x3E)
-        self.write_reg(TIMER_RELOAD_REG_L, 30)
-        self.write_reg(TIMER_RELOAD_REG_H, 0)
+        # Timer: starts automatically after each transmission, 25 us ticks.
+        # The reload value is programmed per command from TIMER_PROFILES.
+        self.write_reg(TIMER_MODE_REG, 0x80)
+        self.write_reg(TIMER_PRESCALER_REG, 0xA9)
+        self.set_timer_profile('default')
+        
+        # IRQ output push-pull instead of open drain
+        self.write_reg(DIV_IEN_REG, 0x80)
         
         # Default 0x00. Force 100% ASK modulation
         self.write_reg(TX_AUTO_REG, 0x40)
@@ -119,18 +398,52 @@ class MFRC522:
         
         # Enable antenna
         self.write_reg(TX_CONTROL_REG, 0x83)
+        if self.antenna_on_since is None:
+            self.antenna_on_since = time.monotonic()
+
+    def antenna_on(self):
+        """Switch the transmitter (RF field) on; True if it was off"""
+        if self.antenna_on_since is not None:
+            return False
+        self.set_bit_mask(TX_CONTROL_REG, 0x03)
+        self.antenna_on_since = time.monotonic()
+        self.antenna_switches += 1
+        return True
+
+    def antenna_off(self):
+        """Switch the transmitter off; cards in the field lose power and reset"""
+        if self.antenna_on_since is None:
+            return
+        self.clear_bit_mask(TX_CONTROL_REG, 0x03)
+        self.antenna_on_seconds += time.monotonic() - self.antenna_on_since
+        self.antenna_on_since = None
 
+    def antenna_time(self):
+        """Total seconds the field has been on, including the current stretch"""
+        current = time.monotonic() - self.antenna_on_since if self.antenna_on_since is not None else 0.0
+        return self.antenna_on_seconds + current
+
+    def set_timer_profile(self, profile):
+        """Program the chip timeout for a command type; returns it in seconds"""
+        timeout_ms = TIMER_PROFILES[profile]
+        reload = int(timeout_ms * 1000 / TIMER_TICK_US) - 1
+        self.write_reg(TIMER_RELOAD_REG_H, reload >> 8)
+        self.write_reg(TIMER_RELOAD_REG_L, reload & 0xFF)
+        return timeout_ms / 1000
+
+    @counted
     def MFRC522_Request(self, req_mode):
         TagType = []
         self.write_reg(BIT_FRAMING_REG, 0x07)
         TagType.append(req_mode)
-        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, TagType)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, TagType, 'activate')
         
         if ((status != MI_OK) | (back_len != 0x10)):
             status = MI_ERR
             
         return (status, back_data)
 
+    @counted
     def MFRC522_Anticoll(self):
         back_data = []
         ser_num_check = 0
@@ -142,7 +455,7 @@ class MFRC522:
         ser_num.append(PICC_ANTICOLL)
         ser_num.append(0x20)
         
-        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, ser_num)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, ser_num, 'activate')
         
         if(status == MI_OK):
             i = 0
@@ -157,7 +470,36 @@ class MFRC522:
                 
         return (status, back_data)
 
-    def MFRC522_ToCard(self, command, send_data):
+    @counted
+    def MFRC522_Activate(self, req_mode=PICC_REQALL, attempts=2, select=True):
+        """Request, anticollision and select in one go; returns (status, uid)
+
+        A card left READY/ACTIVE by an earlier exchange ignores the first request and
+        drops back to IDLE (or HALT), so the request is retried. WUPA (the default) also
+        wakes cards halted by a previous session. Without select the card is left READY,
+        for callers that look at the UID before deciding to select it.
+        """
+        for _ in range(attempts):
+            (status, _) = self.MFRC522_Request(req_mode)
+            if status == MI_OK:
+                break
+        else:
+            return (MI_ERR, None)
+
+        (status, uid) = self.MFRC522_Anticoll()
+        if status != MI_OK:
+            return (MI_ERR, None)
+        if select and self.MFRC522_SelectTag(uid) <= 0:
+            return (MI_ERR, None)
+        return (MI_OK, uid)
+
+    def sector_session(self, sector, key=None, uid=None, auth_mode=PICC_AUTHENT1A):
+        """Context manager authenticating one sector once for several block operations"""
+        return SectorSession(self, sector, key or DEFAULT_KEY, uid=uid, auth_mode=auth_mode)
+
+    @counted
+    def MFRC522_ToCard(self, command, send_data, profile='default'):
+        started = time.perf_counter()
         back_data = []
         back_len = 0
         status = MI_ERR
@@ -165,7 +507,7 @@ class MFRC522:
         wait_irq = 0x00
         last_bits = None
         n = 0
-        i = 0
+        done = False
         
         if command == COMMAND_MFAUTHENT:
             irq_en = 0x12
@@ -173,41 +515,56 @@ class MFRC522:
         elif command == COMMAND_TRANSCEIVE:
             irq_en = 0x77
             wait_irq = 0x30
+        if self.irq_enabled:
+            # Only completion, error and timer events may pull the IRQ line
+            irq_en = wait_irq | 0x03
             
-        self.write_reg(0x02, irq_en | 0x80)
-        self.clear_bit_mask(0x04, 0x80)
-        self.set_bit_mask(FIFO_LEVEL_REG, 0x80)
+        timeout = self.set_timer_profile(profile) + HOST_TIMEOUT_MARGIN
+        self.write_reg(COM_IEN_REG, irq_en | 0x80)
+        self.write_reg(COM_IRQ_REG, 0x7F)       # Set1=0: clear every interrupt flag
+        self.write_reg(FIFO_LEVEL_REG, 0x80)    # FlushBuffer
         
         self.write_reg(COMMAND_REG, COMMAND_IDLE)
-        
-        while(i < len(send_data)):
-            self.write_reg(FIFO_DATA_REG, send_data[i])
-            i = i + 1
-            
+        self.write_fifo(send_data)
         self.write_reg(COMMAND_REG, command)
             
         if command == COMMAND_TRANSCEIVE:
             self.set_bit_mask(BIT_FRAMING_REG, 0x80)
             
-        i = 2000
+        # Wait for the command to finish (wait_irq) or the chip timer to expire (0x01).
+        # The chip timer always fires, the host deadline only covers a wedged chip.
+        deadline = time.monotonic() + timeout
+        if self.irq_enabled:
+            self.spi.wait_for_irq(timeout)
+        interval = POLL_INTERVAL_MIN
         while True:
-            n = self.read_reg(0x04)
-            i = i - 1
-            if ~((i != 0) and ~(n & 0x01) and ~(n & wait_irq)):
+            n = self.read_reg(COM_IRQ_REG)
+            if n & (wait_irq | 0x01):
+                done = True
                 break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Yield the CPU (and the shared bus) instead of spinning on register reads
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, POLL_INTERVAL_MAX)
                 
         self.clear_bit_mask(BIT_FRAMING_REG, 0x80)
         
-        if i != 0:
-            if (self.read_reg(ERROR_REG) & 0x1B) == 0x00:
+        if done:
+            if command == COMMAND_TRANSCEIVE:
+                error, level, control = self.read_regs([ERROR_REG, FIFO_LEVEL_REG, CONTROL_REG])
+            else:
+                error = self.read_reg(ERROR_REG)
+            if (error & 0x1B) == 0x00:
                 status = MI_OK
                 
-                if n & irq_en & 0x01:
+                if n & 0x01 and not (n & wait_irq):
                     status = MI_NOTAGERR
                     
-                if command == COMMAND_TRANSCEIVE:
-                    n = self.read_reg(FIFO_LEVEL_REG)
-                    last_bits = self.read_reg(CONTROL_REG) & 0x07
+                if command == COMMAND_TRANSCEIVE and status == MI_OK:
+                    n = level
+                    last_bits = control & 0x07
                     if last_bits != 0:
                         back_len = (n - 1) * 8 + last_bits
                     else:
@@ -218,15 +575,15 @@ class MFRC522:
                     if n > 16:
                         n = 16
                         
-                    i = 0
-                    while i < n:
-                        back_data.append(self.read_reg(FIFO_DATA_REG))
-                        i = i + 1
+                    back_data = self.read_fifo(n)
             else:
                 status = MI_ERR
         
+        TOCARD_SECONDS.observe(time.perf_counter() - started, profile)
+        TOCARD_COMMANDS.inc(profile, STATUS_NAMES[status])
         return (status, back_data, back_len)
 
+    @counted
     def MFRC522_SelectTag(self, ser_num):
         back_data = []
         buf = []
@@ -236,16 +593,17 @@ class MFRC522:
         while i < 5:
             buf.append(ser_num[i])
             i = i + 1
-        pout = self.CalulateCRC(buf)
+        pout = self.calculate_crc(buf)
         buf.append(pout[0])
         buf.append(pout[1])
-        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buf)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buf, 'activate')
         
         if (status == MI_OK) and (back_len == 0x18):
             return back_data[0]
         else:
             return 0
 
+    @counted
     def MFRC522_Auth(self, auth_mode, block_addr, sect_key, ser_num):
         buff = []
         buff.append(auth_mode)
@@ -261,26 +619,36 @@ class MFRC522:
             buff.append(ser_num[i])
             i = i + 1
             
-        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_MFAUTHENT, buff)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_MFAUTHENT, buff, 'auth')
         
         if not (status == MI_OK):
+            AUTH_FAILURES.inc()
             print("AUTH ERROR!!")
         if not (self.read_reg(STATUS2_REG) & 0x08) != 0:
             print("AUTH ERROR(status2reg & 0x08) != 0")
             
         return status
 
+    @counted
     def MFRC522_StopCrypto1(self):
         self.clear_bit_mask(STATUS2_REG, 0x08)
 
+    @counted
+    def MFRC522_Halt(self):
+        # A halted card answers nothing, so this always ends on the (1 ms) timer
+        buf = [PICC_HALT, 0]
+        buf += self.calculate_crc(buf)
+        self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buf, 'activate')
+
+    @counted
     def MFRC522_Read(self, block_addr):
         recvData = []
         recvData.append(PICC_READ)
         recvData.append(block_addr)
-        pout = self.CalulateCRC(recvData)
+        pout = self.calculate_crc(recvData)
         recvData.append(pout[0])
         recvData.append(pout[1])
-        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, recvData)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, recvData, 'read')
         if not(status == MI_OK):
             print("Error while reading!")
         i = 0
@@ -289,14 +657,15 @@ class MFRC522:
         else:
             return None
 
+    @counted
     def MFRC522_Write(self, block_addr, write_data):
         buff = []
         buff.append(PICC_WRITE)
         buff.append(block_addr)
-        crc = self.CalulateCRC(buff)
+        crc = self.calculate_crc(buff)
         buff.append(crc[0])
         buff.append(crc[1])
-        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buff)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buff, 'write')
         if not(status == MI_OK) or not(back_len == 4) or not((back_data[0] & 0x0F) == 0x0A):
             status = MI_ERR
             
@@ -306,41 +675,239 @@ class MFRC522:
             while i < 16:
                 buf.append(write_data[i])
                 i = i + 1
-            crc = self.CalulateCRC(buf)
+            crc = self.calculate_crc(buf)
             buf.append(crc[0])
             buf.append(crc[1])
-            (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buf)
+            (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buf, 'write')
             if not(status == MI_OK) or not(back_len == 4) or not((back_data[0] & 0x0F) == 0x0A):
                 print("Error while writing")
                 status = MI_ERR
         return status
 
+    def _value_command(self, command, block_addr, operand):
+        """Increment/decrement/restore: the command is ACKed, the 4-byte operand is not"""
+        buff = [command, block_addr]
+        buff += self.calculate_crc(buff)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buff, 'write')
+        if status != MI_OK or back_len != 4 or (back_data[0] & 0x0F) != 0x0A:
+            print(f"Value command {command:#04x} refused for block {block_addr}")
+            return MI_ERR
+        buf = list((operand & 0xFFFFFFFF).to_bytes(4, 'little'))
+        buf += self.calculate_crc(buf)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buf, 'value')
+        if status != MI_NOTAGERR:
+            # A NAK here means the block is not a valid value block
+            print(f"Value command {command:#04x} failed for block {block_addr}")
+            return MI_ERR
+        return MI_OK
+
+    @counted
+    def MFRC522_Increment(self, block_addr, delta):
+        """Add delta to a value block into the card's transfer buffer (see MFRC522_Transfer)"""
+        return self._value_command(PICC_INCREMENT, block_addr, delta)
+
+    @counted
+    def MFRC522_Decrement(self, block_addr, delta):
+        """Subtract delta from a value block into the card's transfer buffer"""
+        return self._value_command(PICC_DECREMENT, block_addr, delta)
+
+    @counted
+    def MFRC522_Restore(self, block_addr):
+        """Copy a value block into the transfer buffer, e.g. to back it up to another block"""
+        return self._value_command(PICC_RESTORE, block_addr, 0)
+
+    @counted
+    def MFRC522_Transfer(self, block_addr):
+        """Write the transfer buffer to a value block; nothing changes on the card before this"""
+        buff = [PICC_TRANSFER, block_addr]
+        buff += self.calculate_crc(buff)
+        (status, back_data, back_len) = self.MFRC522_ToCard(COMMAND_TRANSCEIVE, buff, 'write')
+        if status != MI_OK or back_len != 4 or (back_data[0] & 0x0F) != 0x0A:
+            print(f"Transfer failed for block {block_addr}")
+            return MI_ERR
+        return MI_OK
+
+    def format_value_block(self, block_addr, value, addr=None):
+        """Write block_addr as a value block holding value (addr byte defaults to the block number)"""
+        return self.MFRC522_Write(block_addr, pack_value_block(value, block_addr if addr is None else addr))
+
+    def read_value(self, block_addr):
+        """(status, value, addr) of a value block; MI_ERR if it cannot be read or is not one"""
+        block = self.MFRC522_Read(block_addr)
+        decoded = unpack_value_block(block) if block else None
+        if decoded is None:
+            return (MI_ERR, None, None)
+        return (MI_OK,) + decoded
+
+    def calculate_crc(self, data):
+        """CRC_A for a frame, computed according to crc_mode"""
+        if self.crc_mode == 'software':
+            return crc_a(data)
+        hardware = self.CalulateCRC(data)
+        if self.crc_mode == 'check':
+            software = crc_a(data)
+            if software != hardware:
+                self.crc_mismatches += 1
+                print(f"CRC mismatch for {data}: software {software}, chip {hardware}")
+        return hardware
+
+    @counted
     def CalulateCRC(self, pIndata):
-        self.clear_bit_mask(0x05, 0x04)
-        self.set_bit_mask(FIFO_LEVEL_REG, 0x80)
-        i = 0
-        while i < len(pIndata):
-            self.write_reg(FIFO_DATA_REG, pIndata[i])
-            i = i + 1
+        self.write_reg(DIV_IRQ_REG, 0x04)      # Set1=0: clear CRCIRq
+        self.write_reg(FIFO_LEVEL_REG, 0x80)   # FlushBuffer
+        self.write_fifo(pIndata)
         self.write_reg(COMMAND_REG, COMMAND_CALCULATE_CRC)
         i = 0xFF
         while True:
-            n = self.read_reg(0x05)
+            n = self.read_reg(DIV_IRQ_REG)
             i = i - 1
             if not ((i != 0) and not (n & 0x04)):
                 break
-        pOutData = []
-        pOutData.append(self.read_reg(CRC_RESULT_REG_L))
-        pOutData.append(self.read_reg(CRC_RESULT_REG_M))
-        return pOutData
+        return self.read_regs([CRC_RESULT_REG_L, CRC_RESULT_REG_M])
 
     def cleanup(self):
         self.spi.close()
-        self.rst.close()
+
+class SectorSession:
+    """One select + auth for a sector, then back-to-back block reads/writes
+
+    with mfrc.sector_session(2) as session:
+        session.write_blocks({8: data8, 9: data9})
+        session.verify({8: data8, 9: data9})
+        # or, writing only what differs: session.update_blocks({8: data8, 9: data9}, done=set())
+        # value blocks: session.read_values([12]), session.debit(12, 1)
+
+    Leaving the block halts the card and stops Crypto1.
+    """
+    def __init__(self, mfrc, sector, key, uid=None, auth_mode=PICC_AUTHENT1A):
+        self.mfrc = mfrc
+        self.sector = sector
+        self.key = key
+        self.uid = uid
+        self.auth_mode = auth_mode
+
+    def __enter__(self):
+        if self.uid is None:
+            (status, self.uid) = self.mfrc.MFRC522_Activate()
+            if status != MI_OK:
+                raise CardSessionError("No card could be selected")
+        status = self.mfrc.MFRC522_Auth(self.auth_mode, self.sector * 4 + 3, self.key, self.uid)
+        if status != MI_OK:
+            raise CardSessionError(f"Authentication failed for sector {self.sector}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.mfrc.MFRC522_Halt()
+        self.mfrc.MFRC522_StopCrypto1()
+        return False
+
+    def switch(self, sector, keys=None):
+        """Authenticate another sector of the same card, without selecting it again.
+        keys ([(auth_mode, key)], default the session's own) are tried in order; a
+        rejected key halts Crypto1 on the card, so it is selected again before the next.
+        Returns the (auth_mode, key) that was accepted."""
+        for i, (auth_mode, key) in enumerate(keys or [(self.auth_mode, self.key)]):
+            if i and not self._reselect():
+                break
+            if self.mfrc.MFRC522_Auth(auth_mode, sector * 4 + 3, key, self.uid) == MI_OK:
+                self.sector = sector
+                return auth_mode, key
+        raise CardSessionError(f"Authentication failed for sector {sector}")
+
+    def _reselect(self):
+        self.mfrc.MFRC522_StopCrypto1()
+        (status, uid) = self.mfrc.MFRC522_Activate()
+        return status == MI_OK and uid == self.uid
+
+    def write_trailer(self, key_a, access, key_b):
+        """Set this sector's keys and access bits. Keys never read back, so the access
+        bits read back confirm it."""
+        block = self.sector * 4 + 3
+        if self.mfrc.MFRC522_Write(block, list(key_a) + list(access) + list(key_b)) != MI_OK:
+            print(f"Trailer write failed for sector {self.sector}")
+            return False
+        read_back = self.mfrc.MFRC522_Read(block)
+        if not read_back or read_back[6:10] != list(access):
+            VERIFY_FAILURES.inc()
+            print(f"Trailer verification failed for sector {self.sector}")
+            return False
+        return True
+
+    def _check_block(self, block):
+        if block // 4 != self.sector or block % 4 == 3:
+            raise ValueError(f"Block {block} is not a data block of sector {self.sector}")
+
+    def write_blocks(self, blocks):
+        """Write {block: 16 bytes} in order; stops at the first failure"""
+        for block, data in sorted(blocks.items()):
+            self._check_block(block)
+            if self.mfrc.MFRC522_Write(block, list(data)) != MI_OK:
+                print(f"Write failed for block {block}")
+                return False
+        return True
+
+    def read_blocks(self, blocks):
+        """Read the given blocks; a failed read maps to None"""
+        result = {}
+        for block in blocks:
+            self._check_block(block)
+            result[block] = self.mfrc.MFRC522_Read(block)
+        return result
+
+    def update_blocks(self, blocks, done, stale=()):
+        """Make {block: 16 bytes} current on the card: read the blocks not in done, write
+        only those that differ and read each one back. Blocks in stale are known to
+        differ and are written without the first read. Blocks confirmed on the card
+        are added to done, so a retry resumes at the first unconfirmed one. Stops at
+        the first failure."""
+        pending = sorted(block for block in blocks if block not in done)
+        current = self.read_blocks([block for block in pending if block not in stale])
+        for block in pending:
+            expected = list(blocks[block])
+            if current.get(block) == expected:
+                WRITE_BLOCKS.inc('unchanged')
+                done.add(block)
+                continue
+            if self.mfrc.MFRC522_Write(block, expected) != MI_OK:
+                print(f"Write failed for block {block}")
+                return False
+            WRITE_BLOCKS.inc('written')
+            read_back = self.mfrc.MFRC522_Read(block)
+            if read_back != expected:
+                VERIFY_FAILURES.inc()
+                print(f"Verification failed for block {block}: expected {expected}, got {read_back}")
+                return False
+            done.add(block)
+        return True
+
+    def read_values(self, blocks):
+        """{block: (value, addr)} for the given blocks; None for a failed read or a non-value block"""
+        return {block: unpack_value_block(data) if data else None
+                for block, data in self.read_blocks(blocks).items()}
+
+    def debit(self, block, amount):
+        """Take amount off a value block: decrement and transfer, nothing written unless both succeed"""
+        self._check_block(block)
+        return self.mfrc.MFRC522_Decrement(block, amount) == MI_OK and self.mfrc.MFRC522_Transfer(block) == MI_OK
+
+    def credit(self, block, amount):
+        """Add amount to a value block: increment and transfer"""
+        self._check_block(block)
+        return self.mfrc.MFRC522_Increment(block, amount) == MI_OK and self.mfrc.MFRC522_Transfer(block) == MI_OK
+
+    def verify(self, blocks):
+        """Read every block once and compare with {block: expected 16 bytes}"""
+        read_back = self.read_blocks(sorted(blocks))
+        for block, expected in sorted(blocks.items()):
+            if read_back[block] != list(expected):
+                VERIFY_FAILURES.inc()
+                print(f"Verification failed for block {block}: expected {list(expected)}, got {read_back[block]}")
+                return False
+        return True
 
 class SimpleMFRC522:
-    def __init__(self):
-        self.mfrc = MFRC522()
+    def __init__(self, transport=None):
+        self.mfrc = MFRC522(transport=transport)
         self.mfrc.MFRC522_Init()
 
     def read(self):
@@ -397,22 +964,335 @@ class SimpleMFRC522:
                         
         return id_val
 
+def _build_crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+CRC8_TABLE = _build_crc8_table()
+
+def pack_value_block(value, addr):
+    """MIFARE value block: signed 32-bit value, its inverse and the value again (little-endian),
+    then the address byte, its inverse, the byte and its inverse. The card checks the
+    redundancy on every increment/decrement/restore."""
+    data = list((value & 0xFFFFFFFF).to_bytes(4, 'little'))
+    return data + [b ^ 0xFF for b in data] + data + [addr & 0xFF, ~addr & 0xFF, addr & 0xFF, ~addr & 0xFF]
+
+def unpack_value_block(block):
+    """(value, addr) of a value block, or None if the block is not in value block format"""
+    if not block or len(block) != 16:
+        return None
+    data, inverted, copy = block[0:4], block[4:8], block[8:12]
+    if data != copy or any(a ^ b != 0xFF for a, b in zip(data, inverted)):
+        return None
+    if block[12] != block[14] or block[13] != block[15] or block[12] ^ block[13] != 0xFF:
+        return None
+    return int.from_bytes(bytes(data), 'little', signed=True), block[12]
+
+def crc8(data):
+    """CRC-8 (poly 0x07, init 0x00), the card record checksum"""
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+class CardRecordError(ValueError):
+    """Block contents are not a valid card record"""
+
+class CardRecord:
+    """Roll number, machine permissions and issuance session packed into one 16-byte block
+
+    Record block layout (multi-byte fields big-endian):
+      [0]      0x80 | version << 4 | roll digit count  (bit 7 never set in legacy ASCII)
+      [1..5]   roll number as a 40-bit integer (digit count restores leading zeros)
+      [6..7]   permission bits for machines 1-16, bit n-1 = machine ID n
+      [8..11]  session ID, 32 bits (printed as 8 hex digits)
+      [12..14] issue time in minutes since RECORD_EPOCH (2024-01-01 UTC), 24 bits
+      [15]     CRC-8 (poly 0x07, init 0x00) over bytes 0..14
+
+    Version 1 stops there. Version 2 (any machine ID above 16) is followed by
+    extension blocks in the next data blocks of the sector:
+      [0]      number of extension blocks
+      [1..14]  permission bits for the next 112 machines, little-endian
+      [15]     CRC-8 over bytes 0..14
+
+    Access_Node.ino carries the matching decodeCardRecord().
+    """
+    VERSION = 1
+    EXTENDED_VERSION = 2
+    RECORD_EPOCH = 1704067200
+    MAX_ROLL_DIGITS = 12
+    BASE_BITS = 16
+    EXTENSION_BITS = 112
+    MAX_EXTENSION_BLOCKS = 2    # blocks 9 and 10 share the record's sector
+    MAX_MACHINES = BASE_BITS + EXTENSION_BITS * MAX_EXTENSION_BLOCKS
+
+    def __init__(self, roll_number, permissions, session_id, issued_at, version=VERSION):
+        self.roll_number = str(roll_number)
+        self.permissions = permissions
+        self.session_id = session_id
+        self.issued_at = issued_at
+        self.version = version
+
+    @classmethod
+    def new(cls, roll_number, permissions):
+        """Record for a fresh issuance: random session ID, issued now"""
+        return cls(roll_number, permissions, uuid.uuid4().int >> 96, int(time.time()))
+
+    @property
+    def session_hex(self):
+        return f"{self.session_id:08X}"
+
+    @property
+    def extension_blocks(self):
+        """Number of bitmap blocks needed after the record block"""
+        extra_bits = self.permissions.bit_length() - self.BASE_BITS
+        return 0 if extra_bits <= 0 else -(-extra_bits // self.EXTENSION_BITS)
+
+    @classmethod
+    def valid_roll(cls, roll_number):
+        """True if the roll number fits the record (digits only, at most MAX_ROLL_DIGITS)"""
+        roll = str(roll_number).strip()
+        return roll.isdigit() and roll.isascii() and len(roll) <= cls.MAX_ROLL_DIGITS
+
+    def pack(self):
+        """Encode as a list of 16-byte blocks: the record, then any extension blocks"""
+        roll = self.roll_number.strip()
+        if not self.valid_roll(roll):
+            raise CardRecordError(f"Roll number '{roll}' cannot be stored on a card: "
+                                  f"records hold numeric roll numbers of 1-{self.MAX_ROLL_DIGITS} digits")
+        if self.permissions < 0 or self.permissions.bit_length() > self.MAX_MACHINES:
+            raise CardRecordError(f"Permissions exceed {self.MAX_MACHINES} machines")
+        minutes = (int(self.issued_at) - self.RECORD_EPOCH) // 60
+        if not 0 <= minutes <= 0xFFFFFF:
+            raise CardRecordError("Issue time outside the record range")
+
+        extensions = self.extension_blocks
+        version = self.EXTENDED_VERSION if extensions else self.VERSION
+        block = [0x80 | (version << 4) | len(roll)]
+        block += list(int(roll).to_bytes(5, 'big'))
+        block += list((self.permissions & 0xFFFF).to_bytes(2, 'big'))
+        block += list((self.session_id & 0xFFFFFFFF).to_bytes(4, 'big'))
+        block += list(minutes.to_bytes(3, 'big'))
+        block.append(crc8(block))
+
+        blocks = [block]
+        bits = self.permissions >> self.BASE_BITS
+        for _ in range(extensions):
+            ext = [extensions] + list((bits & ((1 << self.EXTENSION_BITS) - 1)).to_bytes(14, 'little'))
+            ext.append(crc8(ext))
+            blocks.append(ext)
+            bits >>= self.EXTENSION_BITS
+        return blocks
+
+    @staticmethod
+    def is_record(block):
+        """True if the block holds a binary record rather than legacy ASCII"""
+        return bool(block) and (block[0] & 0x80) != 0
+
+    @classmethod
+    def has_extension(cls, block):
+        """True if the record block is followed by permission extension blocks"""
+        return cls.is_record(block) and (block[0] >> 4) & 0x07 == cls.EXTENDED_VERSION
+
+    @classmethod
+    def session_of(cls, block):
+        """Session ID of a binary record block with a good checksum, else None"""
+        if not cls.is_record(block) or len(block) != 16 or crc8(block[:15]) != block[15]:
+            return None
+        return int.from_bytes(bytes(block[8:12]), 'big')
+
+    @classmethod
+    def unpack(cls, block, extensions=()):
+        """Decode a record block (plus its extension blocks for version 2);
+        raises CardRecordError on a bad version, checksum or missing extension"""
+        if not block or len(block) != 16 or not cls.is_record(block):
+            raise CardRecordError("Block does not hold a binary card record")
+        version = (block[0] >> 4) & 0x07
+        if version not in (cls.VERSION, cls.EXTENDED_VERSION):
+            raise CardRecordError(f"Unsupported card record version {version}")
+        if crc8(block[:15]) != block[15]:
+            raise CardRecordError("Card record checksum mismatch")
+        digits = block[0] & 0x0F
+        roll = str(int.from_bytes(bytes(block[1:6]), 'big')).zfill(digits)
+        permissions = int.from_bytes(bytes(block[6:8]), 'big')
+        minutes = int.from_bytes(bytes(block[12:15]), 'big')
+
+        if version == cls.EXTENDED_VERSION:
+            if not extensions:
+                raise CardRecordError("Card record extension blocks missing")
+            count = extensions[0][0]
+            if not 1 <= count <= cls.MAX_EXTENSION_BLOCKS or len(extensions) < count:
+                raise CardRecordError("Card record extension blocks missing")
+            for i, ext in enumerate(extensions[:count]):
+                if len(ext) != 16 or ext[0] != count or crc8(ext[:15]) != ext[15]:
+                    raise CardRecordError("Card record extension checksum mismatch")
+                bits = int.from_bytes(bytes(ext[1:15]), 'little')
+                permissions |= bits << (cls.BASE_BITS + i * cls.EXTENSION_BITS)
+
+        return cls(roll, permissions, int.from_bytes(bytes(block[8:12]), 'big'),
+                   cls.RECORD_EPOCH + minutes * 60, version)
+
+    @classmethod
+    def from_legacy(cls, roll_block, machine_block, session_block):
+        """Decode the pre-v1 three-block ASCII layout (roll / '0'/'1' flags / session + time)"""
+        roll = ''.join(chr(b) for b in roll_block if b != 0).strip()
+        flags = ''.join(chr(b) for b in machine_block[:16])
+        session = ''.join(chr(b) for b in session_block if b != 0)
+        try:
+            session_id = int(session[:8], 16)
+        except ValueError:
+            session_id = 0
+        # The legacy timestamp was str(int(time.time()))[:8], i.e. seconds // 100
+        issued_at = int(session[8:16]) * 100 if session[8:16].isdigit() else 0
+        return cls(roll, flags_to_mask(flags), session_id, issued_at, version=0)
+
+    def to_dict(self, registry=None):
+        registry = registry or get_registry()
+        return {
+            'roll_number': self.roll_number,
+            'permissions': self.permissions,
+            'machine_flags': mask_to_flags(self.permissions),
+            'machines': registry.names_for(self.permissions),
+            'session_id': self.session_hex,
+            'issued_at': self.issued_at,
+            'record_version': self.version,
+        }
+
+def uid_to_card_id(uid):
+    """Card ID as shown to users and stored in Firestore: the UID bytes as one integer"""
+    card_id = 0
+    for byte in uid:
+        card_id = (card_id << 8) + byte
+    return card_id
+
+def parse_key(text):
+    """6-byte MIFARE key from 12 hex digits; None if empty"""
+    text = text.strip().replace(':', '').replace(' ', '')
+    if not text:
+        return None
+    try:
+        key = list(bytes.fromhex(text))
+    except ValueError:
+        key = []
+    if len(key) != 6:
+        raise ValueError(f"MIFARE key must be 12 hex digits, got {text!r}")
+    return key
+
+def credit_keys(key_a, key_b):
+    """(key A, key B) for the credit sectors. Credits under the transport key could be
+    incremented by any reader, so both must be set, differ and not be the default."""
+    key_a, key_b = parse_key(key_a), parse_key(key_b)
+    if key_a is None or key_b is None:
+        raise ValueError("CREDIT_SECTORS needs CREDIT_KEY_A and CREDIT_KEY_B")
+    if DEFAULT_KEY in (key_a, key_b) or key_a == key_b:
+        raise ValueError("CREDIT_KEY_A and CREDIT_KEY_B must differ and not be the transport key")
+    return key_a, key_b
+
+def credit_slots(sectors, exclude=None):
+    """Data blocks of the comma separated sectors, in order (3 per sector)"""
+    blocks = []
+    for part in sectors.split(','):
+        if not part.strip():
+            continue
+        sector = int(part)
+        if not 1 <= sector <= 15 or sector == exclude:
+            raise ValueError(f"Credit sector {sector} must be 1-15 and not the record sector")
+        blocks += [sector * 4 + i for i in range(3)]
+    return blocks
+
+class RecordCache:
+    """Decoded CardRecords by (card ID, session ID), plus the card known to be in the field
+
+    Every write puts a fresh session ID into the record block, so a (card, session)
+    pair names one record for good: a card that comes back only needs its record
+    block read. While a card stays in the field this station is its only writer,
+    so its record is known without reading anything; an empty probe or the field
+    going off ends that.
+    """
+    def __init__(self, size=None):
+        self.size = size or Config.RFID_RECORD_CACHE
+        self.records = OrderedDict()    # (card_id, session_id) -> (record block, CardRecord)
+        self.present = None             # key of the card in the field since it was last read or written
+
+    def get(self, card_id, block):
+        """Cached record for a binary record block read from the card, or None"""
+        key = (card_id, int.from_bytes(bytes(block[8:12]), 'big'))
+        entry = self.records.get(key)
+        if entry is None or entry[0] != list(block):
+            return None
+        self.records.move_to_end(key)
+        self.present = key
+        return entry[1]
+
+    def in_field(self, card_id):
+        """Record of the card if it has not left the field since it was last read or written"""
+        if self.present is None or self.present[0] != card_id:
+            return None
+        entry = self.records.get(self.present)
+        return entry[1] if entry else None
+
+    def put(self, card_id, block, record):
+        key = (card_id, record.session_id)
+        self.records[key] = (list(block), record)
+        self.records.move_to_end(key)
+        while len(self.records) > self.size:
+            self.records.popitem(last=False)
+        self.present = key
+
+    def card_left(self):
+        self.present = None
+
+    def clear(self):
+        self.records.clear()
+        self.present = None
+
+    def snapshot(self):
+        """JSON-safe entry of the card in the field (for SPI traces), or None"""
+        entry = self.records.get(self.present) if self.present else None
+        if entry is None:
+            return None
+        block, record = entry
+        return {'card_id': self.present[0], 'block': block,
+                'record': [record.roll_number, record.permissions, record.session_id, record.issued_at, record.version]}
+
+    def restore(self, snapshot):
+        if snapshot is None:
+            self.present = None
+        else:
+            self.put(snapshot['card_id'], snapshot['block'], CardRecord(*snapshot['record']))
+
+    def status(self):
+        return {'records': len(self.records), 'size': self.size,
+                'in_field': self.present[0] if self.present else None}
+
 class RFIDHandler:
-    def __init__(self):
+    def __init__(self, transport=None):
         """Initialize RFID reader with simple configuration"""
-        self.reader = SimpleMFRC522()
+        self.reader = SimpleMFRC522(transport=transport)
         self.mfrc = self.reader.mfrc
+        self.records = RecordCache()
         self.current_card_id = None
         self.last_detection_time = 0
         self.detection_cooldown = 0.5
         
-        # Data block assignments for clean organization
-        self.ROLL_BLOCK = 8      # Block 8 for roll number
-        self.MACHINE_BLOCK = 9   # Block 9 for machine access flags
-        self.SESSION_BLOCK = 10  # Block 10 for session ID and timestamp
+        # Data block assignments: the binary CardRecord lives in block 8.
+        # Cards issued before it carry the legacy ASCII layout in blocks 8-10.
+        self.RECORD_BLOCK = 8
+        self.ROLL_BLOCK = 8      # Legacy: roll number
+        self.MACHINE_BLOCK = 9   # Legacy: machine access flags
+        self.SESSION_BLOCK = 10  # Legacy: session ID and timestamp
+        # Usage credits: value blocks in CREDIT_SECTORS, address byte = machine ID
+        self.CREDIT_BLOCKS = credit_slots(Config.CREDIT_SECTORS, exclude=self.RECORD_BLOCK // 4)
+        self.CREDIT_KEYS = credit_keys(Config.CREDIT_KEY_A, Config.CREDIT_KEY_B) if self.CREDIT_BLOCKS else None
         
         print("RFID Handler initialized with simplified write structure")
     
+    @traced
     def detect_card(self):
         """Simple card detection with cooldown"""
         try:
@@ -420,8 +1300,10 @@ class RFIDHandler:
             if current_time - self.last_detection_time < self.detection_cooldown:
                 return self.current_card_id
             
+            self.field_on()
             (status, _) = self.mfrc.MFRC522_Request(self.mfrc.PICC_REQIDL)
             if status != self.mfrc.MI_OK:
+                self.records.card_left()
                 if self.current_card_id is not None:
                     print("Card removed")
                     self.current_card_id = None
@@ -447,21 +1329,68 @@ class RFIDHandler:
             print(f"Card detection error: {e}")
             return None
     
+    @traced
+    def field_on(self):
+        """Make sure the RF field is up, giving cards time to power up if it was off"""
+        if self.mfrc.antenna_on():
+            time.sleep(Config.RFID_FIELD_SETTLE)
+
+    @traced
+    def field_off(self):
+        self.records.card_left()
+        self.mfrc.antenna_off()
+
+    @traced
+    def poll_card(self, power_down=False):
+        """
+        One presence probe: card ID of the card in the field, or None.
+        WUPA wakes idle and halted cards alike; the card is halted again after
+        anticollision so the next probe gets an answer on the first request.
+        With power_down the field is switched off again when no card answers.
+        """
+        try:
+            self.field_on()
+            (status, _) = self.mfrc.MFRC522_Request(self.mfrc.PICC_REQALL)
+            if status != self.mfrc.MI_OK:
+                self.records.card_left()
+                if power_down:
+                    self.field_off()
+                return None
+            (status, uid) = self.mfrc.MFRC522_Anticoll()
+            self.mfrc.MFRC522_Halt()
+            if status != self.mfrc.MI_OK:
+                return None
+            
+            card_id = uid_to_card_id(uid)
+            if not self.records.in_field(card_id):
+                self.records.card_left()
+            return card_id
+        except Exception as e:
+            print(f"Card poll error: {e}")
+            return None
+    
+    @traced
     def is_card_present(self):
         """Quick card presence check"""
         try:
-            (status, _) = self.mfrc.MFRC522_Request(self.mfrc.PICC_REQIDL)
-            return status == self.mfrc.MI_OK
+            self.field_on()
+            # WUPA also sees cards halted by a finished sector session; a card still
+            # READY from an earlier request only answers the second attempt
+            for _ in range(2):
+                (status, _) = self.mfrc.MFRC522_Request(self.mfrc.PICC_REQALL)
+                if status == self.mfrc.MI_OK:
+                    return True
+            return False
         except Exception as e:
             print(f"Card presence check error: {e}")
             return False
     
-    def write_card(self, roll_number, machine_flags):
+    def write_card(self, roll_number, machine_flags, credits=None):
         """
-        Simplified card writing with three data blocks:
-        - Block 8: Roll number (16 bytes)
-        - Block 9: Machine flags (16 bytes, first 16 chars are the binary flags)
-        - Block 10: Session ID + timestamp (16 bytes)
+        Write a CardRecord (roll number, permissions, session) into the record block(s).
+        machine_flags is an integer bitmask, a list of machine names/IDs or a
+        16-character '0'/'1' string. credits ({machine ID: amount}) go into the
+        credit value blocks, replacing whatever the card held.
         """
         print(f"Starting card write - Roll: {roll_number}, Flags: {machine_flags}")
         
@@ -469,41 +1398,83 @@ class RFIDHandler:
         if not roll_number or not str(roll_number).strip():
             return False, "Roll number is required"
         
-        if not machine_flags or len(machine_flags) != 16:
-            return False, f"Machine flags must be exactly 16 characters (got {len(machine_flags) if machine_flags else 0})"
-        
-        if not all(c in '01' for c in machine_flags):
-            return False, "Machine flags must contain only 0s and 1s"
+        if isinstance(machine_flags, int):
+            permissions = machine_flags
+        elif isinstance(machine_flags, (list, tuple, set)):
+            permissions = get_registry().mask_for(machine_flags)
+        else:
+            if not machine_flags or len(machine_flags) != 16:
+                return False, f"Machine flags must be exactly 16 characters (got {len(machine_flags) if machine_flags else 0})"
+            
+            if not all(c in '01' for c in machine_flags):
+                return False, "Machine flags must contain only 0s and 1s"
+            permissions = flags_to_mask(machine_flags)
         
-        # Check card presence
-        if not self.is_card_present():
-            return False, "No card detected"
+        try:
+            record = CardRecord.new(str(roll_number).strip(), permissions)
+            blocks = self.record_blocks(record, credits)
+        except CardRecordError as e:
+            return False, str(e)
         
+        # No separate presence check: it would leave the card READY, and the sector
+        # session's WUPA is then dropped. With no card the write fails on its own.
+        return self.write_record(record, blocks)
+    
+    def record_blocks(self, record, credits=None):
+        """{block: 16 bytes} for a record and its credits; raises CardRecordError if they do not fit"""
+        blocks = {self.RECORD_BLOCK + i: block for i, block in enumerate(record.pack())}
+        blocks.update(self.credit_blocks(credits or {}, record.permissions))
+        return blocks
+
+    def credit_blocks(self, credits, permissions):
+        """{block: 16 bytes} for every credit slot: a value block per machine in
+        {machine ID: amount}, the rest cleared so nothing from an earlier issuance stays usable.
+        Credits must be for machines in the permission mask."""
+        if not self.CREDIT_BLOCKS:
+            if credits:
+                print("Credits not written: CREDIT_SECTORS is not set")
+            return {}
+        if len(credits) > len(self.CREDIT_BLOCKS):
+            raise CardRecordError(f"Credits for {len(credits)} machines do not fit in {len(self.CREDIT_BLOCKS)} credit blocks")
+        blocks = {block: [0] * 16 for block in self.CREDIT_BLOCKS}
+        for block, (machine_id, amount) in zip(self.CREDIT_BLOCKS, sorted(credits.items())):
+            if not 1 <= machine_id <= CardRecord.MAX_MACHINES:
+                raise CardRecordError(f"Credit for unknown machine ID {machine_id}")
+            if not permissions >> (machine_id - 1) & 1:
+                raise CardRecordError(f"Credit for machine {machine_id}, which the card does not permit")
+            if not 0 <= amount <= 0x7FFFFFFF:
+                raise CardRecordError(f"Credit {amount} for machine {machine_id} out of range")
+            blocks[block] = pack_value_block(amount, machine_id)
+        return blocks
+    
+    @traced
+    def write_record(self, record, blocks=None):
+        """Write a prepared CardRecord (blocks packed in advance if given) to the card in the field"""
+        blocks = blocks or self.record_blocks(record)
         try:
-            # Generate unique session ID (8 chars) + timestamp (8 chars)
-            session_id = str(uuid.uuid4())[:8].upper()
-            timestamp = str(int(time.time()))[:8]
-            session_data = f"{session_id}{timestamp}"
-            
-            print(f"Generated session data: {session_data}")
-            
-            # Prepare data for each block
-            roll_data = str(roll_number).ljust(16, '\x00')[:16]  # Pad to 16 bytes
-            machine_data = machine_flags.ljust(16, '0')[:16]     # Pad to 16 bytes  
-            session_data = session_data.ljust(16, '\x00')[:16]   # Pad to 16 bytes
+            print(f"Generated session: {record.session_hex}")
             
-            # Attempt card write with retries
+            # Attempt card write with retries; each one resumes where the last stopped
+            # Until it is confirmed, the card holds neither the old record nor the new one
+            self.records.card_left()
+            progress = {'uid': None, 'done': set(), 'written': set()}
             max_attempts = 3
             for attempt in range(max_attempts):
                 print(f"Write attempt {attempt + 1}/{max_attempts}")
                 
-                if self._write_all_blocks(roll_data, machine_data, session_data):
+                if self._write_blocks(blocks, progress):
+                    WRITE_ATTEMPTS.inc('ok')
+                    self.records.put(uid_to_card_id(progress['uid']), blocks[self.RECORD_BLOCK], record)
                     print("Card write successful!")
-                    return True, f"Card written successfully (Session: {session_id})"
+                    return True, f"Card written successfully (Session: {record.session_hex})"
+                WRITE_ATTEMPTS.inc('failed')
                 
                 if attempt < max_attempts - 1:
-                    print("Write failed, retrying...")
-                    time.sleep(1)
+                    delay = retry_delay(attempt)
+                    remaining = sorted(set(blocks) - progress['done'])
+                    print(f"Write failed, retrying blocks {remaining} in {delay * 1000:.0f} ms...")
+                    time.sleep(delay)
+                    WRITE_RETRY_SLEEP.inc(amount=delay)
             
             return False, "Failed to write after multiple attempts"
             
@@ -511,176 +1482,158 @@ class RFIDHandler:
             print(f"Card write exception: {e}")
             return False, f"Write error: {str(e)}"
     
-    def _write_all_blocks(self, roll_data, machine_data, session_data):
-        """Write data to all three blocks in sequence"""
-        try:
-            # Get card UID
-            (status, _) = self.mfrc.MFRC522_Request(self.mfrc.PICC_REQIDL)
-            if status != self.mfrc.MI_OK:
-                print("Failed to request card")
-                return False
-            
-            (status, uid) = self.mfrc.MFRC522_Anticoll()
-            if status != self.mfrc.MI_OK:
-                print("Failed to get card UID")
-                return False
-            
-            # Select card
-            size = self.mfrc.MFRC522_SelectTag(uid)
-            if size <= 0:
-                print("Failed to select card")
-                return False
-            
-            print(f"Card selected, size: {size}")
-            
-            # Write each block
-            blocks_data = [
-                (self.ROLL_BLOCK, roll_data, "Roll Number"),
-                (self.MACHINE_BLOCK, machine_data, "Machine Flags"), 
-                (self.SESSION_BLOCK, session_data, "Session Data")
-            ]
-            
-            for block_num, data, description in blocks_data:
-                if not self._write_single_block(uid, block_num, data, description):
-                    return False
-                time.sleep(0.1)  # Small delay between block writes
-            
-            # Verify the write
-            print("Verifying written data...")
-            return self._verify_all_blocks(uid, roll_data, machine_data, session_data)
-            
-        except Exception as e:
-            print(f"Write blocks exception: {e}")
-            return False
-    
-    def _write_single_block(self, uid, block_num, data, description):
-        """Write data to a single block"""
-        try:
-            # Default MIFARE key
-            key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
-            
-            # Authenticate
-            status = self.mfrc.MFRC522_Auth(self.mfrc.PICC_AUTHENT1A, block_num, key, uid)
-            if status != self.mfrc.MI_OK:
-                print(f"Authentication failed for block {block_num} ({description})")
-                return False
-            
-            # Convert data to bytes
-            data_bytes = [ord(c) for c in data]
-            
-            # Write block
-            status = self.mfrc.MFRC522_Write(block_num, data_bytes)
-            if status != self.mfrc.MI_OK:
-                print(f"Write failed for block {block_num} ({description})")
-                return False
-            
-            print(f"Successfully wrote block {block_num} ({description})")
-            return True
-            
-        except Exception as e:
-            print(f"Single block write error for block {block_num}: {e}")
-            return False
-    
-    def _verify_all_blocks(self, uid, expected_roll, expected_machine, expected_session):
-        """Verify that all blocks were written correctly"""
+    def sector_session(self, sector, key=None, uid=None):
+        """Authenticated session on one sector of the card in the field (uid if already selected)"""
+        return self.mfrc.sector_session(sector, key, uid=uid)
+
+    def _credit_auth(self):
+        """Keys to try on a credit sector: transport key A first (a card getting credits
+        for the first time, the common case when issuing), then our key B"""
+        return [(PICC_AUTHENT1A, DEFAULT_KEY), (PICC_AUTHENT1B, self.CREDIT_KEYS[1])]
+
+    def _write_blocks(self, blocks, progress):
+        """Bring {block: 16 bytes} up to date in a single selection, one authentication per sector.
+        Credit sectors still on the transport key get their trailer (CREDIT_ACCESS) last.
+        progress ({'uid', 'done'}) carries the blocks (and trailers) already confirmed between attempts."""
+        credit_sectors = {block // 4 for block in self.CREDIT_BLOCKS}
         try:
-            key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
-            
-            # Verify each block
-            blocks_to_verify = [
-                (self.ROLL_BLOCK, expected_roll, "Roll"),
-                (self.MACHINE_BLOCK, expected_machine, "Machine"),
-                (self.SESSION_BLOCK, expected_session, "Session")
-            ]
-            
-            for block_num, expected_data, description in blocks_to_verify:
-                # Authenticate
-                status = self.mfrc.MFRC522_Auth(self.mfrc.PICC_AUTHENT1A, block_num, key, uid)
-                if status != self.mfrc.MI_OK:
-                    print(f"Verification auth failed for {description} block")
-                    return False
-                
-                # Read block
-                read_data = self.mfrc.MFRC522_Read(block_num)
-                if not read_data:
-                    print(f"Verification read failed for {description} block")
-                    return False
-                
-                # Convert to string and compare
-                read_string = ''.join(chr(b) for b in read_data[:16])
-                expected_clean = expected_data.rstrip('\x00')
-                read_clean = read_string.rstrip('\x00')
-                
-                if read_clean != expected_clean:
-                    print(f"Verification failed for {description}: expected '{expected_clean}', got '{read_clean}'")
-                    return False
-                    
-                print(f"Verification passed for {description} block")
-            
+            with self.sector_session(self.RECORD_BLOCK // 4) as session:
+                if progress['uid'] is not None and session.uid != progress['uid']:
+                    # Another card was placed between attempts; nothing on it is confirmed
+                    print("Different card in the field, writing from the first block")
+                    progress['done'].clear()
+                    progress['written'].clear()
+                progress['uid'] = session.uid
+                # A fresh session ID makes the record block differ from whatever the card
+                # holds, until an attempt has tried to write it
+                stale = {self.RECORD_BLOCK} - progress['written']
+                progress['written'].update(block for block in blocks if block not in progress['done'])
+                for sector in sorted({block // 4 for block in blocks}):
+                    sector_blocks = {block: data for block, data in blocks.items() if block // 4 == sector}
+                    trailer = sector * 4 + 3
+                    if set(sector_blocks) <= progress['done'] and \
+                            (sector not in credit_sectors or trailer in progress['done']):
+                        continue
+                    if sector in credit_sectors:
+                        (_, key) = session.switch(sector, self._credit_auth())
+                        if key != DEFAULT_KEY:
+                            progress['done'].add(trailer)   # already ours
+                    elif sector != session.sector:
+                        session.switch(sector)
+                    if not session.update_blocks(sector_blocks, progress['done'], stale):
+                        return False
+                    if trailer not in progress['done'] and sector in credit_sectors:
+                        key_a, key_b = self.CREDIT_KEYS
+                        if not session.write_trailer(key_a, CREDIT_ACCESS, key_b):
+                            return False
+                        progress['done'].add(trailer)
             print("All blocks verified successfully!")
             return True
             
+        except CardSessionError as e:
+            print(f"Card session error: {e}")
+            return False
         except Exception as e:
-            print(f"Verification exception: {e}")
+            print(f"Write blocks exception: {e}")
             return False
     
+    @traced
+    def read_record(self):
+        """
+        (card_id, CardRecord, source) for the card in the field, or None without a card.
+        One activation; the record block and whatever it needs (extension blocks or
+        the rest of the legacy layout) are read in a single sector session. source
+        is 'field' or 'session' when the record came from the cache, 'card' otherwise.
+        Raises CardSessionError or CardRecordError.
+        """
+        self.field_on()
+        (status, uid) = self.mfrc.MFRC522_Activate(select=False)
+        if status != self.mfrc.MI_OK:
+            self.records.card_left()
+            return None
+        card_id = uid_to_card_id(uid)
+
+        # Same card as last time: the UID check is all the RF traffic needed
+        record = self.records.in_field(card_id)
+        if record is not None:
+            self.mfrc.MFRC522_Halt()
+            RECORD_READS.inc('field')
+            return card_id, record, 'field'
+
+        if self.mfrc.MFRC522_SelectTag(uid) <= 0:
+            raise CardSessionError("No card could be selected")
+
+        with self.sector_session(self.RECORD_BLOCK // 4, uid=uid) as session:
+            block = session.read_blocks([self.RECORD_BLOCK])[self.RECORD_BLOCK]
+            if not block:
+                raise CardSessionError("Failed to read record block")
+            if CardRecord.is_record(block):
+                record = self.records.get(card_id, block)
+                if record is not None:
+                    RECORD_READS.inc('session')
+                    return card_id, record, 'session'
+            if CardRecord.has_extension(block):
+                # The first extension block says how many follow
+                first = session.read_blocks([self.RECORD_BLOCK + 1])[self.RECORD_BLOCK + 1] or [0] * 16
+                extra = range(self.RECORD_BLOCK + 2, self.RECORD_BLOCK + min(first[0], CardRecord.MAX_EXTENSION_BLOCKS) + 1)
+                more = session.read_blocks(list(extra))
+                record = CardRecord.unpack(block, [first] + [more[b] or [0] * 16 for b in extra])
+            elif CardRecord.is_record(block):
+                record = CardRecord.unpack(block)
+            else:
+                legacy = session.read_blocks([self.MACHINE_BLOCK, self.SESSION_BLOCK])
+                record = CardRecord.from_legacy(block, legacy[self.MACHINE_BLOCK] or [0] * 16,
+                                                legacy[self.SESSION_BLOCK] or [0] * 16)
+        self.records.put(card_id, block, record)
+        RECORD_READS.inc('card')
+        return card_id, record, 'card'
+
+    @traced
+    def read_credits(self):
+        """
+        {'card_id', 'session_id', 'credits': {machine ID: balance}} of the card in the
+        field, or None without a card. Always read from the card: access nodes debit
+        credits offline, so they are never cached. Raises CardSessionError.
+        """
+        self.field_on()
+        (status, uid) = self.mfrc.MFRC522_Activate()
+        if status != self.mfrc.MI_OK:
+            self.records.card_left()
+            return None
+        credits = {}
+        with self.sector_session(self.RECORD_BLOCK // 4, uid=uid) as session:
+            block = session.read_blocks([self.RECORD_BLOCK])[self.RECORD_BLOCK]
+            session_id = CardRecord.session_of(block) if block else None
+            for sector in sorted({block // 4 for block in self.CREDIT_BLOCKS}):
+                session.switch(sector, self._credit_auth())
+                values = session.read_values([block for block in self.CREDIT_BLOCKS if block // 4 == sector])
+                for value in values.values():
+                    # Address byte 0 (or above MAX_MACHINES): a value block we did not write
+                    if value is not None and 1 <= value[1] <= CardRecord.MAX_MACHINES:
+                        balance, machine_id = value
+                        credits[machine_id] = balance
+        return {'card_id': uid_to_card_id(uid),
+                'session_id': f"{session_id:08X}" if session_id is not None else None,
+                'credits': credits}
+
     def read_card(self):
         """Read all data from the card"""
-        if not self.is_card_present():
-            print("No card present for reading")
-            return None
-        
         try:
-            # Get basic card info
-            id_val, _ = self.reader.read()
-            
-            # Read our custom blocks
-            (status, _) = self.mfrc.MFRC522_Request(self.mfrc.PICC_REQIDL)
-            if status != self.mfrc.MI_OK:
-                return {'card_id': id_val, 'error': 'Failed to request card'}
-            
-            (status, uid) = self.mfrc.MFRC522_Anticoll()
-            if status != self.mfrc.MI_OK:
-                return {'card_id': id_val, 'error': 'Failed to get UID'}
-            
-            key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
-            result = {'card_id': id_val}
-            
-            # Read each block
-            blocks_to_read = [
-                (self.ROLL_BLOCK, 'roll_number'),
-                (self.MACHINE_BLOCK, 'machine_flags'),
-                (self.SESSION_BLOCK, 'session_data')
-            ]
-            
-            for block_num, field_name in blocks_to_read:
-                try:
-                    status = self.mfrc.MFRC522_Auth(self.mfrc.PICC_AUTHENT1A, block_num, key, uid)
-                    if status == self.mfrc.MI_OK:
-                        data = self.mfrc.MFRC522_Read(block_num)
-                        if data:
-                            value = ''.join(chr(b) for b in data[:16] if b != 0)
-                            result[field_name] = value.strip('\x00')
-                        else:
-                            result[field_name] = ''
-                    else:
-                        result[field_name] = ''
-                except Exception as e:
-                    print(f"Error reading block {block_num}: {e}")
-                    result[field_name] = ''
-            
-            # Parse session data if available
-            if 'session_data' in result and len(result['session_data']) >= 16:
-                session_info = result['session_data']
-                result['session_id'] = session_info[:8]
-                result['timestamp'] = session_info[8:16]
-            
-            print(f"Card read result: {result}")
-            return result
-            
+            read = self.read_record()
+        except (CardSessionError, CardRecordError) as e:
+            return {'card_id': None, 'error': str(e)}
         except Exception as e:
             print(f"Card read error: {e}")
-            return {'card_id': id_val if 'id_val' in locals() else None, 'error': str(e)}
+            return {'card_id': None, 'error': str(e)}
+        if read is None:
+            print("No card present for reading")
+            return None
+
+        card_id, record, source = read
+        result = {'card_id': card_id, 'cached': source != 'card'}
+        result.update(record.to_dict())
+        print(f"Card read result: {result}")
+        return result
     
     def cleanup(self):
         """Clean up resources"""
@@ -690,43 +1643,21 @@ class RFIDHandler:
         except Exception as e:
             print(f"Cleanup error: {e}")
 
-# Helper function to convert machine list to binary flags
+def flags_to_mask(flags):
+    """'0'/'1' flag string (position n-1 = machine ID n) to an integer bitmask"""
+    return sum(1 << i for i, c in enumerate(flags) if c == '1')
+
+def mask_to_flags(mask, width=16):
+    """Integer bitmask back to the '0'/'1' flag string"""
+    return ''.join('1' if mask >> i & 1 else '0' for i in range(width))
+
+def machines_to_mask(accessible_machines):
+    """Integer permission bitmask for a list of machine names/IDs (see MachineRegistry)"""
+    return get_registry().mask_for(accessible_machines)
+
 def machines_to_flags(accessible_machines):
-    """
-    Convert list of machine names/IDs to 16-bit binary string
-    Machine ID mapping (you can modify this as needed):
-    """
-    machine_id_map = {
-        '3D Printer': 1,
-        'Laser Cutter': 2, 
-        'CNC Machine': 3,
-        'PCB Mill': 4,
-        'Soldering Station': 5,
-        'Drill Press': 6,
-        'Band Saw': 7,
-        'Lathe': 8,
-        'Milling Machine': 9,
-        'Plasma Cutter': 10,
-        # Add more machines as needed, up to 16 total
-    }
-    
-    flags = ['0'] * 16  # Initialize all bits to 0
-    
-    for machine in accessible_machines:
-        try:
-            if isinstance(machine, str):
-                machine_id = machine_id_map.get(machine)
-            else:
-                machine_id = int(machine)
-            
-            if machine_id and 1 <= machine_id <= 16:
-                flags[machine_id - 1] = '1'  # Set the corresponding bit
-                
-        except (ValueError, TypeError):
-            print(f"Warning: Could not process machine: {machine}")
-            continue
-    
-    return ''.join(flags)
+    """16-character '0'/'1' flag string for machines 1-16 (legacy card layout)"""
+    return mask_to_flags(machines_to_mask(accessible_machines) & 0xFFFF)
 
 # Example usage
 if __name__ == "__main__":
@@ -741,7 +1672,7 @@ if __name__ == "__main__":
                 print(f"Card detected: {card_id}")
                 
                 # Example: write some data to the card
-                machine_flags = machines_to_flags(['3D Printer', 'Laser Cutter'])
+                machine_flags = machines_to_mask(['3D Printer', 'Laser Cutter'])
                 success, message = handler.write_card("12345", machine_flags)
                 print(f"Write result: {success}, {message}")
                 
@@ -0,0 +1,468 @@
+# SPI trace capture and replay for the MFRC522 driver
+#   RFID_TRACE_PATH=/var/log/rfid/spi.trace python app.py    (record while the station runs)
+#   python spi_trace.py info spi.trace
+#   python spi_trace.py replay spi.trace --realtime -o replayed.trace
+#   python spi_trace.py compare before.trace after.trace
+#
+# File layout (little endian):
+#   header  '<4sBBHd'  magic b'MFRT', version, flags (bit 0: IRQ line wired), JSON length,
+#                      start time (Unix seconds), followed by that many bytes of JSON
+#   record  '<BIIH'    kind, microseconds since the previous record started, duration in
+#                      microseconds (lost record count for GAP), payload length, payload
+# Kinds: XFER (payload: the n bytes sent, then the n bytes received, length = n),
+#        IRQ (payload: 1 if the line asserted), RESET, OP (payload: JSON of a top-level
+#        RFIDHandler call with the driver state at its start) and GAP (records lost
+#        because the ring buffer overflowed).
+# Each file starts a new delta chain and rotation happens only at OP records, so
+# every rotated file can be read and replayed on its own.
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+from config import Config
+
+MAGIC = b'MFRT'
+VERSION = 1
+FLAG_IRQ = 0x01
+HEADER = struct.Struct('<4sBBHd')
+RECORD = struct.Struct('<BIIH')
+XFER, IRQ, RESET, OP, GAP = 1, 2, 3, 4, 5
+KIND_NAMES = {XFER: 'xfer', IRQ: 'irq', RESET: 'reset', OP: 'op', GAP: 'gap'}
+MAX_U32 = 0xFFFFFFFF
+
+def _us(seconds):
+    return max(0, min(MAX_U32, int(seconds * 1e6)))
+
+def _encode_arg(value):
+    # CardRecord is the only non-JSON argument of a traced operation; packed block
+    # dicts are derived from it and rebuilt on replay
+    if hasattr(value, 'session_id') and hasattr(value, 'pack'):
+        return {'record': [value.roll_number, value.permissions, value.session_id, value.issued_at, value.version]}
+    if isinstance(value, dict):
+        return None
+    return value
+
+def _decode_arg(value):
+    if isinstance(value, dict) and 'record' in value:
+        from rfid_handler import CardRecord
+        return CardRecord(*value['record'])
+    return value
+
+class TraceRecorder:
+    """Transport wrapper that records every transfer, IRQ wait and reset
+
+    The driver thread only appends to an in-memory ring buffer; a background
+    thread encodes and writes it. If the writer falls behind, the oldest records
+    are dropped and a GAP is written in their place. Files rotate at max_bytes,
+    keeping max_files (path, path.1, ... oldest last).
+    """
+
+    def __init__(self, transport, path, max_bytes=None, max_files=None, buffer_records=None, info=None):
+        self.transport = transport
+        self.path = path
+        self.max_bytes = max_bytes or Config.RFID_TRACE_MAX_BYTES
+        self.max_files = max_files or Config.RFID_TRACE_FILES
+        self.capacity = buffer_records or Config.RFID_TRACE_BUFFER
+        self.info = dict(info or {})
+        self.ring = collections.deque()
+        self.seq = 0
+        self.written_seq = 0
+        self.dropped = 0
+        self.depth = 0
+        self.file = None
+        self.size = 0
+        self.last_start = None
+        self.files_written = 0
+        self.wake = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name='spi-trace')
+        self.thread.start()
+
+    # Transport interface
+
+    def xfer2(self, data):
+        start = time.perf_counter()
+        rx = self.transport.xfer2(data)
+        self._push(XFER, start, time.perf_counter() - start, bytes(data) + bytes(rx))
+        return rx
+
+    def wait_for_irq(self, timeout):
+        start = time.perf_counter()
+        asserted = self.transport.wait_for_irq(timeout)
+        self._push(IRQ, start, time.perf_counter() - start, bytes([1 if asserted else 0]))
+        return asserted
+
+    def reset(self):
+        start = time.perf_counter()
+        self.transport.reset()
+        self._push(RESET, start, time.perf_counter() - start)
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join(5)
+        self.transport.close()
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    @contextlib.contextmanager
+    def trace_op(self, name, args, kwargs, mfrc, handler_state=None):
+        """Mark a handler operation; only the outermost one is written"""
+        self.depth += 1
+        try:
+            if self.depth == 1:
+                state = {
+                    'op': name,
+                    'args': [_encode_arg(a) for a in args],
+                    'kwargs': {k: _encode_arg(v) for k, v in kwargs.items()},
+                    'shadow': {str(reg): value for reg, value in mfrc.shadow.items()},
+                    'antenna': mfrc.antenna_on_since is not None,
+                }
+                state.update(handler_state or {})
+                self._push(OP, time.perf_counter(), 0.0, json.dumps(state).encode())
+            yield
+        finally:
+            self.depth -= 1
+
+    # Recording
+
+    def _push(self, kind, start, duration, payload=b''):
+        if len(self.ring) >= self.capacity:
+            try:
+                self.ring.popleft()
+                self.dropped += 1
+            except IndexError:
+                pass
+        self.seq += 1
+        self.ring.append((self.seq, kind, start, duration, payload))
+        if len(self.ring) >= self.capacity // 2:
+            self.wake.set()
+
+    def _open(self):
+        self.file = open(self.path, 'wb')
+        info = json.dumps(self.info).encode()
+        flags = FLAG_IRQ if getattr(self.transport, 'has_irq', False) else 0
+        self.file.write(HEADER.pack(MAGIC, VERSION, flags, len(info), time.time()) + info)
+        self.size = HEADER.size + len(info)
+        self.last_start = None
+        self.files_written += 1
+
+    def _rotate(self):
+        self.file.close()
+        names = [self.path] + [f"{self.path}.{index}" for index in range(1, self.max_files)]
+        if len(names) > 1:
+            for newer, older in reversed(list(zip(names, names[1:]))):
+                if os.path.exists(newer):
+                    os.replace(newer, older)
+        self._open()
+
+    def _write(self, kind, start, duration, payload):
+        delta = 0 if self.last_start is None else start - self.last_start
+        self.last_start = start
+        if kind == XFER:
+            length = len(payload) // 2
+        else:
+            length = len(payload)
+        record = RECORD.pack(kind, _us(delta), duration if kind == GAP else _us(duration), length) + payload
+        self.file.write(record)
+        self.size += len(record)
+
+    def _drain(self):
+        while True:
+            try:
+                seq, kind, start, duration, payload = self.ring.popleft()
+            except IndexError:
+                break
+            if self.file is None:
+                self._open()
+            elif kind == OP and self.size >= self.max_bytes:
+                self._rotate()
+            if seq != self.written_seq + 1:
+                self._write(GAP, start, min(MAX_U32, seq - self.written_seq - 1), b'')
+            self._write(kind, start, duration, payload)
+            self.written_seq = seq
+        if self.file is not None:
+            self.file.flush()
+
+    def _run(self):
+        while True:
+            self.wake.wait(0.5)
+            self.wake.clear()
+            try:
+                self._drain()
+            except Exception as e:
+                print(f"SPI trace write error: {e}")
+            if not self.running:
+                break
+        if self.file is not None:
+            self.file.close()
+
+    def status(self):
+        return {'path': self.path, 'records': self.seq, 'dropped': self.dropped,
+                'buffered': len(self.ring), 'files_written': self.files_written}
+
+# Reading
+
+def load_trace(path):
+    """(header dict, [(kind, t, duration, payload)]) with t in seconds from the file start"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is empty or truncated")
+    magic, version, flags, info_len, started = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not an SPI trace (version {VERSION})")
+    offset = HEADER.size
+    header = {'irq': bool(flags & FLAG_IRQ), 'started': started,
+              'info': json.loads(data[offset:offset + info_len] or b'{}')}
+    offset += info_len
+    records = []
+    t = 0.0
+    while offset + RECORD.size <= len(data):
+        kind, delta, duration, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        size = length * 2 if kind == XFER else length
+        if offset + size > len(data):
+            break   # torn final record
+        payload = data[offset:offset + size]
+        offset += size
+        if kind == GAP:
+            records.append((kind, t, duration, b''))
+            continue
+        t += delta / 1e6
+        records.append((kind, t, duration / 1e6, payload))
+    return header, records
+
+def split_ops(records):
+    """(records before the first OP, [{'op': state, 't': start, 'records': [...], 'gap': bool}])"""
+    preamble = []
+    ops = []
+    for record in records:
+        if record[0] == OP:
+            ops.append({'op': json.loads(record[3]), 't': record[1], 'records': [], 'gap': False})
+        elif ops:
+            ops[-1]['records'].append(record)
+            if record[0] == GAP:
+                ops[-1]['gap'] = True
+        else:
+            preamble.append(record)
+    return preamble, ops
+
+def op_profile(op):
+    """Transfers, bytes, bus time, IRQ wait and wall time of one operation"""
+    xfers = [r for r in op['records'] if r[0] == XFER]
+    irqs = [r for r in op['records'] if r[0] == IRQ]
+    end = max((r[1] + r[2] for r in op['records'] if r[0] != GAP), default=op['t'])
+    return {
+        'transfers': len(xfers),
+        'bytes': sum(len(r[3]) // 2 for r in xfers),
+        'bus': sum(r[2] for r in xfers),
+        'irq_wait': sum(r[2] for r in irqs),
+        'wall': end - op['t'],
+    }
+
+def summarize(paths):
+    """Per-operation totals over one or more trace files"""
+    summary = collections.OrderedDict()
+    gaps = 0
+    for path in paths:
+        _, records = load_trace(path)
+        _, ops = split_ops(records)
+        for op in ops:
+            gaps += op['gap']
+            entry = summary.setdefault(op['op']['op'], collections.Counter())
+            entry['calls'] += 1
+            entry.update(op_profile(op))
+    return summary, gaps
+
+def print_summary(title, summary):
+    print(title)
+    print(f"  {'operation':<18}{'calls':>7}{'xfers/call':>12}{'bytes/call':>12}{'bus us/call':>13}{'wall ms/call':>14}")
+    for name, entry in summary.items():
+        calls = entry['calls']
+        print(f"  {name:<18}{calls:>7}{entry['transfers'] / calls:>12.1f}{entry['bytes'] / calls:>12.1f}"
+              f"{entry['bus'] / calls * 1e6:>13.1f}{entry['wall'] / calls * 1000:>14.2f}")
+
+# Replay
+
+class ReplayDivergence(Exception):
+    """The driver asked for a transfer that differs from the recording"""
+
+class ReplayTransport:
+    """Answers the driver from recorded transfers, checking each request against the trace
+
+    With realtime=True every transfer and IRQ wait completes at its recorded offset
+    from the start of the operation, reproducing the original timing profile.
+    """
+
+    def __init__(self, has_irq, realtime=False):
+        self.has_irq = has_irq
+        self.realtime = realtime
+        self.records = []
+        self.pos = 0
+        self.op_start = 0.0
+        self.started = 0.0
+        self.passthrough = False
+        self.divergence = None
+        self.transactions = 0
+        self.bytes_transferred = 0
+
+    def load(self, records, op_start):
+        self.records = [r for r in records if r[0] != GAP]
+        self.pos = 0
+        self.op_start = op_start
+        self.started = time.perf_counter()
+        self.divergence = None
+
+    def remaining(self):
+        return len(self.records) - self.pos
+
+    def _next(self, kind, description):
+        if self.divergence is not None:
+            return None
+        if self.pos >= len(self.records):
+            self.divergence = f"extra {description} after the recorded operation ended"
+            return None
+        record = self.records[self.pos]
+        if record[0] != kind:
+            self.divergence = f"record {self.pos}: driver did {description}, trace has {KIND_NAMES[record[0]]}"
+            return None
+        self.pos += 1
+        if self.realtime:
+            delay = self.started + (record[1] - self.op_start) + record[2] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return record
+
+    def xfer2(self, data):
+        self.transactions += 1
+        self.bytes_transferred += len(data)
+        if self.passthrough:
+            return [0] * len(data)
+        record = self._next(XFER, f"transfer {bytes(data).hex()}")
+        if record is None:
+            return [0] * len(data)
+        n = len(record[3]) // 2
+        sent, received = record[3][:n], record[3][n:]
+        if bytes(data) != sent:
+            self.divergence = f"record {self.pos - 1}: driver sent {bytes(data).hex()}, trace has {sent.hex()}"
+            return [0] * len(data)
+        return list(received)
+
+    def wait_for_irq(self, timeout):
+        if self.passthrough:
+            return True
+        record = self._next(IRQ, "IRQ wait")
+        return bool(record and record[3] and record[3][0])
+
+    def reset(self):
+        if not self.passthrough:
+            self._next(RESET, "reset")
+
+    def close(self):
+        pass
+
+def replay(path, realtime=False, out=None, verbose=False):
+    """Run the recorded operations through the current driver; returns (matched, diverged, skipped)"""
+    from rfid_handler import RFIDHandler
+    header, records = load_trace(path)
+    preamble, ops = split_ops(records)
+    Config.RFID_CRC_MODE = header['info'].get('crc_mode', Config.RFID_CRC_MODE)
+    transport = ReplayTransport(header['irq'], realtime=realtime)
+    driver_transport = TraceRecorder(transport, out, info=header['info']) if out else transport
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+    # A trace from process start includes the reset and init sequence; a rotated
+    # file starts at an operation and the driver state comes from its OP record
+    from_start = bool(preamble) and all(record[0] != GAP for record in preamble)
+    transport.passthrough = not from_start
+    transport.load(preamble, 0.0)
+    with output:
+        handler = RFIDHandler(transport=driver_transport)
+    transport.passthrough = False
+    if from_start and transport.divergence:
+        print(f"init: diverged, {transport.divergence}")
+
+    matched = diverged = skipped = 0
+    started = time.perf_counter()
+    for index, op in enumerate(ops):
+        state = op['op']
+        if op['gap']:
+            skipped += 1
+            continue
+        handler.mfrc.shadow = {int(reg): value for reg, value in state['shadow'].items()}
+        if state['antenna'] != (handler.mfrc.antenna_on_since is not None):
+            handler.mfrc.antenna_on_since = time.monotonic() if state['antenna'] else None
+        if 'in_field' in state:
+            handler.records.restore(state['in_field'])
+        transport.load(op['records'], op['t'])
+        args = [_decode_arg(a) for a in state['args']]
+        kwargs = {k: _decode_arg(v) for k, v in state['kwargs'].items()}
+        with output:
+            getattr(handler, state['op'])(*args, **kwargs)
+        if transport.divergence is None and transport.remaining():
+            transport.divergence = f"{transport.remaining()} recorded records not requested"
+        if transport.divergence:
+            diverged += 1
+            print(f"op {index} {state['op']}: diverged, {transport.divergence}")
+        else:
+            matched += 1
+    elapsed = time.perf_counter() - started
+    if out:
+        driver_transport.close()
+    recorded = (ops[-1]['t'] - ops[0]['t']) if len(ops) > 1 else 0.0
+    print(f"Replayed {len(ops)} operations: {matched} matched, {diverged} diverged, {skipped} skipped (ring buffer gaps)")
+    print(f"  {transport.transactions} transfers, {elapsed:.2f} s replay vs {recorded:.2f} s recorded"
+          f"{'' if realtime else ' (use --realtime for recorded timing)'}")
+    return matched, diverged, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, replay and compare MFRC522 SPI traces")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    info = sub.add_parser('info', help="per-operation transfers, bytes, bus and wall time")
+    info.add_argument('traces', nargs='+')
+
+    rep = sub.add_parser('replay', help="feed a trace back through the current driver")
+    rep.add_argument('trace')
+    rep.add_argument('--realtime', action='store_true', help="reproduce the recorded timing")
+    rep.add_argument('-o', '--out', help="record the replayed transfers to a new trace")
+    rep.add_argument('--verbose', action='store_true', help="show driver output")
+
+    cmp = sub.add_parser('compare', help="per-operation cost before and after a driver change")
+    cmp.add_argument('before')
+    cmp.add_argument('after')
+
+    args = parser.parse_args()
+    if args.command == 'info':
+        summary, gaps = summarize(args.traces)
+        print_summary(', '.join(args.traces), summary)
+        if gaps:
+            print(f"  {gaps} operations with ring buffer gaps")
+    elif args.command == 'replay':
+        _, diverged, _ = replay(args.trace, realtime=args.realtime, out=args.out, verbose=args.verbose)
+        sys.exit(1 if diverged else 0)
+    elif args.command == 'compare':
+        before, _ = summarize([args.before])
+        after, _ = summarize([args.after])
+        print(f"{'operation':<18}{'xfers/call':>20} {'bus us/call':>24} {'wall ms/call':>24}")
+        for name in list(before) + [n for n in after if n not in before]:
+            cells = []
+            for key, scale, fmt in (('transfers', 1, '.1f'), ('bus', 1e6, '.0f'), ('wall', 1e3, '.2f')):
+                values = [e[key] / e['calls'] * scale if e else None for e in (before.get(name), after.get(name))]
+                text = ' -> '.join('-' if v is None else format(v, fmt) for v in values)
+                if None not in values and values[0]:
+                    text += f" ({(values[1] - values[0]) / values[0]:+.0%})"
+                cells.append(text)
+            print(f"{name:<18}{cells[0]:>20} {cells[1]:>24} {cells[2]:>24}")
+
+if __name__ == '__main__':
+    main()
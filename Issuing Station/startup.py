@@ -0,0 +1,97 @@
+import threading
+import time
+import traceback
+
+class NotReady(Exception):
+    """A subsystem a request needs is still starting (or failed to start)"""
+
+    def __init__(self, name, state, error=None):
+        message = f"{name} is {state}" + (f": {error}" if error else "")
+        super().__init__(message)
+        self.name = name
+        self.state = state
+
+class Subsystem:
+    def __init__(self, name, init, retry=None, gating=True):
+        self.name = name
+        self.init = init
+        self.retry = retry      # seconds between attempts after a failure; None gives up
+        self.gating = gating    # False: reported, but not waited for by ready()
+        self.state = 'pending'
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.started = None
+        self.seconds = None
+        self.done = threading.Event()
+
+    def run(self, since):
+        while True:
+            self.state = 'starting'
+            self.attempts += 1
+            self.started = time.monotonic()
+            try:
+                self.result = self.init()
+            except Exception as e:
+                self.error = str(e)
+                self.state = 'failed'
+                print(f"Startup: {self.name} failed: {e}")
+                if self.attempts == 1:
+                    traceback.print_exc()
+                if self.retry is None:
+                    self.done.set()
+                    return
+                time.sleep(self.retry)
+                continue
+            self.error = None
+            self.state = 'ready'
+            # Since startup began, i.e. what a kiosk waits for after power-on
+            self.seconds = round(time.monotonic() - since, 3)
+            print(f"Startup: {self.name} ready after {self.seconds} s")
+            self.done.set()
+            return
+
+    def status(self):
+        status = {'state': self.state, 'attempts': self.attempts}
+        if not self.gating:
+            status['gating'] = False
+        if self.seconds is not None:
+            status['ready_after_seconds'] = self.seconds
+        if self.error:
+            status['error'] = self.error
+        return status
+
+class Startup:
+    """Initialize independent subsystems in parallel background threads
+
+    The process serves requests right away; handlers ask for what they need
+    with get(name, timeout) and get NotReady (a 503) while it is not up.
+    A subsystem with retry keeps trying, e.g. until the network is up.
+    One added with gating=False (a best-effort warm-up) does not hold back ready().
+    """
+
+    def __init__(self):
+        self.subsystems = {}
+        self.since = time.monotonic()
+
+    def add(self, name, init, retry=None, gating=True):
+        self.subsystems[name] = Subsystem(name, init, retry, gating)
+
+    def start(self):
+        self.since = time.monotonic()
+        for subsystem in self.subsystems.values():
+            threading.Thread(target=subsystem.run, args=(self.since,), daemon=True,
+                             name=f'startup-{subsystem.name}').start()
+
+    def get(self, name, timeout=0):
+        """Result of name's init, waiting up to timeout seconds for it"""
+        subsystem = self.subsystems[name]
+        if not subsystem.done.wait(timeout) or subsystem.state != 'ready':
+            raise NotReady(name, subsystem.state, subsystem.error)
+        return subsystem.result
+
+    def ready(self):
+        return all(subsystem.state == 'ready' for subsystem in self.subsystems.values() if subsystem.gating)
+
+    def status(self):
+        return {name: subsystem.status() for name, subsystem in self.subsystems.items()}
@@ -0,0 +1,159 @@
+# On-card formats: once cards are in circulation these layouts cannot change.
+#   python -m pytest tests
+import contextlib
+import io
+import random
+
+import pytest
+
+import mfrc522_sim
+from mfrc522_sim import MFRC522Simulator, MifareClassic1K
+from rfid_handler import (CREDIT_ACCESS, DEFAULT_KEY, PICC_AUTHENT1A, PICC_AUTHENT1B, CardRecord,
+                          CardRecordError, CardSessionError, RFIDHandler, crc8, crc_a, pack_value_block,
+                          unpack_value_block)
+
+KEY_A = [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5]
+KEY_B = [0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5]
+
+def _handler(sim, credit_sectors=()):
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler = RFIDHandler(transport=sim)
+    if credit_sectors:
+        handler.CREDIT_BLOCKS = [sector * 4 + i for sector in credit_sectors for i in range(3)]
+        handler.CREDIT_KEYS = (KEY_A, KEY_B)
+    return handler
+
+# ISO/IEC 14443-3 Annex B examples, and the HLTA frame every reader sends
+@pytest.mark.parametrize('data, expected', [
+    ([0x00, 0x00], [0xA0, 0x1E]),
+    ([0x12, 0x34], [0x26, 0xCF]),
+    ([0x50, 0x00], [0x57, 0xCD]),
+])
+def test_crc_a_vectors(data, expected):
+    assert crc_a(data) == expected
+
+def test_crc_a_table_matches_bitwise_reference():
+    rng = random.Random(14443)
+    for length in range(0, 40):
+        data = [rng.randrange(256) for _ in range(length)]
+        assert crc_a(data) == mfrc522_sim.crc_a(data)
+
+def test_crc8_check_value():
+    # CRC-8 (poly 0x07, init 0x00) of "123456789"
+    assert crc8(b'123456789') == 0xF4
+
+@pytest.mark.parametrize('roll', ['1', '007', '240003021', '999999999999', '000000000001'])
+def test_record_round_trip(roll):
+    record = CardRecord(roll, 0b1010000000000101, 0xDEADBEEF, CardRecord.RECORD_EPOCH + 3600 * 24)
+    blocks = record.pack()
+    assert len(blocks) == 1 and len(blocks[0]) == 16
+    assert blocks[0][15] == crc8(blocks[0][:15])
+    decoded = CardRecord.unpack(blocks[0])
+    assert (decoded.roll_number, decoded.permissions, decoded.session_id, decoded.issued_at, decoded.version) == \
+        (roll, record.permissions, 0xDEADBEEF, record.issued_at, CardRecord.VERSION)
+
+def test_record_layout_is_fixed():
+    # 9 digits, roll 0x0E4E27CD, machines 1 and 3, session, one minute after the epoch, CRC-8
+    record = CardRecord('240003021', 0x0005, 0x12345678, CardRecord.RECORD_EPOCH + 60)
+    assert record.pack() == [[0x99, 0x00, 0x0E, 0x4E, 0x27, 0xCD, 0x00, 0x05,
+                              0x12, 0x34, 0x56, 0x78, 0x00, 0x00, 0x01, 0x59]]
+
+@pytest.mark.parametrize('roll', ['1000000000000', '24BCS001', '', '12.5', '٣٤'])
+def test_record_rejects_rolls_that_do_not_fit(roll):
+    assert not CardRecord.valid_roll(roll)
+    with pytest.raises(CardRecordError):
+        CardRecord(roll, 1, 1, CardRecord.RECORD_EPOCH).pack()
+
+def test_record_twelve_digit_boundary():
+    assert CardRecord.valid_roll('9' * 12)
+    assert not CardRecord.valid_roll('9' * 13)
+
+def test_record_corrupted_crc_is_rejected():
+    block = CardRecord('240003021', 3, 1, CardRecord.RECORD_EPOCH).pack()[0]
+    for index in (1, 7, 11, 15):
+        corrupted = list(block)
+        corrupted[index] ^= 0x01
+        with pytest.raises(CardRecordError):
+            CardRecord.unpack(corrupted)
+        assert CardRecord.session_of(corrupted) is None
+
+def test_extended_record_round_trip():
+    permissions = (1 << 0) | (1 << 16) | (1 << 127) | (1 << 239)
+    record = CardRecord('240003021', permissions, 7, CardRecord.RECORD_EPOCH)
+    blocks = record.pack()
+    assert len(blocks) == 3 and CardRecord.has_extension(blocks[0])
+    decoded = CardRecord.unpack(blocks[0], blocks[1:])
+    assert decoded.permissions == permissions and decoded.version == CardRecord.EXTENDED_VERSION
+    with pytest.raises(CardRecordError):
+        CardRecord.unpack(blocks[0])
+    corrupted = list(blocks[2])
+    corrupted[5] ^= 0x80
+    with pytest.raises(CardRecordError):
+        CardRecord.unpack(blocks[0], [blocks[1], corrupted])
+
+def test_record_rejects_machine_ids_beyond_the_format():
+    with pytest.raises(CardRecordError):
+        CardRecord('1', 1 << CardRecord.MAX_MACHINES, 1, CardRecord.RECORD_EPOCH).pack()
+
+def test_legacy_layout():
+    roll = list(b'240003021') + [0] * 7
+    flags = list(b'1010000000000000')
+    session = list(b'AE66463117040672')
+    record = CardRecord.from_legacy(roll, flags, session)
+    assert (record.roll_number, record.permissions, record.session_id, record.issued_at, record.version) == \
+        ('240003021', 0b101, 0xAE664631, 1704067200, 0)
+    assert not CardRecord.is_record(roll)
+
+@pytest.mark.parametrize('value, addr', [(0, 1), (10, 2), (0x7FFFFFFF, 240), (-1, 7)])
+def test_value_block_layout(value, addr):
+    block = pack_value_block(value, addr)
+    assert block[0:4] == block[8:12]
+    assert [a ^ b for a, b in zip(block[0:4], block[4:8])] == [0xFF] * 4
+    assert block[12:16] == [addr, addr ^ 0xFF, addr, addr ^ 0xFF]
+    assert unpack_value_block(block) == (value, addr)
+
+def test_value_block_rejects_broken_copies():
+    block = pack_value_block(25, 3)
+    for index in (0, 5, 9, 12, 13):
+        broken = list(block)
+        broken[index] ^= 0x10
+        assert unpack_value_block(broken) is None
+
+def test_record_round_trip_on_simulated_card():
+    sim = MFRC522Simulator()
+    handler = _handler(sim)
+    sim.place_card(MifareClassic1K())
+    record = CardRecord.new('240003021', (1 << 2) | (1 << 40))
+    with contextlib.redirect_stdout(io.StringIO()):
+        success, _ = handler.write_record(record)
+        # A second handler has nothing cached: the record is read off the card
+        card_id, read, source = _handler(sim).read_record()
+    assert success and source == 'card'
+    assert (read.roll_number, read.permissions, read.session_id) == \
+        ('240003021', record.permissions, record.session_id)
+
+def test_credit_sector_trailer_on_simulated_card():
+    sim = MFRC522Simulator()
+    handler = _handler(sim, credit_sectors=(3,))
+    card = MifareClassic1K()
+    sim.place_card(card)
+    record = CardRecord.new('240003021', 0b11)
+    with contextlib.redirect_stdout(io.StringIO()):
+        success, _ = handler.write_record(record, handler.record_blocks(record, {1: 10, 2: 5}))
+        credits = handler.read_credits()['credits']
+    assert success and credits == {1: 10, 2: 5}
+    assert card.blocks[15] == KEY_A + CREDIT_ACCESS + KEY_B
+    assert card.blocks[12] == pack_value_block(10, 1)
+
+    mfrc = handler.mfrc
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Access node: key A may decrement but not increment
+        with mfrc.sector_session(3, KEY_A, auth_mode=PICC_AUTHENT1A) as session:
+            assert session.debit(12, 3)
+        with mfrc.sector_session(3, KEY_A, auth_mode=PICC_AUTHENT1A) as session:
+            assert not session.credit(12, 100)
+        with pytest.raises(CardSessionError):
+            with mfrc.sector_session(3, DEFAULT_KEY):
+                pass
+        with mfrc.sector_session(3, KEY_B, auth_mode=PICC_AUTHENT1B) as session:
+            assert session.read_values([12]) == {12: (7, 1)}
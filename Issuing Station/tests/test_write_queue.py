@@ -0,0 +1,99 @@
+# Write-behind journal: replay must survive a crash at any point of an append.
+import json
+
+import pytest
+
+from write_queue import WriteQueue
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, fields, merge=False):
+        self.ops.append((ref, fields))
+
+    def update(self, ref, fields):
+        if ref not in self.db.docs:
+            raise NotFound(f"No document to update: {ref}")
+        self.ops.append((ref, fields))
+
+    def commit(self):
+        for ref, fields in self.ops:
+            self.db.docs.setdefault(ref, {}).update(fields)
+
+class NotFound(Exception):
+    pass
+
+class FakeDb:
+    def __init__(self, docs=()):
+        self.docs = {doc: {} for doc in docs}
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def document(self, path):
+        return path
+
+def _journal(path, *records, torn=''):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.write(torn)
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'write_queue.jsonl')
+
+def test_replay_skips_a_torn_last_line(path):
+    _journal(path,
+             {'seq': 1, 'doc': 'users/1', 'fields': {'card_id': '11'}, 'ts': 1.0},
+             {'seq': 2, 'doc': 'users/2', 'fields': {'card_id': '22'}, 'ts': 2.0},
+             torn='{"seq": 3, "doc": "users/3", "fie')
+    queue = WriteQueue(FakeDb(), path=path)
+    assert sorted(queue.pending) == [1, 2]
+    assert queue.stats['replayed'] == 2
+    # The journal was compacted: the torn line is gone and new entries follow on
+    with open(path) as f:
+        assert [json.loads(line)['seq'] for line in f] == [1, 2]
+    assert queue.enqueue('users/3', {'card_id': '33'}) == 3
+    queue.journal.close()
+
+def test_replay_drops_acked_entries(path):
+    _journal(path,
+             {'seq': 1, 'doc': 'users/1', 'fields': {'card_id': '11'}, 'ts': 1.0},
+             {'seq': 2, 'doc': 'users/1', 'fields': {'pin_hash': 'h'}, 'ts': 2.0},
+             {'ack': [1]},
+             {'seq': 3, 'doc': 'credit_ledger/x', 'fields': {'kind': 'grant'}, 'ts': 3.0},
+             torn='{"ack": [2, ')
+    queue = WriteQueue(FakeDb(), path=path)
+    assert sorted(queue.pending) == [2, 3]
+    assert queue.next_seq == 4
+    queue.journal.close()
+
+def test_replayed_entries_are_committed(path):
+    _journal(path,
+             {'seq': 1, 'doc': 'users/1', 'fields': {'card_id': '11'}, 'ts': 1.0},
+             {'seq': 2, 'doc': 'users/1', 'fields': {'pin_hash': 'h'}, 'ts': 2.0},
+             {'seq': 3, 'doc': 'credit_ledger/x', 'fields': {'kind': 'grant'}, 'ts': 3.0},
+             torn='\x00\x00\x00')
+    db = FakeDb(docs=['users/1'])
+    queue = WriteQueue(db, path=path, linger=0)
+    queue.start()
+    assert queue.flush(5)
+    queue.close()
+    assert db.docs == {'users/1': {'card_id': '11', 'pin_hash': 'h'}, 'credit_ledger/x': {'kind': 'grant'}}
+    assert WriteQueue(db, path=path).pending == {}
+
+def test_update_for_a_deleted_user_is_dead_lettered(path):
+    db = FakeDb(docs=['users/1'])
+    queue = WriteQueue(db, path=path, linger=0)
+    queue.start()
+    queue.enqueue('users/1', {'card_id': '11'})
+    queue.enqueue('users/gone', {'card_id': '99'})
+    assert queue.flush(5)
+    queue.close()
+    assert 'users/gone' not in db.docs and db.docs['users/1'] == {'card_id': '11'}
+    assert queue.status()['dead_letters'] == 1
+    with open(queue.dead_letter_path) as f:
+        assert json.loads(f.readline())['doc'] == 'users/gone'
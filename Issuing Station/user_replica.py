@@ -0,0 +1,287 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from config import Config
+from metrics import firestore_call
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    doc_id      TEXT PRIMARY KEY,
+    roll_number TEXT,
+    card_id     TEXT,
+    data        TEXT NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_roll_number ON users (roll_number);
+CREATE INDEX IF NOT EXISTS users_card_id ON users (card_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+def _timestamp(read_time):
+    """Firestore read_time (datetime or protobuf Timestamp) as Unix seconds"""
+    if read_time is None:
+        return time.time()
+    if hasattr(read_time, 'timestamp'):
+        return read_time.timestamp()
+    return read_time.seconds + read_time.nanos / 1e9
+
+class UserLookupUnavailable(Exception):
+    """Firestore could not be reached and the user is not in the replica"""
+
+class UserReplica:
+    """SQLite (WAL) mirror of the users collection: bootstrapped by a paginated
+    full sync, kept current by a snapshot listener, read locally
+
+    Deletions missed while offline are caught up with: each (re)attached listener's
+    first snapshot lists every document, and rows not in it are dropped; a listener
+    that died is re-attached, and a full sync runs every USER_REPLICA_RECONCILE seconds.
+    """
+
+    def __init__(self, db, path=None, page_size=None):
+        self.db = db
+        self.path = path or Config.USER_REPLICA_PATH
+        self.page_size = page_size or Config.USER_REPLICA_PAGE_SIZE
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.on_change = None   # callable(roll_number) for each listener update
+        self._watch = None
+        self._attached_at = None    # when the current listener was attached
+        self._reconcile = False     # drop rows missing from the listener's first snapshot
+        self._stop = threading.Event()
+        self.synced = threading.Event()
+        self.last_current = None    # read_time of the newest data applied
+        self.event_lag = None       # delay between a change and its arrival here
+        self.stats = {
+            'local_hits': 0,
+            'local_misses': 0,
+            'read_through': 0,
+            'fetch_failed': 0,
+            'listener_events': 0,
+            'full_syncs': 0,
+            'last_full_sync_seconds': None,
+            'listener_attaches': 0,
+            'reconciled_deletes': 0,
+            'max_lag_served': 0.0,
+        }
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'last_current'").fetchone()
+        if row:
+            self.last_current = float(row[0])
+
+    def _conn(self):
+        """One connection per thread; WAL lets kiosk reads run alongside listener writes"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(doc_id, user):
+        return (doc_id, user.get('roll_number') or doc_id, user.get('card_id'),
+                json.dumps(user, default=_json_default), time.time())
+
+    def _upsert(self, conn, rows):
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (doc_id, roll_number, card_id, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+            rows)
+
+    def _mark_current(self, conn, read_time):
+        self.last_current = read_time
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_current', ?)", (str(read_time),))
+
+    def full_sync(self):
+        """Page through the whole collection, then drop rows for deleted documents"""
+        start = time.monotonic()
+        sync_started = time.time()
+        users_ref = self.db.collection('users')
+        seen = 0
+        last_doc = None
+        conn = self._conn()
+        while True:
+            query = users_ref.order_by('__name__').limit(self.page_size)
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            with firestore_call('replica_sync_page'):
+                docs = list(query.stream())
+            if not docs:
+                break
+            with self.write_lock, conn:
+                self._upsert(conn, [self._row(doc.id, doc.to_dict()) for doc in docs])
+            seen += len(docs)
+            last_doc = docs[-1]
+            if len(docs) < self.page_size:
+                break
+
+        with self.write_lock, conn:
+            # Rows not touched by this sync (or the listener meanwhile) were deleted upstream
+            conn.execute("DELETE FROM users WHERE updated_at < ?", (sync_started,))
+            self._mark_current(conn, sync_started)
+        self.stats['full_syncs'] += 1
+        self.stats['last_full_sync_seconds'] = round(time.monotonic() - start, 2)
+        print(f"User replica: synced {seen} users in {self.stats['last_full_sync_seconds']} s")
+        return seen
+
+    def _on_snapshot(self, docs, changes, read_time):
+        read_ts = _timestamp(read_time)
+        conn = self._conn()
+        rolls = []
+        with self.write_lock, conn:
+            if self._reconcile:
+                rolls.extend(self._drop_missing(conn, docs))
+            upserts = []
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    conn.execute("DELETE FROM users WHERE doc_id = ?", (doc.id,))
+                    rolls.append(doc.id)
+                else:
+                    user = doc.to_dict() or {}
+                    upserts.append(self._row(doc.id, user))
+                    rolls.append(user.get('roll_number') or doc.id)
+            self._upsert(conn, upserts)
+            self._mark_current(conn, read_ts)
+        self.stats['listener_events'] += len(changes)
+        self.event_lag = max(0.0, time.time() - read_ts)
+        self.synced.set()
+        if self.on_change:
+            for roll_number in rolls:
+                self.on_change(roll_number)
+
+    def _drop_missing(self, conn, docs):
+        """First snapshot of a new listener: it holds the whole collection, so rows it lacks
+        (and not written here since the listener attached) were deleted while we were away"""
+        self._reconcile = False
+        present = {doc.id for doc in docs}
+        gone = [(doc_id, roll_number) for doc_id, roll_number, updated_at
+                in conn.execute("SELECT doc_id, roll_number, updated_at FROM users")
+                if doc_id not in present and updated_at < self._attached_at]
+        conn.executemany("DELETE FROM users WHERE doc_id = ?", [(doc_id,) for doc_id, _ in gone])
+        self.stats['reconciled_deletes'] += len(gone)
+        if gone:
+            print(f"User replica: removed {len(gone)} users deleted while the listener was down")
+        return [roll_number for _, roll_number in gone]
+
+    def _attach(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+        self._attached_at = time.time()
+        self._reconcile = True
+        self._watch = self.db.collection('users').on_snapshot(self._on_snapshot)
+        self.stats['listener_attaches'] += 1
+
+    def _supervise(self):
+        next_full_sync = time.monotonic() + Config.USER_REPLICA_RECONCILE
+        while not self._stop.is_set():
+            try:
+                if self.count() == 0 or self.last_current is None:
+                    self.full_sync()
+                    next_full_sync = time.monotonic() + Config.USER_REPLICA_RECONCILE
+                if not self.listener_active():
+                    # First start, a start while offline, or a stream that gave up
+                    self._attach()
+                elif Config.USER_REPLICA_RECONCILE and time.monotonic() >= next_full_sync:
+                    self.full_sync()
+                    next_full_sync = time.monotonic() + Config.USER_REPLICA_RECONCILE
+            except Exception as e:
+                print(f"User replica sync error: {e}")
+            self._stop.wait(Config.USER_REPLICA_CHECK_INTERVAL)
+
+    def start(self):
+        """Bootstrap (if needed), attach the listener and keep it attached; runs in the background"""
+        self._stop.clear()
+        threading.Thread(target=self._supervise, daemon=True, name='user-replica').start()
+
+    def listener_active(self):
+        # google-cloud-firestore keeps the watch stream on Watch._rpc; treat a
+        # missing attribute as active rather than depending on it
+        if self._watch is None:
+            return False
+        rpc = getattr(self._watch, '_rpc', None)
+        return bool(getattr(rpc, 'is_active', True)) and not getattr(self._watch, '_closed', False)
+
+    def lag(self):
+        """Seconds the replica may be behind Firestore"""
+        if self.last_current is None:
+            return None
+        if self.listener_active() and self.event_lag is not None:
+            return self.event_lag
+        return max(0.0, time.time() - self.last_current)
+
+    def _load(self, sql, value):
+        row = self._conn().execute(sql, (value,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_roll(self, roll_number):
+        return self._load("SELECT data FROM users WHERE roll_number = ? LIMIT 1", roll_number)
+
+    def get_by_card(self, card_id):
+        return self._load("SELECT data FROM users WHERE card_id = ? LIMIT 1", str(card_id))
+
+    def put(self, roll_number, user):
+        """Store a document fetched or written by this station"""
+        conn = self._conn()
+        with self.write_lock, conn:
+            self._upsert(conn, [self._row(roll_number, user)])
+
+    def apply_local(self, roll_number, fields):
+        """Mirror a field update made by this station, ahead of the listener echo"""
+        user = self.get_by_roll(roll_number)
+        if user is not None:
+            user.update(fields)
+            self.put(roll_number, user)
+
+    def lookup(self, roll_number, fetch):
+        """Read-through lookup: local row first, fetch() on a miss. Raises
+        UserLookupUnavailable if that fetch fails (outage): not the same as no such user.
+        Records the replica lag each answer was served at."""
+        user = self.get_by_roll(roll_number)
+        lag = self.lag() or 0.0
+        if user is not None:
+            self.stats['local_hits'] += 1
+            self.stats['max_lag_served'] = max(self.stats['max_lag_served'], lag)
+            return user
+        self.stats['local_misses'] += 1
+        try:
+            user = fetch(roll_number)
+        except Exception as e:
+            print(f"User replica: {roll_number} not in the replica and Firestore unavailable ({e})")
+            self.stats['fetch_failed'] += 1
+            raise UserLookupUnavailable(f"User {roll_number} could not be looked up: Firestore unavailable") from e
+        self.stats['read_through'] += 1
+        if user is not None:
+            self.put(roll_number, user)
+        return user
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def status(self):
+        lag = self.lag()
+        return dict(self.stats, rows=self.count(), listener_active=self.listener_active(),
+                    lag_seconds=round(lag, 3) if lag is not None else None,
+                    last_current=self.last_current)
+
+    def close(self):
+        self._stop.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
@@ -0,0 +1,283 @@
+import json
+import os
+import random
+import threading
+import time
+
+from config import Config
+from metrics import firestore_call
+
+FIRESTORE_BATCH_LIMIT = 500
+
+# Documents that must already exist: updated, never created, so an update queued for a
+# user deleted meanwhile does not bring back a partial document. Others (credit ledger
+# entries) are created by their first write.
+UPDATE_ONLY = ('users/',)
+
+# Errors that retrying the same write will not fix (google.api_core exception names).
+# Checked by name so this module does not need the Firestore client to import.
+PERMANENT_ERRORS = {'NotFound', 'PermissionDenied', 'InvalidArgument', 'FailedPrecondition', 'OutOfRange'}
+
+def _permanent(error):
+    return any(cls.__name__ in PERMANENT_ERRORS for cls in type(error).__mro__)
+
+def _not_found(error):
+    return any(cls.__name__ == 'NotFound' for cls in type(error).__mro__)
+
+class WriteQueue:
+    """Durable write-behind queue for Firestore field updates
+
+    Every update is appended (and fsynced) to a JSONL journal before enqueue
+    returns; an ack line is appended once its batch commits. On start the
+    journal is replayed and whatever is not acked is sent again. Pending
+    updates to the same document are coalesced into one write.
+
+    A batch that fails with a permanent error (one bad document fails the whole
+    batch) is split and committed document by document. A document whose write
+    keeps failing permanently (max_attempts, or at once for a user document that
+    no longer exists) moves to the dead-letter journal and stops holding up the rest.
+    """
+
+    def __init__(self, db, path=None, batch_size=None, linger=None, max_backoff=None,
+                 max_attempts=None, dead_letter_path=None):
+        self.db = db
+        self.path = path or Config.WRITE_QUEUE_PATH
+        self.batch_size = min(batch_size or Config.WRITE_QUEUE_BATCH_SIZE, FIRESTORE_BATCH_LIMIT)
+        self.linger = linger if linger is not None else Config.WRITE_QUEUE_LINGER
+        self.max_backoff = max_backoff or Config.WRITE_QUEUE_MAX_BACKOFF
+        self.max_attempts = max_attempts or Config.WRITE_QUEUE_MAX_ATTEMPTS
+        self.dead_letter_path = dead_letter_path or self.path + '.dead'
+        self.attempts = {}      # doc_path -> permanent failures so far
+        self.cond = threading.Condition()
+        self.pending = {}       # seq -> (doc_path, fields, queued_at)
+        self.next_seq = 1
+        self.journal = None
+        self.thread = None
+        self.running = False
+        self.stats = {
+            'enqueued': 0,
+            'committed': 0,
+            'coalesced': 0,
+            'batches': 0,
+            'failures': 0,
+            'split_batches': 0,
+            'dead_letters': self._count_dead_letters(),
+            'replayed': 0,
+            'last_error': None,
+        }
+        self._replay()
+
+    def _replay(self):
+        """Load un-acked updates from the journal and compact it"""
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue    # torn final line from a crash mid-append
+                    if 'ack' in record:
+                        for seq in record['ack']:
+                            entries.pop(seq, None)
+                    else:
+                        entries[record['seq']] = (record['doc'], record['fields'], record['ts'])
+                    self.next_seq = max(self.next_seq, record.get('seq', 0) + 1)
+        self.pending = entries
+        self.stats['replayed'] = len(entries)
+        if entries:
+            print(f"Write queue: replaying {len(entries)} pending updates")
+        self._compact()
+
+    def _count_dead_letters(self):
+        if not os.path.exists(self.dead_letter_path):
+            return 0
+        with open(self.dead_letter_path) as f:
+            return sum(1 for line in f if line.strip())
+
+    def _compact(self):
+        """Rewrite the journal with only the pending entries"""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for seq, (doc_path, fields, queued_at) in sorted(self.pending.items()):
+                f.write(json.dumps({'seq': seq, 'doc': doc_path, 'fields': fields, 'ts': queued_at}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if self.journal:
+            self.journal.close()
+        self.journal = open(self.path, 'a')
+
+    def _append(self, record):
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def enqueue(self, doc_path, fields):
+        """Durably queue a merge of fields into doc_path (e.g. 'users/2021001')"""
+        with self.cond:
+            seq = self.next_seq
+            self.next_seq += 1
+            queued_at = time.time()
+            self._append({'seq': seq, 'doc': doc_path, 'fields': fields, 'ts': queued_at})
+            self.pending[seq] = (doc_path, fields, queued_at)
+            self.stats['enqueued'] += 1
+            self.cond.notify()
+        return seq
+
+    def _take_batch(self):
+        """Oldest pending updates, coalesced per document: {doc_path: (seqs, fields)}"""
+        docs = {}
+        for seq in sorted(self.pending):
+            doc_path, fields, _ = self.pending[seq]
+            if doc_path not in docs and len(docs) >= self.batch_size:
+                break
+            seqs, merged = docs.setdefault(doc_path, ([], {}))
+            seqs.append(seq)
+            merged.update(fields)
+        return docs
+
+    def _commit(self, docs):
+        batch = self.db.batch()
+        for doc_path, (_, fields) in docs.items():
+            ref = self.db.document(doc_path)
+            if doc_path.startswith(UPDATE_ONLY):
+                batch.update(ref, fields)
+            else:
+                batch.set(ref, fields, merge=True)
+        with firestore_call('write_queue_commit'):
+            batch.commit()
+
+    def _commit_each(self, docs):
+        """Commit documents one at a time: (committed doc paths, {doc_path: error}).
+        Stops at the first transient error: the rest is left for the next attempt."""
+        committed, failed = [], {}
+        for doc_path, entry in docs.items():
+            try:
+                self._commit({doc_path: entry})
+            except Exception as e:
+                failed[doc_path] = e
+                if not _permanent(e):
+                    break
+            else:
+                committed.append(doc_path)
+        return committed, failed
+
+    def _dead_letter(self, doc_path, seqs, fields, error):
+        """Move a document's updates out of the queue into the dead-letter journal"""
+        with open(self.dead_letter_path, 'a') as f:
+            f.write(json.dumps({'doc': doc_path, 'fields': fields, 'seqs': seqs,
+                                'error': str(error), 'ts': time.time()}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.attempts.pop(doc_path, None)
+        self.stats['dead_letters'] += 1
+        print(f"Write queue: gave up on {doc_path} ({error}), kept in {self.dead_letter_path}")
+
+    def _acked(self, seqs):
+        self._append({'ack': seqs})
+        for seq in seqs:
+            self.pending.pop(seq, None)
+        if not self.pending:
+            self._compact()
+        self.cond.notify_all()
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running and not self.pending:
+                    return
+            if self.running and self.linger:
+                time.sleep(self.linger)  # let a burst of issuances share one batch
+
+            with self.cond:
+                docs = self._take_batch()
+            try:
+                self._commit(docs)
+                committed, failed = list(docs), {}
+            except Exception as e:
+                if len(docs) > 1 and _permanent(e):
+                    # Batches are atomic: find the documents at fault, commit the rest
+                    self.stats['split_batches'] += 1
+                    committed, failed = self._commit_each(docs)
+                else:
+                    committed, failed = [], {doc_path: e for doc_path in docs}
+
+            with self.cond:
+                done = []
+                for doc_path in committed:
+                    seqs, _ = docs[doc_path]
+                    done += seqs
+                    self.attempts.pop(doc_path, None)
+                    self.stats['committed'] += len(seqs)
+                    self.stats['coalesced'] += len(seqs) - 1
+                for doc_path, error in failed.items():
+                    if not _permanent(error):
+                        continue    # outage: retried with backoff for as long as it takes
+                    self.attempts[doc_path] = self.attempts.get(doc_path, 0) + 1
+                    if (_not_found(error) and doc_path.startswith(UPDATE_ONLY)) or \
+                            self.attempts[doc_path] >= self.max_attempts:
+                        seqs, fields = docs[doc_path]
+                        self._dead_letter(doc_path, seqs, fields, error)
+                        done += seqs
+                failed = {doc_path: error for doc_path, error in failed.items()
+                          if doc_path in self.attempts or not _permanent(error)}
+                if committed:
+                    self.stats['batches'] += 1
+                if done:
+                    self._acked(done)
+
+            if not failed:
+                backoff = 0.5
+                continue
+            error = next(iter(failed.values()))
+            self.stats['failures'] += 1
+            self.stats['last_error'] = str(error)
+            if done:
+                backoff = 0.5   # progress was made; what is left goes again shortly
+            delay = backoff * (0.5 + random.random())
+            print(f"Write queue: commit of {len(failed)} of {len(docs)} documents failed ({error}), "
+                  f"retrying in {delay:.1f} s")
+            with self.cond:
+                if not self.running:
+                    return      # still journaled; replayed on next start
+                self.cond.wait(delay)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed (or dead-lettered); False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            target = self.next_seq
+            while any(seq < target for seq in self.pending):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def status(self):
+        with self.cond:
+            oldest = min((queued_at for _, _, queued_at in self.pending.values()), default=None)
+            return dict(self.stats, pending=len(self.pending), dead_letter_path=self.dead_letter_path,
+                        oldest_pending_seconds=round(time.time() - oldest, 1) if oldest else 0)
+
+    def close(self, timeout=5):
+        """Stop after a final flush attempt; anything left stays journaled"""
+        self.flush(timeout)
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+        if self.journal:
+            self.journal.close()
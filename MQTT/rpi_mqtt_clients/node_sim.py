@@ -0,0 +1,70 @@
+# Simulated lab of access nodes publishing telemetry, for load-testing client_sub:
+#   python stand_in_broker.py --port 1884 &
+#   ./client_sub --port 1884 --db /tmp/telemetry.db &
+#   python node_sim.py --port 1884 --nodes 40 --rate 3000 --seconds 20
+#   python telemetry.py summary --db /tmp/telemetry.db
+# Each node is its own MQTT client and publishes card taps, machine on/off and timer
+# ticks on esp32/<node>/... (see telemetry.py) at QoS 0.
+import argparse
+import json
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+def node_message(node, rng):
+    """(topic, payload) of one plausible access node event"""
+    machine_id = node % 16 + 1
+    roll = rng.random()
+    if roll < 0.1:
+        card_id = rng.choice((3735928559, 305419896, 2882400001, 4023233417))
+        payload = {'card_id': str(card_id), 'machine_id': machine_id, 'granted': rng.random() < 0.9}
+        return f"esp32/node{node:02d}/tap", json.dumps(payload)
+    if roll < 0.2:
+        return f"esp32/node{node:02d}/machine", json.dumps({'machine_id': machine_id, 'state': rng.choice(('on', 'off'))})
+    return f"esp32/node{node:02d}/timer", json.dumps({'machine_id': machine_id, 'seconds': rng.randint(0, 7200)})
+
+def run_node(node, args, rate, stop, counts):
+    rng = random.Random(node)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, f"node_sim_{node:02d}")
+    client.connect(args.host, args.port, 60)
+    client.loop_start()
+    sent = 0
+    started = time.monotonic()
+    while not stop.is_set():
+        # Catch up to the target rate in small bursts rather than sleeping per message
+        due = int((time.monotonic() - started) * rate) - sent
+        for _ in range(due):
+            topic, payload = node_message(node, rng)
+            client.publish(topic, payload, qos=0)
+            sent += 1
+        time.sleep(0.01)
+    client.loop_stop()
+    client.disconnect()
+    counts[node] = sent
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated access nodes publishing telemetry")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--nodes', type=int, default=40)
+    parser.add_argument('--rate', type=float, default=2000, help="messages per second, all nodes together")
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    counts = {}
+    threads = [threading.Thread(target=run_node, args=(node, args, args.rate / args.nodes, stop, counts), daemon=True)
+               for node in range(1, args.nodes + 1)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join(10)
+    sent = sum(counts.values())
+    print(f"{args.nodes} nodes sent {sent} messages in {args.seconds:.1f} s ({sent / args.seconds:.0f} msg/s)")
+
+if __name__ == '__main__':
+    main()
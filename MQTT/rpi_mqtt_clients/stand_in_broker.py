@@ -0,0 +1,314 @@
+# Stand-in MQTT 3.1.1 broker for testing the clients without Mosquitto:
+#   python stand_in_broker.py                    (127.0.0.1:1883)
+#   python stand_in_broker.py --port 1884 --max-queued 1000
+# Speaks enough of the protocol for paho and PubSubClient: CONNECT, PUBLISH (QoS 0-2 in,
+# delivered at QoS 0), SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, retained messages,
+# PINGREQ, DISCONNECT and keepalive timeouts. No authentication, wills or persistence.
+# Like Mosquitto's max_queued_messages, each subscriber has a bounded outgoing queue;
+# messages for a subscriber that is not keeping up are dropped and counted.
+import argparse
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+class ProtocolError(Exception):
+    pass
+
+def _encode_length(length):
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+def _packet(first_byte, body=b''):
+    return bytes([first_byte]) + _encode_length(len(body)) + body
+
+def _string(data, offset):
+    (length,) = struct.unpack_from('!H', data, offset)
+    end = offset + 2 + length
+    if end > len(data):
+        raise ProtocolError("string runs past the packet")
+    return data[offset + 2:end], end
+
+def publish_packet(topic, payload, retain=False):
+    topic = topic.encode()
+    return _packet(0x30 | (1 if retain else 0), struct.pack('!H', len(topic)) + topic + payload)
+
+def topic_matches(topic_filter, topic):
+    """MQTT filter matching; wildcards at the first level do not match $ topics"""
+    if topic.startswith('$') and topic_filter[:1] in ('+', '#'):
+        return False
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+class Session:
+    def __init__(self, broker, sock, client_id, max_queued):
+        self.broker = broker
+        self.sock = sock
+        self.client_id = client_id
+        self.subscriptions = {}     # filter -> granted QoS
+        self.outgoing = queue.Queue(maxsize=max_queued)
+        self.dropped = 0
+        self.closed = threading.Event()
+        self.writer = threading.Thread(target=self._write, daemon=True, name=f'broker-out-{client_id}')
+        self.writer.start()
+
+    def send(self, packet, drop_if_full=False):
+        try:
+            if drop_if_full:
+                self.outgoing.put_nowait(packet)
+            else:
+                self.outgoing.put(packet, timeout=5)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _write(self):
+        while not self.closed.is_set():
+            try:
+                packets = [self.outgoing.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # Coalesce whatever is queued into one send
+            while len(packets) < 256:
+                try:
+                    packets.append(self.outgoing.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.sock.sendall(b''.join(packets))
+            except OSError:
+                self.close()
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class Broker:
+    def __init__(self, max_queued=1000):
+        self.max_queued = max_queued
+        self.lock = threading.Lock()
+        self.sessions = {}      # client ID -> Session
+        self.retained = {}      # topic -> payload
+        self.routes = {}        # topic -> [Session], cleared when subscriptions change
+        self.stats = {'connections': 0, 'received': 0, 'delivered': 0}
+        self.dropped_closed = 0    # dropped for sessions that are gone
+
+    def attach(self, session):
+        with self.lock:
+            old = self.sessions.get(session.client_id)
+            self.sessions[session.client_id] = session
+            self.routes.clear()
+            self.stats['connections'] += 1
+        if old is not None:
+            # Same client ID connecting again takes over, as in Mosquitto
+            old.close()
+
+    def detach(self, session):
+        with self.lock:
+            if self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+                self.routes.clear()
+                self.dropped_closed += session.dropped
+
+    def subscribe(self, session, filters):
+        with self.lock:
+            for topic_filter, qos in filters:
+                session.subscriptions[topic_filter] = qos
+            self.routes.clear()
+            retained = [(topic, payload) for topic, payload in self.retained.items()
+                        if any(topic_matches(f, topic) for f, _ in filters)]
+        for topic, payload in retained:
+            session.send(publish_packet(topic, payload, retain=True))
+
+    def unsubscribe(self, session, filters):
+        with self.lock:
+            for topic_filter in filters:
+                session.subscriptions.pop(topic_filter, None)
+            self.routes.clear()
+
+    def publish(self, topic, payload, retain=False):
+        with self.lock:
+            self.stats['received'] += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            targets = self.routes.get(topic)
+            if targets is None:
+                targets = self.routes[topic] = [
+                    session for session in self.sessions.values()
+                    if any(topic_matches(f, topic) for f in session.subscriptions)]
+        if not targets:
+            return
+        packet = publish_packet(topic, payload)
+        delivered = sum(1 for session in targets if session.send(packet, drop_if_full=True))
+        with self.lock:
+            self.stats['delivered'] += delivered
+
+    def status(self):
+        with self.lock:
+            dropped = self.dropped_closed + sum(session.dropped for session in self.sessions.values())
+            return dict(self.stats, clients=len(self.sessions), retained=len(self.retained), dropped=dropped)
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.request.makefile('rb', buffering=65536)
+
+    def _read_packet(self):
+        header = self.file.read(1)
+        if not header:
+            return None, None, None
+        length, multiplier = 0, 1
+        for _ in range(4):
+            byte = self.file.read(1)
+            if not byte:
+                return None, None, None
+            length += (byte[0] & 0x7F) * multiplier
+            if not byte[0] & 0x80:
+                break
+            multiplier *= 128
+        else:
+            raise ProtocolError("malformed remaining length")
+        body = self.file.read(length)
+        if len(body) != length:
+            return None, None, None
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    def _connect(self, body):
+        protocol, offset = _string(body, 0)
+        level, flags = body[offset], body[offset + 1]
+        (keepalive,) = struct.unpack_from('!H', body, offset + 2)
+        if protocol not in (b'MQTT', b'MQIsdp') or level not in (3, 4):
+            # Unacceptable protocol version
+            self.request.sendall(_packet(0x20, b'\x00\x01'))
+            return None, 0
+        client_id, offset = _string(body, offset + 4)
+        client_id = client_id.decode('utf-8', 'replace') or f'auto-{id(self):x}'
+        return client_id, keepalive
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            kind, _, body = self._read_packet()
+            if kind != CONNECT:
+                return
+            client_id, keepalive = self._connect(body)
+        except (OSError, ProtocolError, IndexError, struct.error):
+            return
+        if client_id is None:
+            return
+        if keepalive:
+            self.request.settimeout(keepalive * 1.5)
+        session = Session(broker, self.request, client_id, broker.max_queued)
+        broker.attach(session)
+        session.send(_packet(0x20, b'\x00\x00'))
+        try:
+            self._serve(broker, session)
+        except (OSError, ProtocolError, IndexError, struct.error):
+            pass
+        finally:
+            broker.detach(session)
+            session.close()
+
+    def _serve(self, broker, session):
+        while not session.closed.is_set():
+            kind, flags, body = self._read_packet()
+            if kind is None or kind == DISCONNECT:
+                return
+            if kind == PUBLISH:
+                qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+                topic, offset = _string(body, 0)
+                if qos:
+                    packet_id = body[offset:offset + 2]
+                    offset += 2
+                    session.send(_packet(0x40 if qos == 1 else 0x50, packet_id))
+                broker.publish(topic.decode('utf-8', 'replace'), body[offset:], retain)
+            elif kind == PUBREL:
+                session.send(_packet(0x70, body[:2]))
+            elif kind == SUBSCRIBE:
+                packet_id, offset, filters = body[:2], 2, []
+                while offset < len(body):
+                    topic_filter, offset = _string(body, offset)
+                    filters.append((topic_filter.decode('utf-8', 'replace'), body[offset]))
+                    offset += 1
+                # Everything is delivered at QoS 0
+                session.send(_packet(0x90, packet_id + bytes(len(filters))))
+                broker.subscribe(session, filters)
+            elif kind == UNSUBSCRIBE:
+                packet_id, offset, filters = body[:2], 2, []
+                while offset < len(body):
+                    topic_filter, offset = _string(body, offset)
+                    filters.append(topic_filter.decode('utf-8', 'replace'))
+                broker.unsubscribe(session, filters)
+                session.send(_packet(0xB0, packet_id))
+            elif kind == PINGREQ:
+                session.send(_packet(0xD0))
+            elif kind in (PUBACK, PUBREC, PUBCOMP):
+                pass    # nothing is sent above QoS 0
+            else:
+                raise ProtocolError(f"unexpected packet type {kind}")
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(host='127.0.0.1', port=1883, max_queued=1000):
+    """Start the broker in a background thread; returns (server, broker)"""
+    server = _Server((host, port), _Handler)
+    server.broker = Broker(max_queued)
+    threading.Thread(target=server.serve_forever, daemon=True, name='broker-accept').start()
+    return server, server.broker
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in MQTT broker for testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--max-queued', type=int, default=1000,
+                        help="outgoing messages queued per subscriber before dropping")
+    parser.add_argument('--stats-interval', type=float, default=10)
+    args = parser.parse_args()
+
+    server, broker = serve(args.host, args.port, args.max_queued)
+    print(f"Stand-in broker listening on {args.host}:{args.port}")
+    last = broker.status()
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            status = broker.status()
+            rate = (status['received'] - last['received']) / args.stats_interval
+            print(f"Broker: {status['clients']} clients, {rate:.0f} msg/s in, "
+                  f"{status['delivered']} delivered, {status['dropped']} dropped")
+            last = status
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
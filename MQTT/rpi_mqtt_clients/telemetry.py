@@ -0,0 +1,351 @@
+# Access node telemetry: message parsing, a bounded ingest queue and batched SQLite storage.
+# Used by client_sub; the paho network thread only calls Ingest.submit(), a writer thread
+# parses and stores. Topics (payload JSON, or the short text forms in parse_message):
+#   esp32/<node>/tap       {"card_id": "3735928559", "machine_id": 2, "granted": true}
+#   esp32/<node>/machine   {"machine_id": 2, "state": "on"}          or  on / off
+#   esp32/<node>/timer     {"machine_id": 2, "seconds": 754, "state": "stop"}  or  754
+#   esp32/<anything>       stored as 'raw' (e.g. esp32/sensor1 from the ESP32 example)
+#   rpi/broadcast          stored as 'broadcast'
+# A "ts" field (Unix seconds) in a JSON payload is used as the event time, otherwise the
+# time the message arrived. Summary of a database:
+#   python telemetry.py summary --db telemetry.db
+import argparse
+import collections
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id         INTEGER PRIMARY KEY,
+    ts         REAL NOT NULL,
+    received   REAL NOT NULL,
+    node       TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    card_id    TEXT,
+    machine_id INTEGER,
+    value      TEXT,
+    number     REAL,
+    topic      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_node_ts ON events (node, ts);
+CREATE INDEX IF NOT EXISTS events_card_ts ON events (card_id, ts) WHERE card_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS drops (
+    at     REAL NOT NULL,
+    reason TEXT NOT NULL,
+    node   TEXT NOT NULL,
+    count  INTEGER NOT NULL
+);
+"""
+
+INSERT = ("INSERT INTO events (ts, received, node, kind, card_id, machine_id, value, number, topic) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+OVERFLOW_POLICIES = ('drop', 'block')
+
+class MalformedMessage(ValueError):
+    """A node message that cannot be stored"""
+
+def _node(topic):
+    parts = topic.split('/', 2)
+    return parts[1] if len(parts) > 1 and parts[1] else parts[0]
+
+def _fields(payload):
+    """JSON object payload as a dict, the short text forms as their text"""
+    text = payload.decode('utf-8', 'replace').strip()
+    if text.startswith(('{', '[')):
+        try:
+            fields = json.loads(text)
+        except ValueError as e:
+            raise MalformedMessage(f"bad JSON: {e}")
+        if not isinstance(fields, dict):
+            raise MalformedMessage("JSON payload is not an object")
+        return fields
+    return text
+
+def _int(value):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise MalformedMessage(f"not an integer: {value!r}")
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise MalformedMessage(f"not a number: {value!r}")
+    if not math.isfinite(number):
+        raise MalformedMessage(f"not a finite number: {value!r}")
+    return number
+
+def _granted(value):
+    """True/False from a tap's granted field (true/false, 1/0, as JSON or text), None if absent"""
+    if value is None or value == '':
+        return None
+    text = str(value).strip().lower()
+    if text in ('true', '1'):
+        return True
+    if text in ('false', '0'):
+        return False
+    raise MalformedMessage(f"granted {value!r}")
+
+def parse_message(topic, payload, received):
+    """events row (ts, received, node, kind, card_id, machine_id, value, number, topic)
+    for one message. Raises MalformedMessage."""
+    parts = topic.split('/')
+    if parts[0] == 'rpi':
+        text = payload.decode('utf-8', 'replace')
+        return (received, received, 'rpi', parts[-1] or 'rpi', None, None, text, None, topic)
+    if parts[0] != 'esp32' or len(parts) < 2:
+        raise MalformedMessage(f"unexpected topic {topic}")
+
+    node = _node(topic)
+    kind = parts[2] if len(parts) == 3 else 'raw'
+    fields = _fields(payload)
+    card_id = machine_id = value = number = None
+    ts = received
+
+    if isinstance(fields, dict):
+        if 'ts' in fields:
+            ts = _number(fields['ts'])
+        card_id = fields.get('card_id')
+        card_id = None if card_id is None else str(card_id)
+        machine_id = _int(fields.get('machine_id'))
+
+    if kind == 'tap':
+        if isinstance(fields, dict):
+            granted = _granted(fields.get('granted'))
+        else:
+            # card_id[,granted] with granted as 1/0
+            card_id, _, granted = fields.partition(',')
+            card_id = card_id.strip()
+            if not card_id.isdigit():
+                raise MalformedMessage(f"card_id {card_id!r}")
+            granted = _granted(granted)
+        if not card_id:
+            raise MalformedMessage("tap without card_id")
+        value = None if granted is None else ('granted' if granted else 'denied')
+    elif kind == 'machine':
+        state = fields.get('state') if isinstance(fields, dict) else fields
+        value = str(state).lower()
+        if value not in ('on', 'off'):
+            raise MalformedMessage(f"machine state {state!r}")
+    elif kind == 'timer':
+        if isinstance(fields, dict):
+            value = fields.get('state')
+            if 'seconds' in fields:
+                number = _number(fields['seconds'])
+            elif value is None:
+                raise MalformedMessage("timer without seconds or state")
+        else:
+            number = _number(fields)
+    else:
+        kind = 'raw'
+        value = json.dumps(fields) if isinstance(fields, dict) else fields
+    return (ts, received, node, kind, card_id, machine_id, value, number, topic)
+
+class TelemetryStore:
+    """Append-only events table in SQLite (WAL); one transaction per batch"""
+
+    def __init__(self, path):
+        self.path = path
+        # Used from the writer thread only once the ingest is running
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def append(self, rows, drops=()):
+        """Store event rows and drop counts [(reason, node, count)] in one transaction"""
+        with self.conn:
+            self.conn.executemany(INSERT, rows)
+            if drops:
+                now = time.time()
+                self.conn.executemany("INSERT INTO drops (at, reason, node, count) VALUES (?, ?, ?, ?)",
+                                      [(now, reason, node, count) for reason, node, count in drops])
+
+    def close(self):
+        self.conn.close()
+
+class Ingest:
+    """Bounded queue between the MQTT network thread and a batching SQLite writer
+
+    submit() never parses or touches the database. When the queue is full the message
+    is dropped and counted (overflow='drop'), or submit() waits up to block_timeout
+    (overflow='block'): that stalls the network thread, so TCP flow control pushes back
+    on the broker, which then queues or drops by its own limits. The writer stores a
+    batch when it has batch_size messages or the oldest one has waited flush_interval.
+    Drop counts are printed with the stats and stored in the drops table.
+    """
+
+    def __init__(self, store, queue_size=20000, batch_size=500, flush_interval=0.5,
+                 overflow='drop', block_timeout=1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.store = store
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.lock = threading.Lock()
+        self.dropped = collections.Counter()    # (reason, node) -> messages
+        self.unsaved_drops = collections.Counter()
+        self.stats = {
+            'received': 0, 'stored': 0, 'batches': 0, 'store_retries': 0,
+            'max_depth': 0, 'last_batch': 0, 'last_flush_ms': 0.0,
+        }
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True, name='telemetry-writer')
+        self.thread.start()
+
+    def submit(self, topic, payload, received=None):
+        """Queue one message (network thread); False if it was dropped"""
+        item = (topic, payload, received or time.time())
+        try:
+            if self.overflow == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            self._drop('queue_full', _node(topic))
+            with self.lock:
+                self.stats['received'] += 1
+            return False
+        depth = self.queue.qsize()
+        with self.lock:
+            self.stats['received'] += 1
+            if depth > self.stats['max_depth']:
+                self.stats['max_depth'] = depth
+        return True
+
+    def _drop(self, reason, node, count=1):
+        with self.lock:
+            self.dropped[(reason, node)] += count
+            self.unsaved_drops[(reason, node)] += count
+
+    def _next_batch(self):
+        """Up to batch_size items, waiting at most flush_interval after the first one"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.stopping.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _rows(self, batch):
+        rows = []
+        for topic, payload, received in batch:
+            try:
+                rows.append(parse_message(topic, payload, received))
+            except MalformedMessage as e:
+                self._drop('malformed', _node(topic))
+                print(f"Telemetry: dropped {topic}: {e}")
+        return rows
+
+    def _flush(self, rows):
+        with self.lock:
+            drops = [(reason, node, count) for (reason, node), count in self.unsaved_drops.items()]
+            self.unsaved_drops.clear()
+        delay = 0.05
+        while True:
+            started = time.perf_counter()
+            try:
+                self.store.append(rows, drops)
+                break
+            except sqlite3.Error as e:
+                with self.lock:
+                    self.stats['store_retries'] += 1
+                if self.stopping.is_set():
+                    print(f"Telemetry: giving up on a batch of {len(rows)} at shutdown: {e}")
+                    self._drop('store_error', '*', len(rows))
+                    return
+                # Keep the batch; new messages back up in the queue meanwhile
+                print(f"Telemetry: store failed ({e}), retrying in {delay:.2f} s")
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        with self.lock:
+            self.stats['stored'] += len(rows)
+            self.stats['batches'] += 1
+            self.stats['last_batch'] = len(rows)
+            self.stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(self._rows(batch))
+            elif self.stopping.is_set():
+                break
+        with self.lock:
+            pending = bool(self.unsaved_drops)
+        if pending:
+            self._flush([])
+
+    def stop(self, timeout=10):
+        """Store what is queued and stop the writer"""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def status(self):
+        with self.lock:
+            dropped = collections.Counter()
+            for (reason, _), count in self.dropped.items():
+                dropped[reason] += count
+            return dict(self.stats, depth=self.queue.qsize(), capacity=self.queue.maxsize,
+                        overflow=self.overflow, dropped=dict(dropped))
+
+    def dropped_by_node(self):
+        with self.lock:
+            by_node = collections.Counter()
+            for (_, node), count in self.dropped.items():
+                by_node[node] += count
+            return dict(by_node)
+
+def summary(path):
+    conn = sqlite3.connect(path)
+    total, first, last = conn.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM events").fetchone()
+    print(f"{total} events" + (f" over {last - first:.1f} s" if total else ""))
+    print(f"{'node':>16} {'kind':>10} {'events':>9}")
+    for node, kind, count in conn.execute(
+            "SELECT node, kind, COUNT(*) FROM events GROUP BY node, kind ORDER BY node, kind"):
+        print(f"{node:>16} {kind:>10} {count:>9}")
+    drops = conn.execute("SELECT reason, node, SUM(count) FROM drops GROUP BY reason, node ORDER BY reason, node").fetchall()
+    print(f"{sum(row[2] for row in drops)} dropped")
+    for reason, node, count in drops:
+        print(f"{reason:>16} {node:>10} {count:>9}")
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Access node telemetry database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('summary', help="events per node and kind, drops per reason")
+    show.add_argument('--db', default='telemetry.db')
+    args = parser.parse_args()
+    summary(args.db)
+
+if __name__ == '__main__':
+    main()
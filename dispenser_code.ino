@@ -48,6 +48,8 @@ bool last_motor2_enable_signal = false;
 
 void setup() {
   Serial.begin(115200);
+  // Commands are newline-terminated; the timeout only matters for a host that omits the newline
+  Serial.setTimeout(50);
   
   // Initialize motor driver pins
   pinMode(MOTOR1_IN1, OUTPUT);
@@ -72,6 +74,7 @@ void setup() {
   Serial.println("Card Dispenser System Initialized");
   Serial.println("Send 'DISPENSE' to start dispensing a card");
   Serial.println("Connect GPIO 22 to GND to enable Motor 2 operation");
+  Serial.println("Or send 'EJECT' once the card is at sensor 1");
 }
 
 void loop() {
@@ -81,11 +84,17 @@ void loop() {
   
   // Check for serial commands
   if (Serial.available()) {
-    String command = Serial.readString();
+    // readString() would wait out the full serial timeout after every command
+    String command = Serial.readStringUntil('\n');
     command.trim();
     
     if (command.equals("DISPENSE") && currentState == IDLE) {
       startDispensing();
+    } else if (command.equals("EJECT") && currentState == WAITING_FOR_MOTOR2_ENABLE) {
+      // Same as the GPIO 22 enable signal, for a host that writes the card at sensor 1
+      Serial.println("Eject command received - Starting transport");
+      startMotor2();
+      currentState = TRANSPORTING_CARD;
     }
   }
   